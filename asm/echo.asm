@@ -0,0 +1,8 @@
+; Prints every key pressed. Waits for a key press by polling in a tight
+; loop, which the VM detects and sleeps through instead of spinning.
+
+start:
+    in
+    jb start
+    out
+    jmp start
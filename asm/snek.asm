@@ -9,6 +9,9 @@ MAX_Y = HEIGHT - 1
 INNER_WIDTH = WIDTH - 2
 INNER_HEIGHT = HEIGHT - 2
 
+; number of frames displayed between snake moves, at 60 frames/s
+FRAMES_PER_STEP = 10
+
 MAP = 0
 MAP_END = WIDTH * HEIGHT
 
@@ -52,6 +55,14 @@ start:
 main_loop:
     call handle_input
     call draw_board
+
+    ; flip waits for the next frame unless running headless; move the
+    ; snake every few frames to keep the game playable
+    movb.i2r c, FRAMES_PER_STEP
+main_loop_wait:
+    flip
+    loop main_loop_wait
+
     call snake_update
 
     jmp main_loop
@@ -95,14 +106,18 @@ handle_input_arrows:
 ; a - address
 ; b - fill
 ; c - size, bytes;
+; OUT:
+; a - address + size
+; c - 0
+; f - as set by cmp.b a, 0, or zero if size is 0
 memset:
+    memset a, b, c
     cmp.b c, 0
     je memset_exit
 
-memset_next:
-    stb.r a, b
-    add.b a, 1
-    loop memset_next
+    add.r a, c
+    movb.i2r c, 0
+    cmp.b a, 0
 
 memset_exit:
     ret
@@ -177,16 +192,9 @@ draw_board:
     seek a, b
 
     movb.i2r a, MAP
+    movw.i2r b, draw_board_char_table
     movw.i2r c, WIDTH * HEIGHT
-draw_board_char:
-    ldb.r b, a
-    add.w b, draw_board_char_table
-    push a
-     lpb.r a, b
-     out
-    pop a
-    add.b a, 1
-    loop draw_board_char
+    blit.x a, b, c
 
     ret
 
@@ -0,0 +1,19 @@
+; Tight arithmetic loop: register-only instructions, no memory accesses
+; and no calls.
+
+ITERATIONS = 200
+
+start:
+    movb.i2r a, 0
+    movb.i2r b, 1
+    movb.i2r c, ITERATIONS
+
+arith_next:
+    add.r a, b
+    mul.b a, 3
+    mod.b a, 251
+    add.b b, 7
+    and.b b, 127
+    loop arith_next
+
+    jmp start
@@ -0,0 +1,32 @@
+; Memory-heavy loop: copies SIZE bytes of RAM back and forth between two
+; buffers placed right after the code, so that it works with separate RAM
+; as well as with RAM mapped onto program memory.
+
+SIZE = 128
+SRC = buffers
+DST = buffers + SIZE
+
+start:
+    movw.i2r a, SRC
+    movb.i2r c, SIZE
+copy_forward_next:
+    ldb.r b, a
+    add.b b, 1
+    add.b a, SIZE
+    stb.r a, b
+    sub.b a, SIZE - 1
+    loop copy_forward_next
+
+    movw.i2r a, DST
+    movb.i2r c, SIZE
+copy_back_next:
+    ldb.r b, a
+    and.b b, 127
+    sub.b a, SIZE
+    stb.r a, b
+    add.b a, SIZE + 1
+    loop copy_back_next
+
+    jmp start
+
+buffers:
@@ -0,0 +1,30 @@
+; Call/ret-heavy recursion: naive recursive Fibonacci numbers.
+
+N = 12
+
+start:
+    movb.i2r a, N
+    call fib
+    jmp start
+
+; IN: a - n
+; OUT: a - fib(n)
+; clobbers b
+fib:
+    cmp.b a, 2
+    jb fib_ret
+
+    push a
+     sub.b a, 1
+     call fib
+     movw.r2r b, a
+    pop a
+
+    push b
+     sub.b a, 2
+     call fib
+    pop b
+    add.r a, b
+
+fib_ret:
+    ret
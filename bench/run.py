@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+End-to-end Evil VM benchmark.
+
+Runs every benchmark program in a separate `python3 -m evil --headless`
+process for each combination of machine configuration and execution engine,
+and reports instructions/s, wall time and peak RSS of each run.
+
+    python3 bench/run.py --output results.json
+    python3 bench/run.py --compare results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, NamedTuple, Optional, Set
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+class Program(NamedTuple):
+    name: str
+    source: str
+    halt_after_instructions: int
+    # extra arguments passed to the VM
+    args: List[str] = []
+    # combinations of --map-memory arguments the program does not work with,
+    # e.g. because it uses RAM starting at address 0
+    incompatible_mappings: List[Set[str]] = []
+
+    def supports_mapping(self, map_memory: str) -> bool:
+        mappings = set(map_memory.split())
+        return not any(m <= mappings for m in self.incompatible_mappings)
+
+
+PROGRAMS = [
+    Program(name='arith',
+            source=os.path.join(BENCH_DIR, 'programs', 'arith.asm'),
+            halt_after_instructions=500000),
+    Program(name='memcpy',
+            source=os.path.join(BENCH_DIR, 'programs', 'memcpy.asm'),
+            halt_after_instructions=500000),
+    Program(name='recursion',
+            source=os.path.join(BENCH_DIR, 'programs', 'recursion.asm'),
+            halt_after_instructions=500000,
+            # data and return stacks would overwrite each other
+            incompatible_mappings=[{'ram=program', 'stack=program'}]),
+    # without input, the snake goes right and hits the wall after 39 moves,
+    # about 5k instructions: boards are drawn with blit.x and flip does not
+    # wait for frames in headless mode, so this mostly measures startup and
+    # assembly of a real program
+    Program(name='snek',
+            source=os.path.join(REPO_DIR, 'asm', 'snek.asm'),
+            halt_after_instructions=10000,
+            incompatible_mappings=[{'ram=program'}]),
+]
+
+
+class Config(NamedTuple):
+    char_bit: int
+    word_size: int
+    addr_size: int
+    map_memory: str
+    engine: str
+
+    def vm_args(self) -> List[str]:
+        args = ['--char-bit', str(self.char_bit),
+                '--word-size', str(self.word_size),
+                '--addr-size', str(self.addr_size),
+                '--engine', self.engine]
+        if self.map_memory:
+            args += ['--map-memory'] + self.map_memory.split()
+        return args
+
+
+def run_once(program: Program,
+             config: Config,
+             ram_size: int,
+             stack_size: int,
+             program_size: int) -> dict:
+    """
+    Runs PROGRAM in a child process. Returns a dict with the measurements.
+    Raises RuntimeError if the VM fails.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stats_path = os.path.join(tmpdir, 'stats.json')
+        stderr_path = os.path.join(tmpdir, 'stderr')
+
+        cmd = ([sys.executable, '-m', 'evil', program.source,
+                '--headless',
+                '--halt-after-instructions', str(program.halt_after_instructions),
+                '--ram-size', str(ram_size),
+                '--stack-size', str(stack_size),
+                '--program-size', str(program_size),
+                '--stats-file', stats_path]
+               + config.vm_args()
+               + program.args)
+
+        with open(stderr_path, 'wb') as stderr:
+            start_time = time.time()
+            proc = subprocess.Popen(cmd,
+                                    cwd=REPO_DIR,
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=stderr)
+            # wait4 reports resource usage of this particular child only
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall_time_s = time.time() - start_time
+            proc.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                               else -os.WTERMSIG(status))
+
+        if proc.returncode != 0 or not os.path.exists(stats_path):
+            with open(stderr_path) as infile:
+                raise RuntimeError('%s failed with exit code %d:\n%s'
+                                   % (' '.join(cmd), proc.returncode, infile.read()))
+
+        with open(stats_path) as infile:
+            stats = json.load(infile)
+        with open(stderr_path) as infile:
+            errors = sum(1 for line in infile if line.startswith('ERROR:'))
+
+    return {
+        'instructions_executed': stats['instructions_executed'],
+        'exec_time_s': stats['elapsed_s'],
+        'instructions_per_s': stats['instructions_per_s'],
+        'wall_time_s': wall_time_s,
+        # Linux reports ru_maxrss in kilobytes, macOS in bytes
+        'peak_rss_kb': rusage.ru_maxrss // (1024 if sys.platform == 'darwin' else 1),
+        # faults logged by the VM; non-zero means the program misbehaved
+        'errors': errors,
+    }
+
+
+def run_benchmark(program: Program,
+                  config: Config,
+                  repeat: int,
+                  ram_size: int,
+                  stack_size: int,
+                  program_size: int) -> dict:
+    """ Runs PROGRAM REPEAT times and returns the fastest run """
+    runs = [run_once(program, config, ram_size, stack_size, program_size) for _ in range(repeat)]
+    result = max(runs, key=lambda r: r['instructions_per_s'])
+    result['peak_rss_kb'] = max(r['peak_rss_kb'] for r in runs)
+    result.update(program=program.name, config=config._asdict())
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict) -> tuple:
+    return (result['program'],) + tuple(sorted(result['config'].items()))
+
+
+def format_config(config: dict) -> str:
+    return 'b%(char_bit)d w%(word_size)d a%(addr_size)d %(engine)s %(map_memory)s' % config
+
+
+def print_result(result: dict, baseline: Optional[dict] = None):
+    line = ('%-10s %-45s %12.0f insn/s %8.3f s wall %8d KB'
+            % (result['program'], format_config(result['config']),
+               result['instructions_per_s'], result['wall_time_s'], result['peak_rss_kb']))
+    if baseline is not None:
+        line += '  %+6.1f%%' % (100.0 * (result['instructions_per_s'] / baseline['instructions_per_s'] - 1))
+    if result['errors']:
+        line += '  (%d errors)' % result['errors']
+    print(line)
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser('bench/run.py',
+                                     description='Measure Evil VM performance.')
+    parser.add_argument('-P', '--programs',
+                        nargs='+',
+                        choices=[p.name for p in PROGRAMS],
+                        default=[p.name for p in PROGRAMS],
+                        help='Benchmark programs to run. Default: all')
+    parser.add_argument('-b', '--char-bit',
+                        nargs='+',
+                        type=int,
+                        default=[9, 8],
+                        help='Numbers of bits per byte to test.')
+    parser.add_argument('-w', '--word-size',
+                        nargs='+',
+                        type=int,
+                        default=[7],
+                        help='Machine word sizes to test.')
+    parser.add_argument('-a', '--addr-size',
+                        nargs='+',
+                        type=int,
+                        default=[5],
+                        help='Address sizes to test.')
+    parser.add_argument('-m', '--map-memory',
+                        nargs='+',
+                        default=['', 'ram=program', 'stack=program', 'ram=program stack=program'],
+                        help='Memory mappings to test, each one a space-separated list of --map-memory arguments. Empty string means no mapping.')
+    parser.add_argument('-e', '--engine',
+                        nargs='+',
+                        default=['interpreter'],
+                        help='Execution engines to test.')
+    parser.add_argument('-n', '--repeat',
+                        type=int,
+                        default=1,
+                        help='Number of times to run each benchmark; the fastest run is reported.')
+    parser.add_argument('--ram-size',
+                        type=int,
+                        default=1024,
+                        help='RAM size, in machine words.')
+    parser.add_argument('--stack-size',
+                        type=int,
+                        default=64,
+                        help='Return stack size, in addresses.')
+    parser.add_argument('--program-size',
+                        type=int,
+                        default=8192,
+                        help='Program memory size, in bytes.')
+    parser.add_argument('-o', '--output',
+                        default=None,
+                        help='Save results to OUTPUT, as JSON.')
+    parser.add_argument('-c', '--compare',
+                        default=None,
+                        help='JSON results of a previous run to compare against.')
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baselines = {result_key(r): r for r in json.load(infile)['results']}
+
+    configs = [Config(*c) for c in itertools.product(args.char_bit,
+                                                     args.word_size,
+                                                     args.addr_size,
+                                                     args.map_memory,
+                                                     args.engine)]
+    results = []
+    for program in PROGRAMS:
+        if program.name not in args.programs:
+            continue
+
+        for config in configs:
+            if not program.supports_mapping(config.map_memory):
+                continue
+
+            result = run_benchmark(program, config,
+                                   repeat=args.repeat,
+                                   ram_size=args.ram_size,
+                                   stack_size=args.stack_size,
+                                   program_size=args.program_size)
+            print_result(result, baselines.get(result_key(result)))
+            results.append(result)
+
+    if args.output is not None:
+        with open(args.output, 'w') as outfile:
+            json.dump({'revision': git_revision(),
+                       'python': platform.python_version(),
+                       'timestamp': time.time(),
+                       'results': results}, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
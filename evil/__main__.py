@@ -5,26 +5,36 @@ import logging
 import sys
 import os
 import argparse
+import functools
+import codecs
+import json
+from typing import TextIO
 
 from evil.cpu import CPU
-from evil.memory import Memory, StrictlyAlignedMemory, DataType
-from evil.assembler import Assembler
-from evil.input import Input
+from evil.machine import MachineConfig, ENGINES
+from evil.input import Input, ScriptedInput
+from evil.gpu import NullGPU, ThreadedGPU, FrameScheduler
+from evil.trace import Tracer, TracingInterpreter
+from evil.profiler import Profile, ProfilingInterpreter
+from evil.fusion import FusionStats, FusingInterpreter
+from evil import snapshot
+from evil.replay import Recording, RecordingInput, RecordingRandom, ReplayInput, ReplayRandom
 
 logging.basicConfig(level=os.environ.get('LOGLEVEL', 'INFO'))
 
-MEMORY_BLOCKS = {}
-
 parser = argparse.ArgumentParser('evilvm', description='''
 Run a program within the Evil VM.
 
+To run many programs in parallel, see: python3 -m evil batch --help
+To run many instances of a program in lockstep, see: python3 -m evil lockstep --help
+
 Recognized environment variables:
 - LOGLEVEL - log level to use. Default is INFO; DEBUG may print some interesting stuff.
 ''', formatter_class=argparse.RawDescriptionHelpFormatter)
 parser.add_argument(dest='source',
-                    nargs=1,
+                    nargs='?',
                     default='/dev/stdin',
-                    help='Assembly source file to load and execute')
+                    help='Assembly source file to load and execute. Ignored if --load-snapshot is used.')
 parser.add_argument('-p', '--program-size',
                     default=None,
                     type=int,
@@ -33,15 +43,27 @@ parser.add_argument('-r', '--ram-size',
                     default=8,
                     type=int,
                     help='Size, in machine-words, of the RAM address space')
+parser.add_argument('--ram-file',
+                    default=None,
+                    help='Map RAM onto this file instead of process memory. The file is created if needed, keeps RAM contents across runs and can be inspected by other processes while the VM runs. Every byte takes 1, 2, 4 or 8 octets of the file, in native byte order, depending on --char-bit.')
+parser.add_argument('--paged-ram',
+                    action='store_true',
+                    help='Allocate RAM in pages on first write. Untouched RAM reads as zeros and takes no host memory, so --ram-size may be huge as long as the program uses little of it, e.g. a heap at the bottom and data stack at the top. Cannot be combined with --ram-file or --save-snapshot.')
 parser.add_argument('-s', '--stack-size',
                     default=8,
-                    type=str,
+                    type=int,
                     help='Size, in address-words, of the return stack address space')
 parser.add_argument('-m', '--map-memory',
                     nargs='+',
                     type=str,
                     default=[],
                     help='Remap address spaces. E.g. ram=program will cause RAM to use program address space. Available: program, ram, stack')
+parser.add_argument('--map-framebuffer',
+                    dest='framebuffer_addr',
+                    type=int,
+                    default=None,
+                    metavar='ADDR',
+                    help='Map the GPU framebuffer into RAM at address ADDR, one byte per character, row by row. Bytes stored there are displayed without using out/seek.')
 parser.add_argument('-b', '--char-bit',
                     type=int,
                     default=9,
@@ -66,43 +88,240 @@ parser.add_argument('-H', '--halt-after-instructions',
                     type=int,
                     default=None,
                     help='Halts VM after executing specific number of instructions.')
+parser.add_argument('-e', '--engine',
+                    choices=sorted(ENGINES),
+                    default='interpreter',
+                    help='Execution engine to use. "blocks" compiles basic blocks of the program into Python functions. '
+                         '"fused" interprets the program, executing common sequences of instructions as superinstructions.')
+parser.add_argument('--no-idle-wait',
+                    dest='idle_wait',
+                    action='store_false',
+                    help='Keep executing busy-wait loops polling for input at full speed, instead of sleeping until a key is pressed or the next frame is due.')
+parser.add_argument('--fusion-stats',
+                    action='store_true',
+                    help='Print a report of executed superinstructions to stderr. Requires --engine fused.')
+parser.add_argument('--frame-check-interval',
+                    type=int,
+                    default=1000,
+                    help='Number of instructions executed between checks whether a new frame should be displayed.')
+parser.add_argument('--clock-hz',
+                    type=float,
+                    default=None,
+                    help='Emulated CPU clock rate, in instructions per second. If set, frames are displayed every CLOCK_HZ / 60 instructions and execution is throttled to that rate.')
+parser.add_argument('-t', '--trace',
+                    type=int,
+                    default=None,
+                    metavar='N',
+                    help='Record last N executed instructions and save them to TRACE_FILE on exit. Render the trace with: python3 -m evil.trace TRACE_FILE')
+parser.add_argument('--trace-file',
+                    default='evil.trace',
+                    help='File to save the execution trace to. Default: evil.trace')
+parser.add_argument('--profile',
+                    action='store_true',
+                    help='Count executions and execution time of every instruction and report them on exit.')
+parser.add_argument('--profile-format',
+                    choices=['table', 'json', 'pstats'],
+                    default='table',
+                    help='Profile output format. "pstats" files can be inspected with: python3 -m pstats PROFILE_FILE. Default: table')
+parser.add_argument('--profile-file',
+                    default=None,
+                    help='File to save the profile to. By default, it is printed to stdout; required for pstats format.')
+parser.add_argument('--profile-limit',
+                    type=int,
+                    default=20,
+                    help='Number of most time-consuming instruction addresses to include in the table. Default: 20')
+parser.add_argument('--headless',
+                    action='store_true',
+                    help='Do not display anything while the program runs. The flip instruction does not wait for the next frame, so programs run as fast as possible. Unless --input-file or --input-string is given, the program receives no input, so no terminal is required.')
+parser.add_argument('--input-file',
+                    default=None,
+                    help='Feed contents of INPUT_FILE to the program instead of reading the keyboard.')
+parser.add_argument('--input-string',
+                    default=None,
+                    help='Feed INPUT_STRING to the program instead of reading the keyboard. Python-style escape sequences, e.g. \\x1b, are recognized.')
+parser.add_argument('--dump-screen',
+                    action='store_true',
+                    help='Print final screen contents once the program finishes.')
+parser.add_argument('--save-snapshot',
+                    default=None,
+                    metavar='SNAPSHOT_FILE',
+                    help='Save machine state to SNAPSHOT_FILE once execution stops, e.g. after --halt-after-instructions.')
+parser.add_argument('--load-snapshot',
+                    default=None,
+                    metavar='SNAPSHOT_FILE',
+                    help='Resume execution from machine state saved with --save-snapshot. Machine configuration options are ignored; the saved one is used instead.')
+parser.add_argument('--record',
+                    default=None,
+                    metavar='RECORDING_FILE',
+                    help='Record every key press and random number consumed by the program to RECORDING_FILE.')
+parser.add_argument('--replay',
+                    default=None,
+                    metavar='RECORDING_FILE',
+                    help='Feed key presses and random numbers from RECORDING_FILE to the program, at the same instructions they were recorded. Unless --halt-after-instructions is given, stops after the number of instructions executed by the recorded run.')
+parser.add_argument('--stats-file',
+                    default=None,
+                    help='Write execution statistics to STATS_FILE, as JSON.')
 
-args = parser.parse_args()
 
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'batch':
+        from evil import batch
+        return batch.main(argv[1:])
+    if argv and argv[0] == 'lockstep':
+        from evil import lockstep
+        return lockstep.main(argv[1:])
 
-DataType._TYPES['w'] = DataType(name='w',
-                                size_bytes=args.word_size,
-                                alignment=(args.word_alignment or args.word_size))
-DataType._TYPES['a'] = DataType(name='a',
-                                size_bytes=args.addr_size,
-                                alignment=(args.addr_alignment or args.addr_size))
+    args = parser.parse_args(argv)
 
-with open(args.source[0]) as infile:
-    asm = Assembler(char_bit=args.char_bit)
-    if args.program_size is None:
-        MEMORY_BLOCKS['program'] = asm.assemble_to_memory(infile.read())
+    if args.trace is not None and args.engine != 'interpreter':
+        parser.error('--trace is only supported by the interpreter engine')
+    if args.profile and args.engine != 'interpreter':
+        parser.error('--profile is only supported by the interpreter engine')
+    if args.profile and args.trace is not None:
+        parser.error('--profile and --trace are mutually exclusive')
+    if args.profile and args.profile_format == 'pstats' and args.profile_file is None:
+        parser.error('--profile-format pstats requires --profile-file')
+    if args.fusion_stats and args.engine != 'fused':
+        parser.error('--fusion-stats requires --engine fused')
+    if args.input_file is not None and args.input_string is not None:
+        parser.error('--input-file and --input-string are mutually exclusive')
+    if args.replay is not None and (args.input_file is not None or args.input_string is not None):
+        parser.error('--replay cannot be used with --input-file or --input-string')
+    if args.replay is not None and args.record is not None:
+        parser.error('--record and --replay are mutually exclusive')
+    if args.paged_ram and args.ram_file is not None:
+        parser.error('--paged-ram and --ram-file are mutually exclusive')
+    if args.paged_ram and args.save_snapshot is not None:
+        parser.error('--paged-ram cannot be used with --save-snapshot')
+
+    gpu_type = NullGPU if args.headless else ThreadedGPU
+    cpu = CPU()
+
+    if args.load_snapshot is not None:
+        saved = snapshot.load(args.load_snapshot, gpu_factory=gpu_type)
+        config = saved.config
+        memory_blocks = saved.memory_blocks
+        gpu = saved.gpu
+        cpu.regs[:] = saved.registers
+        if saved.rng_state is not None:
+            cpu.rng.setstate(saved.rng_state)
+    else:
+        config = MachineConfig(char_bit=args.char_bit,
+                               word_size=args.word_size,
+                               word_alignment=args.word_alignment,
+                               addr_size=args.addr_size,
+                               addr_alignment=args.addr_alignment,
+                               program_size=args.program_size,
+                               ram_size=args.ram_size,
+                               stack_size=args.stack_size,
+                               map_memory=args.map_memory,
+                               framebuffer_addr=args.framebuffer_addr,
+                               ram_file=args.ram_file,
+                               paged_ram=args.paged_ram)
+        with open(args.source) as infile:
+            memory_blocks = config.create_memory_blocks(infile.read())
+        gpu = gpu_type(width=80, height=24)
+
+    try:
+        config.map_framebuffer(memory_blocks, gpu)
+    except ValueError as err:
+        parser.error(str(err))
+
+    engine = ENGINES[args.engine]
+    tracer = None
+    if args.trace is not None:
+        tracer = Tracer(args.trace)
+        engine = functools.partial(TracingInterpreter, tracer=tracer)
+    fusion_stats = None
+    if args.fusion_stats:
+        fusion_stats = FusionStats()
+        engine = functools.partial(FusingInterpreter, stats=fusion_stats)
+    profile = None
+    if args.profile:
+        profile = Profile()
+        engine = functools.partial(ProfilingInterpreter, profile=profile)
+
+    halt_after_instructions = args.halt_after_instructions
+    recording = None
+
+    if args.replay is not None:
+        replayed = Recording.load(args.replay)
+        input = ReplayInput(cpu, replayed)
+        cpu.rng = ReplayRandom(cpu, replayed)
+        if halt_after_instructions is None:
+            halt_after_instructions = replayed.instructions_executed
+    elif args.input_file is not None:
+        input = ScriptedInput.from_file(args.input_file)
+    elif args.input_string is not None:
+        input = ScriptedInput(codecs.decode(args.input_string, 'unicode_escape').encode('latin-1'))
+    elif args.headless:
+        input = ScriptedInput()
     else:
-        MEMORY_BLOCKS['program'] = Memory(char_bit=args.char_bit,
-                                          value=asm.assemble(infile.read()),
-                                          size=args.program_size)
-
-MEMORY_BLOCKS['ram'] = StrictlyAlignedMemory(char_bit=args.char_bit, size=DataType.calcsize('w') * args.ram_size)
-MEMORY_BLOCKS['stack'] = StrictlyAlignedMemory(char_bit=args.char_bit, size=DataType.calcsize('a') * args.stack_size)
-
-for mapping in args.map_memory:
-    dst, src = mapping.split('=', maxsplit=1)
-    if src not in MEMORY_BLOCKS or dst not in MEMORY_BLOCKS:
-        raise ValueError('invalid memory mapping: %s' % mapping)
-
-    MEMORY_BLOCKS[dst] = MEMORY_BLOCKS[src]
-
-try:
-    with Input() as input:
-        cpu = CPU()
-        cpu.execute(program=MEMORY_BLOCKS['program'],
-                    ram=MEMORY_BLOCKS['ram'],
-                    stack=MEMORY_BLOCKS['stack'],
-                    input=input,
-                    halt_after_instructions=args.halt_after_instructions)
-finally:
-    logging.debug(cpu)
+        input = Input()
+
+    if args.record is not None:
+        recording = Recording()
+        input = RecordingInput(input, cpu, recording)
+        cpu.rng = RecordingRandom(cpu.rng, cpu, recording)
+
+    try:
+        with input:
+            stats = cpu.execute(program=memory_blocks['program'],
+                                ram=memory_blocks['ram'],
+                                stack=memory_blocks['stack'],
+                                input=input,
+                                halt_after_instructions=halt_after_instructions,
+                                engine=engine,
+                                frame_scheduler=functools.partial(FrameScheduler,
+                                                                  check_interval=args.frame_check_interval,
+                                                                  clock_hz=args.clock_hz,
+                                                                  vsync=not args.headless),
+                                gpu=gpu,
+                                resume=(args.load_snapshot is not None),
+                                idle_wait=args.idle_wait)
+    finally:
+        gpu.close()
+        if tracer is not None:
+            tracer.save(args.trace_file, char_bit=config.char_bit)
+        if recording is not None:
+            recording.instructions_executed = cpu.instructions_executed
+            recording.save(args.record)
+        logging.debug(cpu)
+
+    if args.save_snapshot is not None:
+        snapshot.save(args.save_snapshot, cpu, config, memory_blocks)
+
+    if args.dump_screen:
+        sys.stdout.write(cpu.gpu.dump())
+
+    if fusion_stats is not None:
+        sys.stderr.write(fusion_stats.format_table())
+
+    if profile is not None:
+        if args.profile_format == 'pstats':
+            profile.dump_stats(args.profile_file, program_name=args.source)
+        elif args.profile_file is not None:
+            with open(args.profile_file, 'w') as outfile:
+                write_profile(profile, outfile, args.profile_format, args.profile_limit)
+        else:
+            write_profile(profile, sys.stdout, args.profile_format, args.profile_limit)
+
+    if args.stats_file is not None:
+        with open(args.stats_file, 'w') as outfile:
+            json.dump({'instructions_executed': stats.instructions_executed,
+                       'elapsed_s': stats.elapsed_s,
+                       'instructions_per_s': stats.instructions_per_s,
+                       'exit_reason': stats.exit_reason.value}, outfile)
+
+
+def write_profile(profile: Profile, outfile: TextIO, fmt: str, limit: int):
+    if fmt == 'json':
+        profile.write_json(outfile)
+    else:
+        outfile.write(profile.format_table(limit=limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -229,7 +229,7 @@ class Assembler:
             try:
                 self._append_statement(instr, Statement.parse(instr))
             except Exception as err:
-                raise SyntaxError('Error while parsing line %d (%s)' % (lineno, instr))
+                raise SyntaxError('Error while parsing line %d (%s): %s' % (lineno, instr, err)) from err
 
         mem = self._compile()
         self._log_source()
@@ -0,0 +1,214 @@
+"""
+Runs many headless jobs in parallel, using a pool of worker processes.
+
+    python3 -m evil batch MANIFEST [--jobs N] [--output RESULTS]
+
+MANIFEST contains one JSON object per line, each describing a single job:
+
+    {"id": "snek-up",
+     "source": "asm/snek.asm",
+     "config": {"char_bit": 9, "ram_size": 1024, "map_memory": ["stack=program"]},
+     "input": "\\u001b[A",
+     "halt_after_instructions": 200000,
+     "timeout_s": 10,
+     "engine": "blocks",
+     "seed": 42}
+
+Only "source" is required. "config" keys are MachineConfig fields. "input"
+is fed to the program as if typed on the keyboard; each character must fit
+in a single byte. Alternatively, "input_file" names a file to read input
+from. "seed" initializes the random number generator used by the rand
+instruction, making runs reproducible. Relative paths are resolved against
+the manifest directory.
+
+For every job, a JSON object is written as a single line, in manifest order:
+
+    {"id": "snek-up", "source": "asm/snek.asm", "exit_reason": "halted",
+     "instructions_executed": 160913, "elapsed_s": 0.52,
+     "registers": {"IP": 542, ...}, "screen_sha256": "..."}
+
+exit_reason is one of: halted, instruction_limit, interrupted, timeout,
+error. Jobs that failed also have an "error" message.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Iterator, NamedTuple, Optional
+
+from evil.cpu import CPU, Register
+from evil.gpu import NullGPU
+from evil.input import ScriptedInput
+from evil.machine import MachineConfig, ENGINES
+
+
+class Job(NamedTuple):
+    id: str
+    source: str
+    config: MachineConfig = MachineConfig()
+    input: bytes = b''
+    halt_after_instructions: Optional[int] = None
+    timeout_s: Optional[float] = None
+    engine: str = 'interpreter'
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_json(cls, obj: dict, base_dir: str, default_id: str) -> 'Job':
+        """
+        Creates a Job from a decoded manifest line. Raises ValueError if
+        the job description is invalid.
+        """
+        obj = dict(obj)
+        try:
+            source = os.path.join(base_dir, obj.pop('source'))
+        except KeyError as err:
+            raise ValueError('job %s: missing "source"' % default_id) from err
+
+        job_id = str(obj.pop('id', default_id))
+
+        config = obj.pop('config', {})
+        unknown = set(config) - set(MachineConfig._fields)
+        if unknown:
+            raise ValueError('job %s: unknown config keys: %s' % (job_id, ', '.join(sorted(unknown))))
+
+        if 'input' in obj and 'input_file' in obj:
+            raise ValueError('job %s: "input" and "input_file" are mutually exclusive' % job_id)
+        if 'input_file' in obj:
+            with open(os.path.join(base_dir, obj.pop('input_file')), 'rb') as infile:
+                input_data = infile.read()
+        else:
+            try:
+                input_data = obj.pop('input', '').encode('latin-1')
+            except UnicodeEncodeError as err:
+                raise ValueError('job %s: "input" characters must fit in a single byte: %r'
+                                 % (job_id, err.object[err.start:err.end])) from err
+
+        engine = obj.pop('engine', 'interpreter')
+        if engine not in ENGINES:
+            raise ValueError('job %s: unknown engine: %s' % (job_id, engine))
+
+        job = cls(id=job_id,
+                  source=source,
+                  config=MachineConfig(**config),
+                  input=input_data,
+                  halt_after_instructions=obj.pop('halt_after_instructions', None),
+                  timeout_s=obj.pop('timeout_s', None),
+                  engine=engine,
+                  seed=obj.pop('seed', None))
+        if obj:
+            raise ValueError('job %s: unknown keys: %s' % (job_id, ', '.join(sorted(obj))))
+        return job
+
+
+def read_manifest(path: str) -> Iterator[Job]:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as infile:
+        for line_no, line in enumerate(infile, start=1):
+            if not line.strip():
+                continue
+            yield Job.from_json(json.loads(line), base_dir, default_id='%s:%d' % (path, line_no))
+
+
+class JobTimeout(Exception):
+    """ Raised when a job exceeds its wall-clock timeout """
+    pass
+
+
+def _raise_timeout(_signum, _frame):
+    raise JobTimeout()
+
+
+def run_job(job: Job) -> dict:
+    """
+    Runs JOB in the current process and returns the result, as a dict
+    ready to be serialized to JSON.
+    """
+    result = {'id': job.id, 'source': job.source}
+    start_time = time.time()
+
+    try:
+        with open(job.source) as infile:
+            memory_blocks = job.config.create_memory_blocks(infile.read())
+    except Exception as err:
+        result.update(exit_reason='error', error='%s: %s' % (type(err).__name__, err))
+        return result
+
+    cpu = CPU()
+    if job.seed is not None:
+        cpu.rng.seed(job.seed)
+    gpu = NullGPU(width=80, height=24)
+
+    if job.timeout_s is not None:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, job.timeout_s)
+
+    try:
+        job.config.map_framebuffer(memory_blocks, gpu)
+        stats = cpu.execute(program=memory_blocks['program'],
+                            ram=memory_blocks['ram'],
+                            stack=memory_blocks['stack'],
+                            input=ScriptedInput(job.input),
+                            halt_after_instructions=job.halt_after_instructions,
+                            engine=ENGINES[job.engine],
+                            gpu=gpu)
+        exit_reason = stats.exit_reason.value
+    except JobTimeout:
+        exit_reason = 'timeout'
+    except Exception as err:
+        exit_reason = 'error'
+        result['error'] = '%s: %s' % (type(err).__name__, err)
+    finally:
+        if job.timeout_s is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        gpu.close()
+
+    result.update(exit_reason=exit_reason,
+                  instructions_executed=cpu.instructions_executed,
+                  elapsed_s=time.time() - start_time,
+                  registers={reg.name: cpu.regs[reg.value] for reg in Register.all()},
+                  screen_sha256=hashlib.sha256(gpu.dump().encode('utf-8')).hexdigest())
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser('evil batch',
+                                     description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(dest='manifest',
+                        help='Job manifest file')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of worker processes. Default: number of CPUs')
+    parser.add_argument('-o', '--output',
+                        default=None,
+                        help='File to write results to. Default: stdout')
+    args = parser.parse_args(argv)
+
+    # per-job instructions/s messages would drown everything else
+    logging.getLogger().setLevel(os.environ.get('LOGLEVEL', 'WARNING'))
+
+    try:
+        jobs = list(read_manifest(args.manifest))
+    except ValueError as err:
+        parser.error(str(err))
+
+    outfile = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with multiprocessing.Pool(processes=args.jobs) as pool:
+            for result in pool.imap(run_job, jobs):
+                outfile.write(json.dumps(result) + '\n')
+                outfile.flush()
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    main()
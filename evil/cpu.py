@@ -5,9 +5,9 @@ import random
 from typing import List, Any, NamedTuple, Callable, Optional
 import sys
 
-from evil.endianness import Endianness, bytes_from_value, value_from_bytes
+from evil.endianness import Endianness, bytes_from_value, value_from_bytes, values_from_bytes
 from evil.memory import Memory, DataType
-from evil.gpu import GPU
+from evil.gpu import GPU, FrameScheduler
 from evil.fault import Fault
 from evil.utils import make_bytes_dump
 from evil.input import Input
@@ -39,43 +39,64 @@ class Flag(enum.IntFlag):
     Greater = enum.auto()
 
 
+# Indices of registers in a register file, equal to their encoded numbers
+REG_IP = Register.IP.value
+REG_SP = Register.SP.value
+REG_RP = Register.RP.value
+REG_A = Register.A.value
+REG_B = Register.B.value
+REG_C = Register.C.value
+REG_F = Register.F.value
+
+FLAG_ZERO = int(Flag.Zero)
+FLAG_GREATER = int(Flag.Greater)
+
+
+def make_register_file() -> List[int]:
+    """
+    Returns a list of register values, indexed directly by encoded register
+    numbers. Index 0 does not correspond to any register and is never used.
+    """
+    return [0] * (len(Register) + 1)
+
+
 class RegisterSet:
-    """ Helper class that provides easy register access """
-    def __init__(self):
-        self.reset()
+    """
+    Helper class that provides easy register access.
+
+    This is just a debugging view of a register file created by
+    make_register_file; operations access the register file directly.
+    """
+    def __init__(self, values: List[int] = None):
+        super().__setattr__('_values', make_register_file() if values is None else values)
 
     def reset(self):
         """ Resets value of all registers """
-        self._registers = {r: 0 for r in Register.all()}
+        self._values[:] = make_register_file()
 
     def __getitem__(self, reg: Register) -> int:
         try:
-            return self._registers.get(reg)
-        except KeyError as err:
+            return self._values[reg.value]
+        except AttributeError as err:
             raise KeyError('unknown register: %s' % reg) from err
 
     def __setitem__(self, reg: Register, val: int):
-        assert reg in self._registers
         try:
-            self._registers[reg] = val
-        except KeyError as err:
+            self._values[reg.value] = val
+        except AttributeError as err:
             raise KeyError('unknown register: %s' % reg) from err
 
     def __getattr__(self, name: str) -> int:
-        return self.__getitem__(Register.by_name(name))
+        try:
+            return self.__getitem__(Register.by_name(name))
+        except KeyError as err:
+            raise AttributeError(name) from err
 
     def __setattr__(self, name: str, val: int):
-        try:
-            return self.__setitem__(Register.by_name(name), val)
-        except KeyError:
-            try:
-                return super().__setattr__(name, val)
-            except KeyError:
-                pass
-            raise
+        return self.__setitem__(Register.by_name(name), val)
 
     def __str__(self) -> str:
-        return '\n'.join('%s = %d (%x)' % (n, v, v) for n, v in self._registers.items())
+        return '\n'.join('%s = %d (%x)' % (r, self[r], self[r]) for r in Register.all())
 
 
 class Operation:
@@ -113,7 +134,11 @@ class Operation:
     def decode_args(self,
                     memory: Memory,
                     addr: int) -> List[Any]:
-        return memory.get_fmt_multiple(self.arg_def, addr, self.args_endianness)
+        args = memory.get_fmt_multiple(self.arg_def, addr, self.args_endianness)
+        for fmt_c, arg in zip(self.arg_def, args):
+            if fmt_c == 'r' and not 0 < arg <= len(Register):
+                raise InvalidRegisterFault('invalid register: %d at address %08x' % (arg, addr))
+        return args
 
     def run(self, cpu: 'CPU', *args, **kwargs):
         """ Executes the wrapped operation """
@@ -124,6 +149,32 @@ class Operation:
         self.mnemonic = wrapped.__name__.lstrip('_').replace('_', '.')
         return self
 
+class DecodedInstruction(NamedTuple):
+    """ Operation fetched from program memory along with its arguments """
+    operation: Operation
+    args: List[Any]
+    next_ip: int
+
+
+class ExitReason(enum.Enum):
+    """ Why CPU.execute() returned """
+    HALTED = 'halted'                       # program executed halt
+    INSTRUCTION_LIMIT = 'instruction_limit' # halt_after_instructions reached
+    INTERRUPTED = 'interrupted'             # KeyboardInterrupt
+
+
+class ExecutionStats(NamedTuple):
+    """ Summary of a single CPU.execute() call """
+    instructions_executed: int
+    # time spent executing instructions, in seconds
+    elapsed_s: float
+    exit_reason: ExitReason
+
+    @property
+    def instructions_per_s(self) -> float:
+        return self.instructions_executed / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+
 class HaltRequested(Exception):
     """ Thrown to halt CPU execution """
     pass
@@ -138,8 +189,8 @@ class Operations:
 
         dst = src
         """
-        cpu.registers[Register(dst_reg)] = cpu.registers[Register(src_reg)]
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        cpu.regs[dst_reg] = cpu.regs[src_reg]
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rb')
     def movb_i2r(cpu: 'CPU', reg: int, immb: int):
@@ -148,8 +199,8 @@ class Operations:
 
         dst = IMM_BYTE
         """
-        cpu.registers[Register(reg)] = immb
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] = immb
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='ra')
     def movb_m2r(cpu: 'CPU', reg: int, addr: int):
@@ -158,8 +209,8 @@ class Operations:
 
         dst = byte ptr $RAM[IMM_ADDR]
         """
-        cpu.registers[Register(reg)] = cpu.ram.get_fmt('b', addr)
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] = cpu.ram.get_fmt('b', addr)
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='ar')
     def movb_r2m(cpu: 'CPU', addr: int, reg: int):
@@ -168,7 +219,7 @@ class Operations:
 
         byte ptr $RAM[IMM_ADDR] = src
         """
-        cpu.ram.set_fmt('b', addr, cpu.registers[Register(reg)])
+        cpu.ram.set_fmt('b', addr, cpu.regs[reg])
 
     @Operation(arg_def='rw')
     def movw_i2r(cpu: 'CPU', reg: int, immw: int):
@@ -177,8 +228,8 @@ class Operations:
 
         dst = IMM_WORD
         """
-        cpu.registers[Register(reg)] = immw
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] = immw
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='ra')
     def movw_m2r(cpu: 'CPU', reg: int, addr: int):
@@ -187,8 +238,8 @@ class Operations:
 
         dst = word ptr $RAM[IMM_ADDR]
         """
-        cpu.registers[Register(reg)] = cpu.ram.get_fmt('w', addr)
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] = cpu.ram.get_fmt('w', addr)
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='ar')
     def movw_r2m(cpu: 'CPU', addr: int, reg: int):
@@ -197,7 +248,7 @@ class Operations:
 
         word ptr $RAM[IMM_ADDR] = src
         """
-        cpu.ram.set_fmt('w', addr, cpu.registers[Register(reg)])
+        cpu.ram.set_fmt('w', addr, cpu.regs[reg])
 
     @Operation(arg_def='rr')
     def lpb_r(cpu: 'CPU', dst_reg: int, addr_reg: int):
@@ -206,9 +257,9 @@ class Operations:
 
         dst = byte ptr $PROGRAM[src]
         """
-        addr = cpu.registers[Register(addr_reg)]
-        cpu.registers[Register(dst_reg)] = cpu.program.get_fmt('b', addr)
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        addr = cpu.regs[addr_reg]
+        cpu.regs[dst_reg] = cpu.program.get_fmt('b', addr)
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rr')
     def lpa_r(cpu: 'CPU', dst_reg: int, addr_reg: int):
@@ -217,9 +268,9 @@ class Operations:
 
         dst = addr ptr $RAM[src]
         """
-        addr = cpu.registers[Register(addr_reg)]
-        cpu.registers[Register(dst_reg)] = cpu.program.get_fmt('a', addr)
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        addr = cpu.regs[addr_reg]
+        cpu.regs[dst_reg] = cpu.program.get_fmt('a', addr)
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rr')
     def lpw_r(cpu: 'CPU', dst_reg: int, addr_reg: int):
@@ -228,9 +279,9 @@ class Operations:
 
         dst = word ptr $PROGRAM[src]
         """
-        addr = cpu.registers[Register(addr_reg)]
-        cpu.registers[Register(reg)] = cpu.program.get_fmt('w', addr)
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        addr = cpu.regs[addr_reg]
+        cpu.regs[dst_reg] = cpu.program.get_fmt('w', addr)
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rr')
     def ldb_r(cpu: 'CPU', dst_reg: int, addr_reg: int):
@@ -239,9 +290,9 @@ class Operations:
 
         dst = byte ptr $RAM[src]
         """
-        addr = cpu.registers[Register(addr_reg)]
-        cpu.registers[Register(dst_reg)] = cpu.ram.get_fmt('b', addr)
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        addr = cpu.regs[addr_reg]
+        cpu.regs[dst_reg] = cpu.ram.get_fmt('b', addr)
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rr')
     def lda_r(cpu: 'CPU', dst_reg: int, addr_reg: int):
@@ -250,9 +301,9 @@ class Operations:
 
         dst = addr ptr $RAM[src]
         """
-        addr = cpu.registers[Register(addr_reg)]
-        cpu.registers[Register(dst_reg)] = cpu.ram.get_fmt('a', addr)
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        addr = cpu.regs[addr_reg]
+        cpu.regs[dst_reg] = cpu.ram.get_fmt('a', addr)
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rr')
     def ldw_r(cpu: 'CPU', dst_reg: int, addr_reg: int):
@@ -261,9 +312,9 @@ class Operations:
 
         dst = word ptr $RAM[src]
         """
-        addr = cpu.registers[Register(addr_reg)]
-        cpu.registers[Register(reg)] = cpu.ram.get_fmt('w', addr)
-        cpu._set_flags(cpu.registers[Register(dst_reg)])
+        addr = cpu.regs[addr_reg]
+        cpu.regs[dst_reg] = cpu.ram.get_fmt('w', addr)
+        cpu._set_flags(cpu.regs[dst_reg])
 
     @Operation(arg_def='rr')
     def stb_r(cpu: 'CPU', addr_reg: int, val_reg: int):
@@ -272,7 +323,7 @@ class Operations:
 
         byte ptr $RAM[dst] = val
         """
-        cpu.ram.set_fmt('b', cpu.registers[Register(addr_reg)], cpu.registers[Register(val_reg)])
+        cpu.ram.set_fmt('b', cpu.regs[addr_reg], cpu.regs[val_reg])
 
     @Operation(arg_def='rr')
     def sta_r(cpu: 'CPU', addr_reg: int, val_reg: int):
@@ -281,7 +332,7 @@ class Operations:
 
         byte ptr $RAM[dst] = val
         """
-        cpu.ram.set_fmt('a', cpu.registers[Register(addr_reg)], cpu.registers[Register(val_reg)])
+        cpu.ram.set_fmt('a', cpu.regs[addr_reg], cpu.regs[val_reg])
 
     @Operation(arg_def='rr')
     def stw_r(cpu: 'CPU', addr_reg: int, val_reg: int):
@@ -290,7 +341,7 @@ class Operations:
 
         byte ptr $RAM[dst] = val
         """
-        cpu.ram.set_fmt('w', cpu.registers[Register(addr_reg)], cpu.registers[Register(val_reg)])
+        cpu.ram.set_fmt('w', cpu.regs[addr_reg], cpu.regs[val_reg])
 
     @Operation(arg_def='a')
     def jmp(cpu: 'CPU', addr: int):
@@ -299,14 +350,14 @@ class Operations:
 
         IP = IMM_ADDR
         """
-        cpu.registers.IP = addr
+        cpu.regs[REG_IP] = addr
 
     @Operation()
     def out(cpu: 'CPU'):
         """
         out - print character to GPU
         """
-        cpu.gpu.put(cpu.registers.A)
+        cpu.gpu.put(cpu.regs[REG_A])
 
     @Operation()
     def _in(cpu: 'CPU'):
@@ -318,16 +369,19 @@ class Operations:
             char = -1
         else:
             logging.info('in: %d' % char)
-        cpu.registers.A = char
-        cpu._set_flags(cpu.registers.A)
+        cpu.regs[REG_A] = char
+        cpu._set_flags(cpu.regs[REG_A])
+
+        if char < 0 and cpu.idle_detector is not None:
+            cpu.idle_detector.poll_missed()
 
     @Operation(arg_def='rr')
     def seek(cpu: 'CPU', x_reg: int, y_reg: int):
         """
         seek - set current GPU write pointer position to (x, y)
         """
-        cpu.gpu.seek(x=cpu.registers[Register(x_reg)],
-                     y=cpu.registers[Register(y_reg)])
+        cpu.gpu.seek(x=cpu.regs[x_reg],
+                     y=cpu.regs[y_reg])
 
     @Operation(arg_def='a')
     def call(cpu: 'CPU', addr: int):
@@ -339,9 +393,9 @@ class Operations:
         IP = addr
         """
         addr_size = DataType.calcsize('a')
-        cpu.registers.RP -= addr_size
-        cpu.call_stack.set_fmt('a', cpu.registers.RP, cpu.registers.IP)
-        cpu.registers.IP = addr
+        cpu.regs[REG_RP] -= addr_size
+        cpu.call_stack.set_fmt('a', cpu.regs[REG_RP], cpu.regs[REG_IP])
+        cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='r')
     def call_r(cpu: 'CPU', reg: int):
@@ -353,9 +407,9 @@ class Operations:
         IP = reg
         """
         addr_size = DataType.calcsize('a')
-        cpu.registers.RP -= addr_size
-        cpu.call_stack.set_fmt('a', cpu.registers.RP, cpu.registers.IP)
-        cpu.registers.IP = cpu.registers[Register(reg)]
+        cpu.regs[REG_RP] -= addr_size
+        cpu.call_stack.set_fmt('a', cpu.regs[REG_RP], cpu.regs[REG_IP])
+        cpu.regs[REG_IP] = cpu.regs[reg]
 
     @Operation()
     def ret(cpu: 'CPU'):
@@ -366,8 +420,8 @@ class Operations:
         RP += sizeof_addr
         """
         addr_size = DataType.calcsize('a')
-        cpu.registers.IP = cpu.call_stack.get_fmt('a', cpu.registers.RP)
-        cpu.registers.RP += addr_size
+        cpu.regs[REG_IP] = cpu.call_stack.get_fmt('a', cpu.regs[REG_RP])
+        cpu.regs[REG_RP] += addr_size
 
     @Operation(arg_def='r')
     def push(cpu: 'CPU', reg: int):
@@ -377,8 +431,8 @@ class Operations:
         SP -= sizeof_word
         word ptr $RAM[SP] = reg
         """
-        cpu.registers.SP -= DataType.from_fmt('w').size_bytes
-        cpu.ram.set_fmt('w', cpu.registers.SP, cpu.registers[Register(reg)])
+        cpu.regs[REG_SP] -= DataType.from_fmt('w').size_bytes
+        cpu.ram.set_fmt('w', cpu.regs[REG_SP], cpu.regs[reg])
 
     @Operation(arg_def='r')
     def pop(cpu: 'CPU', reg: int):
@@ -388,8 +442,8 @@ class Operations:
         reg = word ptr $RAM[SP]
         SP += sizeof_word
         """
-        cpu.registers[Register(reg)] = cpu.ram.get_fmt('w', cpu.registers.SP)
-        cpu.registers.SP += DataType.from_fmt('w').size_bytes
+        cpu.regs[reg] = cpu.ram.get_fmt('w', cpu.regs[REG_SP])
+        cpu.regs[REG_SP] += DataType.from_fmt('w').size_bytes
 
     @Operation(arg_def='rb')
     def add_b(cpu: 'CPU', reg: int, immb: int):
@@ -398,8 +452,8 @@ class Operations:
 
         dst += IMM_BYTE
         """
-        cpu.registers[Register(reg)] += immb
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] += immb
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rw')
     def add_w(cpu: 'CPU', reg: int, immw: int):
@@ -408,8 +462,8 @@ class Operations:
 
         dst += IMM_WORD
         """
-        cpu.registers[Register(reg)] += immw
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] += immw
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rr')
     def add_r(cpu: 'CPU', dst: int, src: int):
@@ -418,8 +472,8 @@ class Operations:
 
         dst += src
         """
-        cpu.registers[Register(dst)] += cpu.registers[Register(src)]
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] += cpu.regs[src]
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def sub_b(cpu: 'CPU', reg: int, immb: int):
@@ -428,8 +482,8 @@ class Operations:
 
         dst -= IMM_BYTE
         """
-        cpu.registers[Register(reg)] -= immb
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] -= immb
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rb')
     def sub_w(cpu: 'CPU', reg: int, immw: int):
@@ -438,8 +492,8 @@ class Operations:
 
         dst -= IMM_WORD
         """
-        cpu.registers[Register(reg)] -= immw
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] -= immw
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rr')
     def sub_r(cpu: 'CPU', dst: int, src: int):
@@ -448,8 +502,8 @@ class Operations:
 
         dst -= src
         """
-        cpu.registers[Register(dst)] -= cpu.registers[Register(src)]
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] -= cpu.regs[src]
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def mul_b(cpu: 'CPU', reg: int, immb: int):
@@ -458,8 +512,8 @@ class Operations:
 
         dst *= IMM_BYTE
         """
-        cpu.registers[Register(reg)] *= immb
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] *= immb
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rw')
     def mul_w(cpu: 'CPU', reg: int, immw: int):
@@ -468,8 +522,8 @@ class Operations:
 
         dst *= IMM_WORD
         """
-        cpu.registers[Register(reg)] *= immw
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] *= immw
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rr')
     def mul_r(cpu: 'CPU', dst: int, src: int):
@@ -478,8 +532,8 @@ class Operations:
 
         dst *= src
         """
-        cpu.registers[Register(dst)] *= cpu.registers[Register(src)]
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] *= cpu.regs[src]
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def mod_b(cpu: 'CPU', reg: int, immb: int):
@@ -488,8 +542,8 @@ class Operations:
 
         dst %= IMM_BYTE
         """
-        cpu.registers[Register(reg)] %= immb
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] %= immb
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rw')
     def mod_w(cpu: 'CPU', reg: int, immw: int):
@@ -498,8 +552,8 @@ class Operations:
 
         dst %= IMM_WORD
         """
-        cpu.registers[Register(reg)] %= immw
-        cpu._set_flags(cpu.registers[Register(reg)])
+        cpu.regs[reg] %= immw
+        cpu._set_flags(cpu.regs[reg])
 
     @Operation(arg_def='rr')
     def mod_r(cpu: 'CPU', dst: int, src: int):
@@ -508,8 +562,8 @@ class Operations:
 
         dst %= src
         """
-        cpu.registers[Register(dst)] %= cpu.registers[Register(src)]
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] %= cpu.regs[src]
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def and_b(cpu: 'CPU', dst: int, immb: int):
@@ -518,8 +572,8 @@ class Operations:
 
         dst &= IMM_BYTE
         """
-        cpu.registers[Register(dst)] &= immb
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] &= immb
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rw')
     def and_w(cpu: 'CPU', dst: int, immw: int):
@@ -528,8 +582,8 @@ class Operations:
 
         dst &= IMM_WORD
         """
-        cpu.registers[Register(dst)] &= immw
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] &= immw
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rr')
     def and_r(cpu: 'CPU', dst: int, src: int):
@@ -538,8 +592,8 @@ class Operations:
 
         dst &= src
         """
-        cpu.registers[Register(dst)] &= cpu.registers[Register(src)]
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] &= cpu.regs[src]
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def or_b(cpu: 'CPU', dst: int, immb: int):
@@ -548,8 +602,8 @@ class Operations:
 
         dst |= IMM_BYTE
         """
-        cpu.registers[Register(dst)] |= immb
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] |= immb
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rw')
     def or_w(cpu: 'CPU', dst: int, immw: int):
@@ -558,8 +612,8 @@ class Operations:
 
         dst |= IMM_WORD
         """
-        cpu.registers[Register(dst)] |= immw
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] |= immw
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rr')
     def or_r(cpu: 'CPU', dst: int, src: int):
@@ -568,8 +622,8 @@ class Operations:
 
         dst |= src
         """
-        cpu.registers[Register(dst)] |= cpu.registers[Register(src)]
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] |= cpu.regs[src]
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def shr_b(cpu: 'CPU', dst: int, immb: int):
@@ -578,8 +632,8 @@ class Operations:
 
         dst >>= IMM_BYTE
         """
-        cpu.registers[Register(dst)] >>= immb
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] >>= immb
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rb')
     def shl_b(cpu: 'CPU', dst: int, immb: int):
@@ -588,59 +642,59 @@ class Operations:
 
         dst <<= IMM_BYTE
         """
-        cpu.registers[Register(dst)] <<= immb
-        cpu._set_flags(cpu.registers[Register(dst)])
+        cpu.regs[dst] <<= immb
+        cpu._set_flags(cpu.regs[dst])
 
     @Operation(arg_def='rw')
     def cmp_b(cpu: 'CPU', reg: int, immb: int):
         """
         cmp.b reg, IMM_WORD - CoMPare register with Byte, set flags
         """
-        cpu._set_flags(cpu.registers[Register(reg)] - immb)
+        cpu._set_flags(cpu.regs[reg] - immb)
 
     @Operation(arg_def='rw')
     def cmp_w(cpu: 'CPU', reg: int, immw: int):
         """
         cmp.w reg, IMM_WORD - CoMPare register with Word, set flags
         """
-        cpu._set_flags(cpu.registers[Register(reg)] - immw)
+        cpu._set_flags(cpu.regs[reg] - immw)
 
     @Operation(arg_def='rr')
     def cmp_r(cpu: 'CPU', reg_a: int, reg_b: int):
         """
         cmp.r reg_a, reg_b - CoMPare two registers, set flags
         """
-        cpu._set_flags(cpu.registers[Register(reg_a)] - cpu.registers[Register(reg_b)])
+        cpu._set_flags(cpu.regs[reg_a] - cpu.regs[reg_b])
 
     @Operation(arg_def='a')
     def je(cpu: 'CPU', addr: int):
-        if cpu.registers.F & Flag.Zero:
-            cpu.registers.IP = addr
+        if cpu.regs[REG_F] & Flag.Zero:
+            cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='a')
     def jne(cpu: 'CPU', addr: int):
-        if not (cpu.registers.F & Flag.Zero):
-            cpu.registers.IP = addr
+        if not (cpu.regs[REG_F] & Flag.Zero):
+            cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='a')
     def ja(cpu: 'CPU', addr: int):
-        if cpu.registers.F & Flag.Greater:
-            cpu.registers.IP = addr
+        if cpu.regs[REG_F] & Flag.Greater:
+            cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='a')
     def jae(cpu: 'CPU', addr: int):
-        if cpu.registers.F & (Flag.Zero | Flag.Greater):
-            cpu.registers.IP = addr
+        if cpu.regs[REG_F] & (Flag.Zero | Flag.Greater):
+            cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='a')
     def jb(cpu: 'CPU', addr: int):
-        if not (cpu.registers.F & (Flag.Zero | Flag.Greater)):
-            cpu.registers.IP = addr
+        if not (cpu.regs[REG_F] & (Flag.Zero | Flag.Greater)):
+            cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='a')
     def jbe(cpu: 'CPU', addr: int):
-        if not (cpu.registers.F & Flag.Greater):
-            cpu.registers.IP = addr
+        if not (cpu.regs[REG_F] & Flag.Greater):
+            cpu.regs[REG_IP] = addr
 
     @Operation(arg_def='a')
     def loop(cpu: 'CPU', addr: int):
@@ -651,9 +705,9 @@ class Operations:
         if C > 0:
             IP = IMM_ADDR
         """
-        cpu.registers.C -= 1
-        if cpu.registers.C > 0:
-            cpu.registers.IP = addr
+        cpu.regs[REG_C] -= 1
+        if cpu.regs[REG_C] > 0:
+            cpu.regs[REG_IP] = addr
 
     @Operation()
     def rand(cpu: 'CPU'):
@@ -666,10 +720,10 @@ class Operations:
         value = 0
         for _ in range(num_bytes):
             value *= 2**cpu.ram.char_bit
-            value += random.randint(0, 2**cpu.ram.char_bit)
+            value += cpu.rng.randint(0, 2**cpu.ram.char_bit)
 
-        cpu.registers.A = value
-        cpu._set_flags(cpu.registers.A)
+        cpu.regs[REG_A] = value
+        cpu._set_flags(cpu.regs[REG_A])
 
     @Operation()
     def halt(cpu: 'CPU'):
@@ -684,9 +738,9 @@ class Operations:
     @Operation('r')
     def dbg_reg(cpu: 'CPU', reg: int):
         """ dbg.reg - prints current state of the VM register """
-        print('%08x: %s = %d (%x)' % (cpu.registers.IP, Register(reg).name,
-                                      cpu.registers[Register(reg)],
-                                      cpu.registers[Register(reg)]),
+        print('%08x: %s = %d (%x)' % (cpu.regs[REG_IP], Register(reg).name,
+                                      cpu.regs[reg],
+                                      cpu.regs[reg]),
               file=sys.stderr)
 
     @Operation()
@@ -701,90 +755,311 @@ class Operations:
                               alignment=4, address_base=addr),
               file=sys.stderr)
 
+    @Operation()
+    def flip(cpu: 'CPU'):
+        """
+        flip - present current GPU framebuffer contents as a complete frame
+
+        Once a program uses flip, the screen is only updated with flipped
+        frames, so partially drawn ones are never displayed. If the frame
+        scheduler has vsync enabled, flip waits until the frame is
+        displayed, so a program that flips once per frame runs at the
+        GPU refresh rate.
+        """
+        cpu.gpu.flip()
+        cpu.frame_scheduler.vsync()
+
+    @Operation(arg_def='rr')
+    def blit(cpu: 'CPU', addr_reg: int, count_reg: int):
+        """
+        blit addr, count - print COUNT characters from RAM to GPU
+
+        for i in range(count):
+            A = byte ptr $RAM[addr + i]
+            out
+        """
+        cpu.gpu.write(_load_chars(cpu.ram, cpu.regs[addr_reg], cpu.regs[count_reg]))
+
+    @Operation(arg_def='rrr')
+    def blit_x(cpu: 'CPU', addr_reg: int, table_reg: int, count_reg: int):
+        """
+        blit.x addr, table, count - print COUNT characters from RAM to GPU,
+        translated through a table in program memory
+
+        for i in range(count):
+            A = byte ptr $PROGRAM[table + byte ptr $RAM[addr + i]]
+            out
+        """
+        values = _load_chars(cpu.ram, cpu.regs[addr_reg], cpu.regs[count_reg])
+        if not values:
+            return
+
+        table = cpu.regs[table_reg]
+        glyphs = {}
+        for value in set(values):
+            glyphs[value] = _load_chars(cpu.program, table + value, 1)[0]
+        cpu.gpu.write([glyphs[value] for value in values])
+
+    @Operation(arg_def='rr')
+    def fill(cpu: 'CPU', char_reg: int, count_reg: int):
+        """
+        fill char, count - print character CHAR to GPU COUNT times
+
+        for i in range(count):
+            A = char
+            out
+        """
+        cpu.gpu.fill(cpu.regs[char_reg], cpu.regs[count_reg])
+
+    @Operation(arg_def='rrr')
+    def memcpy(cpu: 'CPU', dst_reg: int, src_reg: int, count_reg: int):
+        """
+        memcpy dst, src, count - copy COUNT bytes within RAM
+
+        byte ptr $RAM[dst:dst+count] = byte ptr $RAM[src:src+count]
+
+        Overlapping ranges are copied as if through a temporary buffer.
+        """
+        cpu.ram.copy_bytes(cpu.regs[dst_reg], cpu.regs[src_reg], cpu.regs[count_reg])
+
+    @Operation(arg_def='rrr')
+    def memset(cpu: 'CPU', dst_reg: int, val_reg: int, count_reg: int):
+        """
+        memset dst, val, count - fill COUNT bytes of RAM with a value
+
+        for i in range(count):
+            byte ptr $RAM[dst + i] = val
+        """
+        cpu.ram.fill_bytes(cpu.regs[dst_reg], cpu.regs[val_reg], cpu.regs[count_reg])
+
+    @Operation(arg_def='rrr')
+    def memcmp(cpu: 'CPU', lhs_reg: int, rhs_reg: int, count_reg: int):
+        """
+        memcmp lhs, rhs, count - compare COUNT bytes of RAM
+
+        Sets flags as cmp does for the first pair of bytes that differ, or
+        as for equal values if all COUNT bytes are equal:
+
+        for i in range(count):
+            cmp byte ptr $RAM[lhs + i], byte ptr $RAM[rhs + i]
+            jne done
+        done:
+        """
+        count = cpu.regs[count_reg]
+        lhs = _load_chars(cpu.ram, cpu.regs[lhs_reg], count)
+        rhs = _load_chars(cpu.ram, cpu.regs[rhs_reg], count)
+        cpu._set_flags(next((a - b for a, b in zip(lhs, rhs) if a != b), 0))
+
+
+def _load_chars(memory: Memory, addr: int, count: int) -> List[int]:
+    """ Reads COUNT bytes from MEMORY at ADDR, decoded as by ldb.r """
+    return values_from_bytes(memory.get_bytes(addr, max(count, 0)), memory.char_bit)
+
 
 class InvalidOpcodeFault(Fault):
     pass
 
 
+class InvalidRegisterFault(Fault):
+    pass
+
+
+class IdleDetector:
+    """
+    Detects programs busy-waiting for a key press: the same in instruction
+    finding no key press over and over, in a short loop that does not change
+    any register. Once detected, every further unsuccessful poll lets the
+    FrameScheduler block on the input device until a key is pressed or the
+    next frame is due.
+
+    No instructions are skipped: the program executes exactly the same
+    instructions as it would without waiting, only slower in wall-clock
+    time. Loops that keep a counter in memory rather than in a register are
+    not told apart from idle ones.
+    """
+    # polls further apart than that are not a busy-wait loop
+    MAX_LOOP_INSTRUCTIONS = 32
+    # consecutive idle-looking polls required before waiting
+    IDLE_POLLS = 3
+
+    def __init__(self, cpu: 'CPU'):
+        self._cpu = cpu
+        # register values at the first of the idle-looking polls
+        self._regs = None
+        self._last_poll = 0
+        self._idle_polls = 0
+
+    def poll_missed(self):
+        """ Called after an in instruction finds no key press """
+        cpu = self._cpu
+        now = cpu.instructions_executed
+        if now - self._last_poll <= self.MAX_LOOP_INSTRUCTIONS and cpu.regs == self._regs:
+            self._idle_polls += 1
+        else:
+            self._idle_polls = 0
+            self._regs = list(cpu.regs)
+        self._last_poll = now
+
+        if self._idle_polls >= self.IDLE_POLLS:
+            cpu.frame_scheduler.wait_idle(now, cpu.input)
+
+
 class CPU:
     OPERATIONS_BY_OPCODE = {o.opcode: o for o in Operations.__dict__.values() if isinstance(o, Operation)}
     OPERATIONS_BY_MNEMONIC = {o.mnemonic: o for o in Operations.__dict__.values() if isinstance(o, Operation)}
 
     def __init__(self):
-        self.registers = RegisterSet()
+        self.regs = make_register_file()
+        self.registers = RegisterSet(self.regs)
 
         self.program = None
         self.ram = None
         self.call_stack = None
         self.input = None
+        self.gpu = None
+        self.idle_detector = None
+        # number of instructions executed by the current or last execute()
+        # call, including the one being executed. Engines keep it up to date
+        # for every instruction that may access devices.
+        self.instructions_executed = 0
+        # random number generator used by the rand instruction
+        self.rng = random.Random()
+
+        # IP -> DecodedInstruction
+        self._decoded = {}
+        self._max_instruction_size = 0
+
+    def fork(self, gpu: GPU = None) -> 'CPU':
+        """
+        Returns a CPU that continues independently from the current state:
+        registers, random number generator state and forked memory blocks
+        (see Memory.fork()). Memory blocks aliased with each other stay
+        aliased. Must not be called while the CPU is executing.
+
+        GPU, if given, becomes the display of the clone and receives the
+        framebuffer of this CPU's GPU.
+
+        To run the clone, pass its own memory blocks to execute(), with
+        resume set.
+        """
+        clone = CPU()
+        clone.regs[:] = self.regs
+        clone.rng.setstate(self.rng.getstate())
+
+        forked = {}
+        def fork_memory(memory: Optional[Memory]) -> Optional[Memory]:
+            if memory is None:
+                return None
+            if id(memory) not in forked:
+                forked[id(memory)] = memory.fork()
+            return forked[id(memory)]
+
+        clone.program = fork_memory(self.program)
+        clone.ram = fork_memory(self.ram)
+        clone.call_stack = fork_memory(self.call_stack)
+
+        if gpu is not None and self.gpu is not None:
+            gpu.load_state(self.gpu.save_state())
+        clone.gpu = gpu
+        return clone
 
     def _set_flags(self, value: int):
-        self.registers.F = ((Flag.Zero if (value == 0) else 0)
-                            | (Flag.Greater if (value > 0) else 0))
+        self.regs[REG_F] = (FLAG_ZERO if value == 0
+                            else FLAG_GREATER if value > 0
+                            else 0)
 
-    def _log_instruction(self,
-                         op: Operation,
-                         args: List[int],
-                         op_memory: List[int]):
-        args_str = ', '.join(str(x) for x in args)
+    def _decode(self, ip: int) -> DecodedInstruction:
+        """
+        Fetches and decodes the instruction at IP. Results are cached until
+        the program memory they were decoded from is overwritten.
+        """
+        try:
+            op = self.OPERATIONS_BY_OPCODE[self.program[ip]]
+        except KeyError as err:
+            raise InvalidOpcodeFault('invalid opcode: %d (%x) at address %08x'
+                                     % (self.program[ip], self.program[ip], ip)) from err
 
-        byte_fmt_len = len('%x' % 2**(self.program.char_bit - 1))
-        byte_fmt = '%0{0}x'.format(byte_fmt_len)
-        bytecode_str = ' '.join(byte_fmt % b for b in op_memory)
+        args = op.decode_args(memory=self.program, addr=ip + op.opcode_size_bytes)
+        insn = DecodedInstruction(op, args, ip + op.size_bytes)
+        self._decoded[ip] = insn
+        return insn
 
-        logging.debug('%08x  %-8s %-20s %s' % (self.registers.IP, op.mnemonic, args_str, bytecode_str))
+    def _invalidate_decoded(self, addr: int, size: int):
+        """ Drops cached instructions overlapping [ADDR, ADDR+SIZE) """
+        if not self._decoded:
+            return
+        for ip in range(addr - self._max_instruction_size + 1, addr + size):
+            self._decoded.pop(ip, None)
 
     def execute(self,
                 program: Memory,
                 ram: Memory,
                 stack: Memory,
                 input: Input,
-                halt_after_instructions: Optional[int]):
-        self.registers.IP = 0
-        self.registers.SP = len(ram)
-        self.registers.RP = len(stack)
+                halt_after_instructions: Optional[int],
+                engine: Callable[['CPU'], 'Interpreter'] = None,
+                frame_scheduler: Callable[[GPU], FrameScheduler] = None,
+                gpu: GPU = None,
+                resume: bool = False,
+                idle_wait: bool = True) -> ExecutionStats:
+        """
+        Runs PROGRAM from address 0 until it halts or HALT_AFTER_INSTRUCTIONS
+        instructions are executed.
+
+        ENGINE is a factory of the object that actually executes instructions;
+        by default, an Interpreter is used.
+        FRAME_SCHEDULER is a factory of the FrameScheduler that decides when
+        to refresh the GPU.
+        GPU is the display device to use; by default, an 80x24 GPU that
+        writes frames to stdout is created.
+        If RESUME is set, execution continues from current register values,
+        e.g. restored from a snapshot, instead of starting at address 0.
+        If IDLE_WAIT is set, busy-wait loops polling for input sleep on the
+        input device instead of spinning; see IdleDetector.
+
+        Returns ExecutionStats describing the run.
+        """
+        if not resume:
+            self.regs[REG_IP] = 0
+            self.regs[REG_SP] = len(ram)
+            self.regs[REG_RP] = len(stack)
 
         self.program = program
         self.ram = ram
         self.call_stack = stack
         self.input = input
 
-        self.gpu = GPU(width=80, height=24)
-
-        try:
-            instructions_executed = 0
-            start_time = time.time()
-
-            while (halt_after_instructions is None
-                   or instructions_executed < halt_after_instructions):
-                try:
-                    instructions_executed += 1
-                    idx = self.registers.IP
-
-                    try:
-                        op = self.OPERATIONS_BY_OPCODE[program[idx]]
-                    except KeyError as err:
-                        raise InvalidOpcodeFault('invalid opcode: %d (%x) at address %08x'
-                                                 % (program[idx], program[idx], idx)) from err
+        self.gpu = gpu or GPU(width=80, height=24)
+        self.frame_scheduler = (frame_scheduler or FrameScheduler)(self.gpu)
+        self.idle_detector = IdleDetector(self) if idle_wait and input is not None else None
 
-                    args = op.decode_args(memory=program, addr=idx + op.opcode_size_bytes)
-                    self._log_instruction(op, args, program[idx:idx+op.size_bytes])
+        self._decoded = {}
+        self._max_instruction_size = max(op.size_bytes for op in self.OPERATIONS_BY_OPCODE.values())
+        program.add_write_listener(self._invalidate_decoded)
 
-                    self.registers.IP = idx + op.size_bytes
-                    op.run(self, *args)
-                except Fault as err:
-                    # TODO: add fault handlers?
-                    logging.error(err)
+        engine = (engine or Interpreter)(self)
+        start_time = time.time()
+        exit_reason = ExitReason.INSTRUCTION_LIMIT
 
-                self.gpu.refresh()
+        try:
+            engine.run(halt_after_instructions)
         except HaltRequested:
-            pass
+            exit_reason = ExitReason.HALTED
         except KeyboardInterrupt:
+            exit_reason = ExitReason.INTERRUPTED
             print(self)
-
+        finally:
+            engine.close()
+            program.remove_write_listener(self._invalidate_decoded)
+            self.instructions_executed = engine.instructions_executed
+
+        stats = ExecutionStats(instructions_executed=engine.instructions_executed,
+                               elapsed_s=time.time() - start_time,
+                               exit_reason=exit_reason)
         self.gpu.refresh(force=True)
 
-        logging.info('%f instructions/s', instructions_executed / (time.time() - start_time))
+        logging.info('%f instructions/s', stats.instructions_per_s)
+        return stats
 
     def __str__(self):
         return ('--- REGISTERS ---\n'
@@ -796,3 +1071,57 @@ class CPU:
                 '--- CALL_STACK ---\n'
                 '%s\n' % (self.registers, self.program, self.ram,
                           self.call_stack.make_dump(DataType.from_fmt('a').alignment)))
+
+
+class Interpreter:
+    """ Executes the program loaded into a CPU one instruction at a time """
+    def __init__(self, cpu: CPU):
+        self.cpu = cpu
+        self.instructions_executed = 0
+
+    def step(self):
+        """ Executes a single instruction at IP, logging any Fault it raises """
+        cpu = self.cpu
+        try:
+            idx = cpu.regs[REG_IP]
+            op, args, next_ip = cpu._decoded.get(idx) or cpu._decode(idx)
+            cpu.regs[REG_IP] = next_ip
+            op.run(cpu, *args)
+        except Fault as err:
+            # TODO: add fault handlers?
+            logging.error(err)
+
+    def run(self, halt_after_instructions: Optional[int]):
+        """
+        Executes instructions until HALT_AFTER_INSTRUCTIONS are executed or
+        HaltRequested is raised.
+        """
+        cpu = self.cpu
+        regs = cpu.regs
+        decoded = cpu._decoded
+        frame_scheduler = cpu.frame_scheduler
+        instructions_executed = self.instructions_executed
+        next_frame_check = instructions_executed
+
+        try:
+            while (halt_after_instructions is None
+                   or instructions_executed < halt_after_instructions):
+                try:
+                    instructions_executed += 1
+                    cpu.instructions_executed = instructions_executed
+                    idx = regs[REG_IP]
+                    op, args, next_ip = decoded.get(idx) or cpu._decode(idx)
+                    regs[REG_IP] = next_ip
+                    op.run(cpu, *args)
+                except Fault as err:
+                    # TODO: add fault handlers?
+                    logging.error(err)
+
+                if instructions_executed >= next_frame_check:
+                    next_frame_check = frame_scheduler.check(instructions_executed)
+        finally:
+            self.instructions_executed = instructions_executed
+
+    def close(self):
+        """ Releases any resources acquired by the engine """
+        pass
@@ -3,8 +3,7 @@ Functions for encoding/decoding values preserving endianness.
 """
 
 import enum
-from typing import List
-from functools import reduce
+from typing import Callable, List, NamedTuple, Sequence
 
 from evil.utils import group
 
@@ -17,6 +16,109 @@ class Endianness(enum.Enum):
     Big = enum.auto()
     PDP = enum.auto()
 
+class Codec(NamedTuple):
+    """
+    Converts values to and from sign-magnitude encoded bytes, for a single
+    combination of endianness, byte size and value size.
+    """
+    # value -> sequence of bytes
+    encode: Callable[[int], Sequence[int]]
+    # sequence of bytes -> value; bytes are assumed to be in range
+    decode: Callable[[Sequence[int]], int]
+
+
+def _byte_order(endianness: Endianness, num_bytes: int) -> List[int]:
+    """
+    Returns significance of every encoded byte, as an index into a
+    little-endian list of bytes
+    """
+    little = list(range(num_bytes))
+    if endianness == Endianness.Little:
+        return little
+    elif endianness == Endianness.Big:
+        return list(reversed(little))
+    elif endianness == Endianness.PDP:
+        return [idx for pair in group(little, 2) for idx in reversed(pair)]
+    else:
+        assert False, 'Invalid endianness: %r' % endianness
+
+
+def _make_int_codec(endianness: Endianness, num_bytes: int) -> Codec:
+    """ Codec for 8-bit bytes, using int.to_bytes/int.from_bytes """
+    byteorder = 'little' if endianness == Endianness.Little else 'big'
+    limit = 2**(8 * num_bytes)
+    sign = 1 << (8 * num_bytes - 1)
+
+    def encode(value: int) -> bytes:
+        magnitude = -value if value < 0 else value
+        if magnitude >= limit:
+            raise ValueError('%d is too big to fit on %d 8-bit bytes (max: %d)'
+                             % (value, num_bytes, limit - 1))
+        return (magnitude | sign if value < 0 else magnitude).to_bytes(num_bytes, byteorder)
+
+    def decode(val_bytes: Sequence[int]) -> int:
+        value = int.from_bytes(val_bytes, byteorder)
+        return -(value & ~sign) if value & sign else value
+
+    return Codec(encode, decode)
+
+
+def _make_shift_codec(endianness: Endianness, char_bit: int, num_bytes: int) -> Codec:
+    """
+    Codec that packs and unpacks bytes with shifts by precomputed amounts,
+    generated as straight-line Python code
+    """
+    shifts = [char_bit * significance for significance in _byte_order(endianness, num_bytes)]
+    namespace = {'LIMIT': 2**(char_bit * num_bytes),
+                 'SIGN': 1 << (char_bit * num_bytes - 1),
+                 'MASK': 2**char_bit - 1}
+
+    source = ('def encode(value):\n'
+              '    magnitude = -value if value < 0 else value\n'
+              '    if magnitude >= LIMIT:\n'
+              '        raise ValueError("%%d is too big to fit on %d %d-bit bytes (max: %%d)"\n'
+              '                         %% (value, LIMIT - 1))\n'
+              '    value = magnitude | SIGN if value < 0 else magnitude\n'
+              '    return [%s]\n'
+              '\n'
+              'def decode(b):\n'
+              '    value = %s\n'
+              '    return -(value ^ SIGN) if value & SIGN else value\n'
+              % (num_bytes, char_bit,
+                 ', '.join('(value >> %d) & MASK' % shift for shift in shifts),
+                 ' | '.join('(b[%d] << %d)' % (idx, shift) for idx, shift in enumerate(shifts))))
+
+    exec(compile(source, '<codec %s %d %d>' % (endianness.name, char_bit, num_bytes), 'exec'), namespace)
+    return Codec(namespace['encode'], namespace['decode'])
+
+
+_CODECS = {}
+
+
+def get_codec(endianness: Endianness,
+              char_bit: int,
+              num_bytes: int) -> Codec:
+    """
+    Returns a Codec for values stored on NUM_BYTES CHAR_BIT-bit bytes in
+    given ENDIANNESS. Codecs are created once and cached.
+    """
+    key = (endianness, char_bit, num_bytes)
+    try:
+        return _CODECS[key]
+    except KeyError:
+        pass
+
+    if endianness == Endianness.PDP and num_bytes % 2 != 0:
+        raise ValueError('unable to encode PDP endian value on odd number of bytes')
+    if char_bit == 8 and endianness != Endianness.PDP:
+        codec = _make_int_codec(endianness, num_bytes)
+    else:
+        codec = _make_shift_codec(endianness, char_bit, num_bytes)
+
+    _CODECS[key] = codec
+    return codec
+
+
 def bytes_from_value(endianness: Endianness,
                      value: int,
                      char_bit: int,
@@ -26,45 +128,11 @@ def bytes_from_value(endianness: Endianness,
     sign-magnitude encoding.
     The order of bytes depends on ENDIANNESS.
     """
-    if endianness == Endianness.PDP and num_bytes % 2 != 0:
-        raise ValueError('unable to encode PDP endian value on odd number of bytes')
-    if value >= 2**(char_bit * num_bytes):
-        raise ValueError('%d is too big to fit on %d %d-bit bytes (max: %d)'
-                         % (value, num_bytes, char_bit,
-                            2**(num_bytes * char_bit) - 1))
-
-    negative = False
-    if value < 0:
-        negative = True
-        value = -value
-
-    result = [0] * num_bytes
-    idx = 0
-    while value > 0:
-        try:
-            result[idx] = value % 2**char_bit
-        except IndexError as err:
-            raise ValueError('value (%d) too long to encode on %d %d-bit bytes'
-                             % (value, num_bytes, char_bit)) from err
-        value //= 2**char_bit
-        idx += 1
-
-    if negative:
-        msb = (1 << (char_bit - 1))
-        result[-1] |= msb
-
-    if endianness == Endianness.Little:
-        return result
-    elif endianness == Endianness.Big:
-        return list(reversed(result))
-    elif endianness == Endianness.PDP:
-        return list(reduce(list.__add__, (reversed(g) for g in group(result, 2))))
-    else:
-        assert False, 'Invalid endianness: %r' % endianness
+    return list(get_codec(endianness, char_bit, num_bytes).encode(value))
 
 
 def value_from_bytes(endianness: Endianness,
-                     val_bytes: List[int],
+                     val_bytes: Sequence[int],
                      char_bit: int) -> int:
     """
     Decodes a list of CHAR_BIT-bit wide bytes from VAL_BYTES into an integer.
@@ -73,27 +141,19 @@ def value_from_bytes(endianness: Endianness,
     """
     if endianness == Endianness.PDP and len(val_bytes) % 2 != 0:
         raise ValueError('unable to decode PDP endian value from odd number of bytes')
-
-    if endianness == Endianness.Little:
-        val_le = val_bytes
-    elif endianness == Endianness.Big:
-        val_le = list(reversed(val_bytes))
-    elif endianness == Endianness.PDP:
-        val_le = reduce(list.__add__, (reversed(g) for g in group(val_bytes, 2)))
-    else:
-        assert False, 'Invalid endianness: %r' % endianness
-
-    negative = False
-    msb = (1 << (char_bit - 1))
-    if val_le[-1] & msb:
-        negative = True
-        val_le[-1] &= ~msb
-
-    val = 0
-    for byte in reversed(val_le):
+    for byte in val_bytes:
         if byte >= 2**char_bit:
             raise ValueError('%d is supposed to be less than 2**%d' % (byte, char_bit))
-        val *= 2**char_bit
-        val += byte
 
-    return -val if negative else val
+    return get_codec(endianness, char_bit, len(val_bytes)).decode(val_bytes)
+
+
+def values_from_bytes(val_bytes: List[int], char_bit: int) -> List[int]:
+    """
+    Decodes every byte of VAL_BYTES as a separate single-byte value.
+    Sign-magnitude encoding is assumed.
+    """
+    msb = (1 << (char_bit - 1))
+    if val_bytes and max(val_bytes) >= msb:
+        return [-(byte ^ msb) if byte & msb else byte for byte in val_bytes]
+    return val_bytes
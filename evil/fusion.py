@@ -0,0 +1,167 @@
+"""
+Superinstructions: common sequences of two or three instructions, detected
+when the program is decoded and executed with a single dispatch.
+
+Fused sequences are compiled with the BlockCompiler, so IP, flags, faults
+and self-modifying code behave exactly as if the instructions were executed
+one at a time.
+"""
+
+import collections
+from typing import List, NamedTuple, Optional, Sequence, FrozenSet
+
+from evil.cpu import CPU, Interpreter, DecodedInstruction, REG_IP
+from evil.fault import Fault
+from evil.jit import BlockCompiler, BasicBlock
+
+CMP = frozenset(['cmp.b', 'cmp.w', 'cmp.r'])
+JUMP_IF = frozenset(['je', 'jne', 'ja', 'jae', 'jb', 'jbe'])
+ARITH_B = frozenset(['add.b', 'sub.b', 'and.b', 'or.b', 'shr.b', 'shl.b'])
+ARITH = ARITH_B | frozenset(['add.w', 'sub.w', 'and.w', 'or.w', 'add.r', 'sub.r', 'and.r', 'or.r',
+                             'mul.b', 'mul.w', 'mul.r', 'mod.b', 'mod.w', 'mod.r'])
+LOAD = frozenset(['ldb.r', 'lda.r', 'lpb.r', 'lpa.r', 'movb.m2r', 'movw.m2r'])
+STORE = frozenset(['stb.r', 'sta.r', 'stw.r', 'movb.r2m', 'movw.r2m'])
+
+
+# Sequences of mnemonic sets, longest first. A sequence of instructions is
+# fused if the mnemonic of every instruction is in the corresponding set.
+FUSIONS: List[Sequence[FrozenSet[str]]] = [
+    # read-modify-write of a memory variable
+    (LOAD, ARITH, STORE),
+    # call with arguments passed on the stack
+    (frozenset(['push']), ARITH_B, frozenset(['call'])),
+    (CMP, JUMP_IF),
+    (ARITH, JUMP_IF),
+    (ARITH, frozenset(['loop'])),
+    (LOAD, ARITH),
+    (ARITH, STORE),
+    (ARITH, ARITH),
+    (frozenset(['push']), frozenset(['pop'])),
+    (frozenset(['pop']), ARITH),
+]
+
+MAX_FUSED_INSTRUCTIONS = max(len(fusion) for fusion in FUSIONS)
+
+
+class Superinstruction(NamedTuple):
+    # mnemonics of fused instructions, joined with '+'
+    name: str
+    num_instructions: int
+    block: BasicBlock
+
+
+class FusionStats:
+    """ Number of times every kind of superinstruction was executed """
+    def __init__(self):
+        self.fired = collections.Counter()
+        # name -> number of distinct addresses it was created at
+        self.sites = collections.Counter()
+
+    def format_table(self) -> str:
+        lines = ['%12s %12s %6s  %s' % ('dispatches', 'insns saved', 'sites', 'superinstruction')]
+        for name, count in self.fired.most_common():
+            lines.append('%12d %12d %6d  %s' % (count, count * name.count('+'), self.sites[name], name))
+        return '\n'.join(lines) + '\n'
+
+
+class FusingInterpreter(Interpreter):
+    """
+    Interpreter that executes sequences of instructions listed in FUSIONS
+    as superinstructions, with a single dispatch.
+    """
+    def __init__(self, cpu: CPU, stats: FusionStats = None):
+        super().__init__(cpu)
+        self.stats = stats or FusionStats()
+        self._compiler = BlockCompiler(cpu)
+        # IP -> Superinstruction, or None if no fusion starts at IP
+        self._fused = {}
+        # IP -> end of bytecode examined when looking for a fusion at IP
+        self._examined_end = {}
+        self._max_fused_size = MAX_FUSED_INSTRUCTIONS * max(op.size_bytes for op in CPU.OPERATIONS_BY_OPCODE.values())
+
+        cpu.program.add_write_listener(self._invalidate)
+
+    def _match(self, instructions: List[DecodedInstruction]) -> int:
+        """ Returns the number of leading INSTRUCTIONS to fuse, or 0 """
+        for fusion in FUSIONS:
+            if (len(fusion) <= len(instructions)
+                    and all(insn.operation.mnemonic in mnemonics
+                            for insn, mnemonics in zip(instructions, fusion))):
+                return len(fusion)
+        return 0
+
+    def _fuse(self, ip: int) -> Optional[Superinstruction]:
+        instructions = []
+        addr = ip
+        while len(instructions) < MAX_FUSED_INSTRUCTIONS:
+            try:
+                insn = self.cpu._decoded.get(addr) or self.cpu._decode(addr)
+            except Fault:
+                break
+            instructions.append(insn)
+            addr = insn.next_ip
+            if BlockCompiler.is_terminator(insn.operation):
+                break
+
+        superinstruction = None
+        length = self._match(instructions)
+        if length:
+            block = self._compiler.compile(ip, max_instructions=length)
+            if block is not None and block.num_instructions == length:
+                name = '+'.join(insn.operation.mnemonic for insn in instructions[:length])
+                superinstruction = Superinstruction(name, length, block)
+                self.stats.sites[name] += 1
+
+        self._fused[ip] = superinstruction
+        # + 1 covers the opcode of an instruction that failed to decode
+        self._examined_end[ip] = addr + 1
+        return superinstruction
+
+    def _invalidate(self, addr: int, size: int):
+        """ Drops superinstructions that may overlap [ADDR, ADDR+SIZE) """
+        for ip in range(addr - self._max_fused_size + 1, addr + size):
+            end = self._examined_end.get(ip)
+            if end is None or end <= addr:
+                continue
+            del self._examined_end[ip]
+            superinstruction = self._fused.pop(ip, None)
+            if superinstruction is not None:
+                superinstruction.block.invalidate()
+
+    def run(self, halt_after_instructions: Optional[int]):
+        cpu = self.cpu
+        regs = cpu.regs
+        fused = self._fused
+        fired = self.stats.fired
+        frame_scheduler = cpu.frame_scheduler
+        instructions_executed = self.instructions_executed
+        next_frame_check = instructions_executed
+
+        try:
+            while (halt_after_instructions is None
+                   or instructions_executed < halt_after_instructions):
+                idx = regs[REG_IP]
+                try:
+                    superinstruction = fused[idx]
+                except KeyError:
+                    superinstruction = self._fuse(idx)
+
+                if (superinstruction is None
+                        or (halt_after_instructions is not None
+                            and (halt_after_instructions - instructions_executed
+                                 < superinstruction.num_instructions))):
+                    instructions_executed += 1
+                    cpu.instructions_executed = instructions_executed
+                    self.step()
+                else:
+                    cpu.instructions_executed = instructions_executed
+                    instructions_executed += superinstruction.block.run()
+                    fired[superinstruction.name] += 1
+
+                if instructions_executed >= next_frame_check:
+                    next_frame_check = frame_scheduler.check(instructions_executed)
+        finally:
+            self.instructions_executed = instructions_executed
+
+    def close(self):
+        self.cpu.program.remove_write_listener(self._invalidate)
@@ -1,14 +1,173 @@
+import os
 import sys
+from array import array
 import time
 import logging
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, TextIO, Tuple
 
-from evil.utils import group
 from evil.fault import Fault
+from evil.input import Input
+from evil.memory import MemoryRegion
 
 class GPUFault(Fault):
     """ GPU access error """
     pass
 
+class GPUState(NamedTuple):
+    """ Contents of GPU memory, as returned by GPU.save_state() """
+    width: int
+    height: int
+    pixels: List[int]
+    # last flipped frame, None if the program never called flip()
+    front: Optional[List[int]]
+    cursor_x: int
+    cursor_y: int
+
+
+
+class GlyphTable(Dict[int, str]):
+    """ Character displayed for each codepoint, computed on first use """
+    def __missing__(self, n: int) -> str:
+        c = chr(n)
+        glyph = self[n] = c if c.isprintable() else ' '
+        return glyph
+
+
+GLYPHS = GlyphTable()
+
+
+class TextRenderer:
+    """
+    Renders every frame in full, one line per screen row, followed by an
+    empty line. Used when the output is not a terminal.
+    """
+    def __init__(self, width: int, height: int):
+        self._width = width
+        self._height = height
+
+    def format(self, pixels: List[int]) -> str:
+        """ Returns PIXELS as text, one line per screen row """
+        glyphs = GLYPHS
+        width = self._width
+        return ''.join(''.join([glyphs[n] for n in pixels[start:start + width]]) + '\n'
+                       for start in range(0, len(pixels), width))
+
+    def render(self, pixels: List[int]) -> str:
+        """ Returns text that displays PIXELS on the output """
+        return self.format(pixels) + '\n'
+
+
+class AnsiRenderer(TextRenderer):
+    """
+    Redraws the screen in place using ANSI escape sequences. Only cells that
+    changed since the previous frame are written; the whole screen is
+    redrawn on the first frame and whenever TERMINAL_SIZE reports the
+    terminal was resized.
+    """
+    # unchanged cells between two changed ones that are rewritten rather
+    # than skipped with a cursor movement, which takes about as many bytes
+    MAX_GAP = 6
+
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 terminal_size: Callable[[], Tuple[int, int]] = lambda: (0, 0)):
+        super().__init__(width, height)
+        self._terminal_size = terminal_size
+        self._size = None
+        # last rendered frame, None if the screen needs a full redraw
+        self._previous = None
+
+    def invalidate(self):
+        """ Makes the next frame redraw the whole screen """
+        self._previous = None
+
+    def _full_redraw(self, pixels: List[int]) -> str:
+        glyphs = GLYPHS
+        width = self._width
+        out = ['\x1b[H\x1b[2J']
+        for y in range(self._height):
+            start = y * width
+            out.append('\x1b[%d;1H' % (y + 1))
+            out.append(''.join([glyphs[n] for n in pixels[start:start + width]]))
+        return ''.join(out)
+
+    def _changed_runs(self, pixels: List[int]) -> str:
+        glyphs = GLYPHS
+        width = self._width
+        previous = self._previous
+        max_gap = self.MAX_GAP
+        out = []
+
+        for y in range(self._height):
+            row_start = y * width
+            row_end = row_start + width
+            if pixels[row_start:row_end] == previous[row_start:row_end]:
+                continue
+
+            i = row_start
+            while i < row_end:
+                if pixels[i] == previous[i]:
+                    i += 1
+                    continue
+
+                run_start = i
+                run_end = i + 1
+                i += 1
+                while i < row_end and i - run_end < max_gap:
+                    if pixels[i] != previous[i]:
+                        run_end = i + 1
+                    i += 1
+
+                out.append('\x1b[%d;%dH' % (y + 1, run_start - row_start + 1))
+                out.append(''.join([glyphs[n] for n in pixels[run_start:run_end]]))
+        return ''.join(out)
+
+    def render(self, pixels: List[int]) -> str:
+        size = self._terminal_size()
+        if self._previous is None or size != self._size:
+            self._size = size
+            text = self._full_redraw(pixels)
+            self._previous = pixels[:]
+        else:
+            text = self._changed_runs(pixels)
+            self._previous[:] = pixels
+
+        if not text:
+            return ''
+        # leave the cursor below the screen
+        return text + '\x1b[%d;1H' % (self._height + 1)
+
+
+def create_renderer(output: TextIO, width: int, height: int) -> TextRenderer:
+    """
+    Returns an AnsiRenderer if OUTPUT is a terminal, TextRenderer otherwise
+    """
+    try:
+        fd = output.fileno()
+        is_terminal = os.isatty(fd)
+    except (AttributeError, OSError, ValueError):
+        # io.StringIO and the like
+        is_terminal = False
+
+    if not is_terminal:
+        return TextRenderer(width, height)
+
+    def terminal_size():
+        try:
+            return tuple(os.get_terminal_size(fd))
+        except OSError:
+            return (0, 0)
+
+    return AnsiRenderer(width, height, terminal_size=terminal_size)
+
+
+def make_framebuffer(size: int) -> array:
+    """ Returns a blank framebuffer of SIZE character cells """
+    return array('I', bytes(array('I').itemsize * size))
+
+
 class GPU:
     def __init__(self,
                  width: int,
@@ -16,52 +175,396 @@ class GPU:
                  refresh_rate_hz: int = 60):
         self._width = width
         self._height = height
+        self._size = width * height
 
         self._refresh_rate_hz = refresh_rate_hz
         self._refresh_last_time = time.time()
 
-        self._pixels = [0] * (width * height)
+        self._pixels = make_framebuffer(self._size)
+        # last frame presented with flip(); None until the program calls it
+        self._front = None
+        self._flipped = False
+
+        # cursor position, as an index into the framebuffer
+        self._pos = 0
 
-        self._curr_x = 0
-        self._curr_y = 0
+        # memory displayed in the framebuffer, see map_memory()
+        self._mapped = None
+
+        # created on first refresh, once the output is known
+        self._renderer = None
+
+    @property
+    def refresh_rate_hz(self) -> int:
+        return self._refresh_rate_hz
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    def map_memory(self, region: MemoryRegion):
+        """
+        Makes the framebuffer display REGION, one byte per character,
+        starting at the top-left corner. Bytes written to REGION are copied
+        to the framebuffer when a frame is flipped or displayed; characters
+        put in between are overwritten only in cells whose bytes changed.
+        """
+        if region.size > self._size:
+            raise ValueError('cannot map %d bytes to a framebuffer of %d characters'
+                             % (region.size, self._size))
+        if self._mapped is not None:
+            self._mapped.close()
+        self._mapped = region
+
+    def _sync_mapped(self):
+        """ Copies bytes written to the mapped region to the framebuffer """
+        if self._mapped is None:
+            return
+        span = self._mapped.take_dirty()
+        if span is None:
+            return
+
+        begin, end = span
+        chars = self._mapped.get_values(begin, end)
+        if min(chars) < 0 or max(chars) >= sys.maxunicode:
+            chars = [n if 0 <= n < sys.maxunicode else 0 for n in chars]
+        self._pixels[begin:end] = array('I', chars)
 
     @property
     def _refresh_interval_s(self) -> float:
         return 1.0 / self._refresh_rate_hz
 
-    def _normalize_curr_pos(self):
-        quotient, self._curr_x = divmod(self._curr_x, self._width)
-        self._curr_y = (self._curr_y + quotient) % self._height
-
     def put(self, n: int):
-        if n >= sys.maxunicode:
+        if not 0 <= n < sys.maxunicode:
             raise GPUFault('invalid character value: %d' % n)
 
-        self._pixels[self._curr_y * self._width + self._curr_x] = n
-        self._curr_x += 1
-        self._normalize_curr_pos()
+        pos = self._pos
+        self._pixels[pos] = n
+        pos += 1
+        self._pos = pos if pos < self._size else 0
+
+    def _write_cells(self, cells: array):
+        """
+        Writes CELLS at the cursor, wrapping around like a sequence of put()
+        calls would
+        """
+        size = self._size
+        if len(cells) > size:
+            # only the last SIZE cells stay on the screen
+            skipped = len(cells) - size
+            self._pos = (self._pos + skipped) % size
+            cells = cells[skipped:]
+
+        pos = self._pos
+        head = min(len(cells), size - pos)
+        self._pixels[pos:pos + head] = cells[:head]
+        self._pixels[:len(cells) - head] = cells[head:]
+        self._pos = (pos + len(cells)) % size
+
+    def write(self, chars: Sequence[int]):
+        """
+        Puts every character from CHARS. Nothing is written if any of them
+        is invalid.
+        """
+        if not chars:
+            return
+        lowest = min(chars)
+        highest = max(chars)
+        if lowest < 0 or highest >= sys.maxunicode:
+            raise GPUFault('invalid character value: %d' % (lowest if lowest < 0 else highest))
+        self._write_cells(array('I', chars))
+
+    def fill(self, n: int, count: int):
+        """ Puts character N COUNT times """
+        if not 0 <= n < sys.maxunicode:
+            raise GPUFault('invalid character value: %d' % n)
+        if count > 0:
+            self._write_cells(array('I', [n]) * min(count, self._size + count % self._size))
 
     def seek(self, x: int, y: int):
         if (x < 0 or x >= self._width
                 or y < 0 or y >= self._height):
             raise GPUFault('%d, %d seek position is invalid for screen of size %d x %d'
                            % (x, y, self._width, self._height))
-        self._curr_x = x
-        self._curr_y = y
+        self._pos = y * self._width + x
 
-    def _refresh_now(self):
-        screen_str = ''
-        for line in group(self._pixels, self._width):
-            line_str = ''.join(chr(n) if chr(n).isprintable() else ' ' for n in line)
-            screen_str += line_str + '\n'
+    def save_state(self) -> GPUState:
+        self._sync_mapped()
+        cursor_y, cursor_x = divmod(self._pos, self._width)
+        return GPUState(width=self._width,
+                        height=self._height,
+                        pixels=list(self._pixels),
+                        front=(None if self._front is None else list(self._front)),
+                        cursor_x=cursor_x,
+                        cursor_y=cursor_y)
+
+    def load_state(self, state: GPUState):
+        """ Restores framebuffer and cursor position saved by save_state() """
+        if (state.width, state.height) != (self._width, self._height):
+            raise ValueError('cannot load %dx%d GPU state into %dx%d GPU'
+                             % (state.width, state.height, self._width, self._height))
+
+        self._pixels = array('I', state.pixels)
+        self._front = None if state.front is None else array('I', state.front)
+        self._flipped = self._front is not None
+        self._pos = state.cursor_y * self._width + state.cursor_x
+
+    def flip(self):
+        """
+        Marks current framebuffer contents as a complete frame. Once called,
+        only flipped frames are displayed.
+        """
+        self._sync_mapped()
+        self._front = self._pixels[:]
+        self._flipped = True
+
+    def _displayed_pixels(self) -> array:
+        if self._front is None:
+            self._sync_mapped()
+            return self._pixels
+        return self._front
+
+    def dump(self) -> str:
+        """
+        Returns the currently displayed frame as text, one line per screen
+        row.
+        """
+        return TextRenderer(self._width, self._height).format(self._displayed_pixels())
 
-        sys.stdout.write(screen_str)
-        sys.stdout.write('\n')
+    def _refresh_now(self):
+        if self._renderer is None:
+            self._renderer = create_renderer(sys.stdout, self._width, self._height)
+        sys.stdout.write(self._renderer.render(self._displayed_pixels()))
         sys.stdout.flush()
 
+    def present(self):
+        """
+        Displays the current frame. If the program uses flip(), frames that
+        were already displayed are skipped.
+        """
+        if self._front is not None and not self._flipped:
+            return
+
+        self._flipped = False
+        self._refresh_now()
+
+    def refresh_due_in(self) -> float:
+        """
+        Returns the number of seconds until refresh() would display a frame.
+        If there is no new frame to display, that is one refresh interval.
+        """
+        if self._front is not None and not self._flipped:
+            return self._refresh_interval_s
+        return max(0.0, self._refresh_last_time + self._refresh_interval_s - time.time())
+
     def refresh(self, force=False):
+        """ Displays the current frame if FORCE is set or one is due """
+        if force:
+            self._refresh_last_time = time.time()
+            self._flipped = False
+            self._refresh_now()
+            return
+
+        if self._front is not None and not self._flipped:
+            # nothing new to display
+            return
+
         now = time.time()
-        if force or (now - self._refresh_last_time >= self._refresh_interval_s):
+        if now - self._refresh_last_time >= self._refresh_interval_s:
             logging.debug('refresh interval: %f', now - self._refresh_last_time)
             self._refresh_last_time = now
-            self._refresh_now()
+            self.present()
+
+    def close(self):
+        """ Waits until all frames are displayed and releases resources """
+        if self._mapped is not None:
+            self._sync_mapped()
+            self._mapped.close()
+            self._mapped = None
+
+
+class NullGPU(GPU):
+    """
+    GPU that never displays anything. The framebuffer is still maintained,
+    so the final screen can be retrieved with dump().
+    """
+    def _refresh_now(self):
+        pass
+
+
+class ThreadedGPU(GPU):
+    """
+    GPU that writes frames to OUTPUT (by default: stdout) from a background
+    thread, so that slow output never stalls the CPU.
+
+    Frames are passed to the renderer through a double buffer: the CPU copies
+    the frame into a spare buffer and publishes it as pending; the renderer
+    takes the pending buffer and returns it once the frame is written. If the
+    renderer falls behind, pending frames it did not get to are replaced by
+    newer ones and never displayed.
+    """
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 refresh_rate_hz: int = 60,
+                 output: TextIO = None):
+        super().__init__(width, height, refresh_rate_hz)
+        self._output = output or sys.stdout
+
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        # last published frame, not taken by the renderer yet
+        self._pending = None
+        # buffer to copy the next published frame to; None if both buffers
+        # are in use or the second one was not allocated yet
+        self._spare = make_framebuffer(self._size)
+        self._closing = False
+        self._thread = None
+
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+
+    def _refresh_now(self):
+        with self._lock:
+            if self._pending is not None:
+                # renderer fell behind; overwrite the frame it did not get to
+                frame = self._pending
+                self.frames_dropped += 1
+            elif self._spare is not None:
+                frame, self._spare = self._spare, None
+            else:
+                # the renderer holds the other buffer
+                frame = make_framebuffer(self._size)
+
+            frame[:] = self._displayed_pixels()
+            self._pending = frame
+            self._frame_ready.notify()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._render_loop, name='gpu-renderer', daemon=True)
+            self._thread.start()
+
+    def _render_loop(self):
+        while True:
+            with self._lock:
+                while self._pending is None and not self._closing:
+                    self._frame_ready.wait()
+                frame = self._pending
+                self._pending = None
+                if frame is None:
+                    return
+
+            try:
+                if self._renderer is None:
+                    self._renderer = create_renderer(self._output, self._width, self._height)
+                self._output.write(self._renderer.render(frame))
+                self._output.flush()
+            except (OSError, ValueError) as err:
+                logging.error('cannot display frame: %s', err)
+                return
+
+            with self._lock:
+                self.frames_rendered += 1
+                if self._spare is None:
+                    self._spare = frame
+
+    def close(self):
+        if self._thread is not None:
+            with self._lock:
+                self._closing = True
+                self._frame_ready.notify()
+            self._thread.join()
+            self._thread = None
+            self._closing = False
+            logging.debug('frames rendered: %d, dropped: %d', self.frames_rendered, self.frames_dropped)
+        super().close()
+
+
+class FrameScheduler:
+    """
+    Decides when to refresh the GPU.
+
+    By default, the clock is checked every CHECK_INTERVAL instructions and
+    the GPU refreshed if a frame is due.
+
+    If CLOCK_HZ is given, the CPU is assumed to execute CLOCK_HZ instructions
+    per second: frames are presented every CLOCK_HZ / refresh rate
+    instructions, and execution is slowed down if it gets ahead of that clock.
+
+    If VSYNC is set, the flip instruction waits until the next frame is due
+    and presents it, which paces programs that draw one frame per flip.
+    Otherwise flip returns immediately, e.g. for headless runs.
+    """
+    def __init__(self,
+                 gpu: GPU,
+                 check_interval: int = 1000,
+                 clock_hz: Optional[float] = None,
+                 vsync: bool = False):
+        if check_interval < 1:
+            raise ValueError('invalid frame check interval: %d' % check_interval)
+        if clock_hz is not None and clock_hz <= 0:
+            raise ValueError('invalid clock rate: %f' % clock_hz)
+
+        self._gpu = gpu
+        self._check_interval = check_interval
+        self._clock_hz = clock_hz
+        self._vsync = vsync
+        self._start_time = time.time()
+        self._start_instruction = None
+
+    def check(self, instructions_executed: int) -> int:
+        """
+        Refreshes the GPU if a frame is due. Returns the number of executed
+        instructions after which check() should be called again.
+        """
+        if self._clock_hz is None:
+            self._gpu.refresh()
+            return instructions_executed + self._check_interval
+
+        if self._start_instruction is None:
+            self._start_instruction = instructions_executed
+
+        self._gpu.present()
+
+        elapsed_instructions = instructions_executed - self._start_instruction
+        ahead_s = (self._start_time + elapsed_instructions / self._clock_hz) - time.time()
+        if ahead_s > 0:
+            time.sleep(ahead_s)
+
+        instructions_per_frame = self._clock_hz / self._gpu.refresh_rate_hz
+        next_frame = int(elapsed_instructions // instructions_per_frame) + 1
+        return max(instructions_executed + 1,
+                   self._start_instruction + int(next_frame * instructions_per_frame))
+
+    def vsync(self):
+        """
+        Called after the program flips a frame. With VSYNC, waits until the
+        next frame is due and presents the flipped one.
+        """
+        if not self._vsync:
+            return
+        time.sleep(self._gpu.refresh_due_in())
+        self._gpu.refresh(force=True)
+
+    def wait_idle(self, instructions_executed: int, input: Input):
+        """
+        Called when the CPU has nothing to do until a key is pressed. Waits
+        on INPUT until a key is pressed or the next frame is due, and
+        presents that frame if it is. With CLOCK_HZ, waits no longer than
+        the CPU is ahead of its clock, leaving frames to check().
+        """
+        if self._clock_hz is None:
+            if not input.wait(self._gpu.refresh_due_in()):
+                self._gpu.refresh()
+            return
+
+        if self._start_instruction is None:
+            return
+        elapsed_instructions = instructions_executed - self._start_instruction
+        ahead_s = (self._start_time + elapsed_instructions / self._clock_hz) - time.time()
+        if ahead_s > 0:
+            input.wait(ahead_s)
@@ -23,3 +23,45 @@ class Input:
     def get_char(self) -> Optional[int]:
         if select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], []):
             return sys.stdin.read(1)[0]
+
+    def wait(self, timeout_s: float) -> bool:
+        """
+        Blocks until a key is pressed or TIMEOUT_S seconds pass. Returns
+        True if get_char() has a key press to return.
+        """
+        return select.select([sys.stdin], [], [], timeout_s) == ([sys.stdin], [], [])
+
+
+class ScriptedInput(Input):
+    """
+    Input device that does not require a terminal. Returns bytes of DATA,
+    one per get_char() call, and behaves as if no key was pressed once
+    all of them are consumed.
+    """
+    def __init__(self, data: bytes = b''):
+        super().__init__()
+        self._data = data
+        self._pos = 0
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ScriptedInput':
+        with open(path, 'rb') as infile:
+            return cls(infile.read())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        pass
+
+    def get_char(self) -> Optional[int]:
+        if self._pos >= len(self._data):
+            return None
+
+        char = self._data[self._pos]
+        self._pos += 1
+        return char
+
+    def wait(self, timeout_s: float) -> bool:
+        # scripted key presses never arrive later, there is nothing to wait for
+        return self._pos < len(self._data)
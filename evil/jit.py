@@ -0,0 +1,407 @@
+"""
+Basic-block compiler: an execution engine that translates straight-line runs
+of bytecode into Python functions.
+"""
+
+import logging
+from typing import List, NamedTuple, Callable, Optional, Dict
+
+from evil.cpu import (CPU, Interpreter, Register, Operation, DecodedInstruction,
+                      HaltRequested, REG_IP, FLAG_ZERO, FLAG_GREATER)
+from evil.memory import DataType
+from evil.fault import Fault
+
+
+class Template(NamedTuple):
+    """
+    Python source an Operation gets inlined as.
+
+    CODE is a str.format template, where:
+    * {0}, {1}, ... - are replaced with literal values of operation arguments,
+    * {r0}, {r1}, ... - are replaced with register file indices of registers
+      passed as operation arguments,
+    * {next} - is replaced with the address of the following instruction,
+    * {flags} - is replaced with code that sets F register based on value of
+      the _v variable.
+
+    FAULTS tells whether the operation may raise a Fault.
+    TERMINATOR is set for operations that write IP and thus end a basic block.
+    """
+    code: str
+    faults: bool = False
+    terminator: bool = False
+
+
+SET_FLAGS = 'R[F] = _ZERO if _v == 0 else _GREATER if _v > 0 else 0'
+
+
+def _arith(operator: str, src: str) -> Template:
+    return Template('_v = R[{r0}] %s %s\n'
+                    'R[{r0}] = _v\n'
+                    '{flags}' % (operator, src))
+
+
+def _load(memory: str, fmt: str, addr: str) -> Template:
+    return Template('_v = %s_get(%r, %s)\n'
+                    'R[{r0}] = _v\n'
+                    '{flags}' % (memory, fmt, addr),
+                    faults=True)
+
+
+def _jump_if(condition: str) -> Template:
+    return Template('R[IP] = {0} if %s else {next}' % condition,
+                    terminator=True)
+
+
+# Operations not listed here are compiled into a call to Operation.operation.
+TEMPLATES = {
+    'movw.r2r': Template('_v = R[{r1}]\n'
+                         'R[{r0}] = _v\n'
+                         '{flags}'),
+    'movb.i2r': Template('R[{r0}] = _v = {1}\n'
+                         '{flags}'),
+    'movw.i2r': Template('R[{r0}] = _v = {1}\n'
+                         '{flags}'),
+    'movb.m2r': _load('ram', 'b', '{1}'),
+    'movw.m2r': _load('ram', 'w', '{1}'),
+    'movb.r2m': Template("ram_set('b', {0}, R[{r1}])", faults=True),
+    'movw.r2m': Template("ram_set('w', {0}, R[{r1}])", faults=True),
+    'lpb.r': _load('program', 'b', 'R[{r1}]'),
+    'lpa.r': _load('program', 'a', 'R[{r1}]'),
+    'ldb.r': _load('ram', 'b', 'R[{r1}]'),
+    'lda.r': _load('ram', 'a', 'R[{r1}]'),
+    'stb.r': Template("ram_set('b', R[{r0}], R[{r1}])", faults=True),
+    'sta.r': Template("ram_set('a', R[{r0}], R[{r1}])", faults=True),
+    'stw.r': Template("ram_set('w', R[{r0}], R[{r1}])", faults=True),
+    'out': Template('gpu_put(R[A])', faults=True),
+    'seek': Template('gpu_seek(x=R[{r0}], y=R[{r1}])', faults=True),
+    'flip': Template('gpu_flip()\nvsync()'),
+    'push': Template('R[SP] -= WORD_SIZE\n'
+                     "ram_set('w', R[SP], R[{r0}])",
+                     faults=True),
+    'pop': Template("R[{r0}] = ram_get('w', R[SP])\n"
+                    'R[SP] += WORD_SIZE',
+                    faults=True),
+    'add.b': _arith('+', '{1}'),
+    'add.w': _arith('+', '{1}'),
+    'add.r': _arith('+', 'R[{r1}]'),
+    'sub.b': _arith('-', '{1}'),
+    'sub.w': _arith('-', '{1}'),
+    'sub.r': _arith('-', 'R[{r1}]'),
+    'mul.b': _arith('*', '{1}'),
+    'mul.w': _arith('*', '{1}'),
+    'mul.r': _arith('*', 'R[{r1}]'),
+    'mod.b': _arith('%', '{1}'),
+    'mod.w': _arith('%', '{1}'),
+    'mod.r': _arith('%', 'R[{r1}]'),
+    'and.b': _arith('&', '{1}'),
+    'and.w': _arith('&', '{1}'),
+    'and.r': _arith('&', 'R[{r1}]'),
+    'or.b': _arith('|', '{1}'),
+    'or.w': _arith('|', '{1}'),
+    'or.r': _arith('|', 'R[{r1}]'),
+    'shr.b': _arith('>>', '{1}'),
+    'shl.b': _arith('<<', '{1}'),
+    'cmp.b': Template('_v = R[{r0}] - {1}\n'
+                      '{flags}'),
+    'cmp.w': Template('_v = R[{r0}] - {1}\n'
+                      '{flags}'),
+    'cmp.r': Template('_v = R[{r0}] - R[{r1}]\n'
+                      '{flags}'),
+    'jmp': Template('R[IP] = {0}', terminator=True),
+    'je': _jump_if('R[F] & _ZERO'),
+    'jne': _jump_if('not (R[F] & _ZERO)'),
+    'ja': _jump_if('R[F] & _GREATER'),
+    'jae': _jump_if('R[F] & (_ZERO | _GREATER)'),
+    'jb': _jump_if('not (R[F] & (_ZERO | _GREATER))'),
+    'jbe': _jump_if('not (R[F] & _GREATER)'),
+    'loop': Template('_v = R[C] - 1\n'
+                     'R[C] = _v\n'
+                     'R[IP] = {0} if _v > 0 else {next}',
+                     terminator=True),
+    'call': Template('R[RP] -= ADDR_SIZE\n'
+                     "stack_set('a', R[RP], {next})\n"
+                     'R[IP] = {0}',
+                     faults=True, terminator=True),
+    'call.r': Template('R[RP] -= ADDR_SIZE\n'
+                       "stack_set('a', R[RP], {next})\n"
+                       'R[IP] = R[{r0}]',
+                       faults=True, terminator=True),
+    'ret': Template("R[IP] = stack_get('a', R[RP])\n"
+                    'R[RP] += ADDR_SIZE',
+                    faults=True, terminator=True),
+}
+
+# Operations that never return normally
+HALTING_MNEMONICS = {'halt'}
+
+# Operations without a template that write to RAM
+RAM_WRITING_MNEMONICS = {'memcpy', 'memset'}
+
+
+class BlockHalted(HaltRequested):
+    """ HaltRequested raised from within a compiled basic block """
+    def __init__(self, instructions_executed: int):
+        super().__init__()
+        self.instructions_executed = instructions_executed
+
+
+class BasicBlock:
+    """ A compiled, straight-line sequence of instructions """
+    def __init__(self,
+                 start: int,
+                 end: int,
+                 num_instructions: int,
+                 run: Callable[[], int],
+                 valid: List[bool]):
+        self.start = start
+        self.end = end
+        self.num_instructions = num_instructions
+        # returns the number of instructions executed
+        self.run = run
+        # shared with the compiled code; cleared when the block is invalidated
+        self._valid = valid
+
+    def invalidate(self):
+        self._valid[0] = False
+
+
+class BlockCompiler:
+    """ Translates bytecode of a CPU program into BasicBlocks """
+    MAX_BLOCK_INSTRUCTIONS = 64
+
+    def __init__(self, cpu: CPU):
+        self._cpu = cpu
+        self._namespace = {
+            'R': cpu.regs,
+            'ram_get': cpu.ram.get_fmt,
+            'ram_set': cpu.ram.set_fmt,
+            'program_get': cpu.program.get_fmt,
+            'stack_get': cpu.call_stack.get_fmt,
+            'stack_set': cpu.call_stack.set_fmt,
+            'gpu_put': cpu.gpu.put,
+            'gpu_seek': cpu.gpu.seek,
+            'gpu_flip': cpu.gpu.flip,
+            'vsync': cpu.frame_scheduler.vsync,
+            'cpu': cpu,
+            'logging': logging,
+            'Fault': Fault,
+            'BlockHalted': BlockHalted,
+            'WORD_SIZE': DataType.calcsize('w'),
+            'ADDR_SIZE': DataType.calcsize('a'),
+            '_ZERO': FLAG_ZERO,
+            '_GREATER': FLAG_GREATER,
+        }
+        self._namespace.update((reg.name, reg.value) for reg in Register.all())
+
+        # writes to these memory blocks may modify the program while a block
+        # is running
+        self._ram_aliases_program = cpu.ram is cpu.program
+        self._stack_aliases_program = cpu.call_stack is cpu.program
+
+    def _fetch(self, ip: int) -> Optional[DecodedInstruction]:
+        """
+        Returns the instruction at IP, or None if the interpreter is required
+        to execute it, e.g. because it raises an error when decoded.
+        """
+        try:
+            return self._cpu._decoded.get(ip) or self._cpu._decode(ip)
+        except Fault:
+            return None
+
+    def _may_modify_program(self, op: Operation) -> bool:
+        """ Checks whether OP may write to program memory """
+        template = TEMPLATES.get(op.mnemonic)
+        if template is None:
+            return self._ram_aliases_program and op.mnemonic in RAM_WRITING_MNEMONICS
+        return ((self._ram_aliases_program and 'ram_set' in template.code)
+                or (self._stack_aliases_program and 'stack_set' in template.code))
+
+    def _emit(self,
+              insn: DecodedInstruction,
+              step: int,
+              namespace: Dict[str, object]) -> List[str]:
+        op = insn.operation
+        template = TEMPLATES.get(op.mnemonic)
+
+        lines = []
+        if template is None or template.faults:
+            lines.append('_s = %d' % step)
+
+        if op.mnemonic in HALTING_MNEMONICS:
+            lines += ['R[IP] = %d' % insn.next_ip,
+                      'raise BlockHalted(%d)' % (step + 1)]
+        elif template is None:
+            namespace['op_%d' % step] = op.operation
+            # operations without a template may access devices, which need
+            # to know the current instruction count
+            lines += ['cpu.instructions_executed = _n0 + %d' % (step + 1),
+                      'R[IP] = %d' % insn.next_ip,
+                      'op_%d(cpu%s)' % (step, ''.join(', %r' % a for a in insn.args))]
+        else:
+            regs = {'r%d' % idx: arg
+                    for idx, (fmt_c, arg) in enumerate(zip(op.arg_def, insn.args))
+                    if fmt_c == 'r'}
+            lines += template.code.format(*insn.args,
+                                          next=insn.next_ip,
+                                          flags=SET_FLAGS,
+                                          **regs).split('\n')
+
+        if self._may_modify_program(op) and not self.is_terminator(op):
+            lines += ['if not VALID[0]:',
+                      '    R[IP] = %d' % insn.next_ip,
+                      '    return %d' % (step + 1)]
+        return lines
+
+    @staticmethod
+    def is_terminator(op: Operation) -> bool:
+        template = TEMPLATES.get(op.mnemonic)
+        return ((template is not None and template.terminator)
+                or op.mnemonic in HALTING_MNEMONICS)
+
+    def compile(self,
+                start: int,
+                max_instructions: Optional[int] = None) -> Optional[BasicBlock]:
+        """
+        Compiles a basic block starting at START, at most MAX_INSTRUCTIONS
+        (by default: MAX_BLOCK_INSTRUCTIONS) long. Returns None if the
+        instruction at START cannot be compiled.
+        """
+        instructions = []
+        addresses = []
+        ip = start
+        while len(instructions) < (max_instructions or self.MAX_BLOCK_INSTRUCTIONS):
+            insn = self._fetch(ip)
+            if insn is None:
+                break
+            instructions.append(insn)
+            addresses.append(ip)
+            ip = insn.next_ip
+            if self.is_terminator(insn.operation):
+                break
+
+        if not instructions:
+            return None
+
+        valid = [True]
+        namespace = dict(self._namespace,
+                         VALID=valid,
+                         NEXT=tuple(insn.next_ip for insn in instructions))
+
+        body = []
+        for step, (addr, insn) in enumerate(zip(addresses, instructions)):
+            body.append('# %08x  %s %s' % (addr, insn.operation.mnemonic,
+                                           ', '.join(str(a) for a in insn.args)))
+            body += self._emit(insn, step, namespace)
+        if not self.is_terminator(instructions[-1].operation):
+            body.append('R[IP] = %d' % ip)
+
+        prologue = ''
+        if any(TEMPLATES.get(insn.operation.mnemonic) is None
+               and insn.operation.mnemonic not in HALTING_MNEMONICS
+               for insn in instructions):
+            prologue = '    _n0 = cpu.instructions_executed\n'
+
+        source = ('def block_%08x():\n'
+                  '    _s = 0\n'
+                  '%s'
+                  '    try:\n'
+                  '%s\n'
+                  '    except Fault as err:\n'
+                  '        R[IP] = NEXT[_s]\n'
+                  '        logging.error(err)\n'
+                  '        return _s + 1\n'
+                  '    return %d\n' % (start,
+                                       prologue,
+                                       '\n'.join('        ' + line for line in body),
+                                       len(instructions)))
+        logging.debug('compiled block:\n%s', source)
+
+        exec(compile(source, '<block %08x>' % start, 'exec'), namespace)
+        return BasicBlock(start=start,
+                          end=ip,
+                          num_instructions=len(instructions),
+                          run=namespace['block_%08x' % start],
+                          valid=valid)
+
+
+class BlockEngine(Interpreter):
+    """
+    Executes the program by compiling it into basic blocks, falling back to
+    the Interpreter for instructions that cannot be compiled or when
+    the instruction budget left is smaller than the block size.
+    """
+    # granularity of invalidation lookups
+    PAGE_BITS = 6
+
+    def __init__(self, cpu: CPU):
+        super().__init__(cpu)
+        self._compiler = BlockCompiler(cpu)
+        # start address -> BasicBlock
+        self._blocks = {}
+        # page index -> list of BasicBlocks that contain bytes from that page
+        self._blocks_by_page = {}
+
+        cpu.program.add_write_listener(self._invalidate)
+
+    def _compile(self, start: int) -> Optional[BasicBlock]:
+        block = self._compiler.compile(start)
+        if block is None:
+            return None
+
+        self._blocks[start] = block
+        for page in range(block.start >> self.PAGE_BITS,
+                          ((block.end - 1) >> self.PAGE_BITS) + 1):
+            self._blocks_by_page.setdefault(page, []).append(block)
+        return block
+
+    def _invalidate(self, addr: int, size: int):
+        """ Drops blocks overlapping [ADDR, ADDR+SIZE) """
+        for page in range(addr >> self.PAGE_BITS,
+                          ((addr + size - 1) >> self.PAGE_BITS) + 1):
+            blocks = self._blocks_by_page.get(page)
+            if not blocks:
+                continue
+
+            for block in list(blocks):
+                if block.start < addr + size and addr < block.end:
+                    block.invalidate()
+                    if self._blocks.get(block.start) is block:
+                        del self._blocks[block.start]
+                    blocks.remove(block)
+
+    def run(self, halt_after_instructions: Optional[int]):
+        cpu = self.cpu
+        regs = cpu.regs
+        blocks = self._blocks
+        frame_scheduler = cpu.frame_scheduler
+        instructions_executed = self.instructions_executed
+        next_frame_check = instructions_executed
+
+        try:
+            while (halt_after_instructions is None
+                   or instructions_executed < halt_after_instructions):
+                ip = regs[REG_IP]
+                block = blocks.get(ip) or self._compile(ip)
+
+                if (block is None
+                        or (halt_after_instructions is not None
+                            and (halt_after_instructions - instructions_executed
+                                 < block.num_instructions))):
+                    instructions_executed += 1
+                    cpu.instructions_executed = instructions_executed
+                    self.step()
+                else:
+                    cpu.instructions_executed = instructions_executed
+                    instructions_executed += block.run()
+
+                if instructions_executed >= next_frame_check:
+                    next_frame_check = frame_scheduler.check(instructions_executed)
+        except BlockHalted as halt:
+            instructions_executed += halt.instructions_executed
+            raise
+        finally:
+            self.instructions_executed = instructions_executed
+
+    def close(self):
+        self.cpu.program.remove_write_listener(self._invalidate)
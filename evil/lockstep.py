@@ -0,0 +1,730 @@
+"""
+Lockstep execution: runs many instances of the same program at once, storing
+registers and memory of all of them in NumPy arrays and executing every
+instruction as a single vectorized operation across instances.
+
+    python3 -m evil lockstep SOURCE --instances N [--seed S] [--input-file FILE ...]
+
+Instances start with identical memory contents and differ only in their
+input and random number generator seed. Instances whose control flow
+diverges are grouped by IP, so every step executes one vectorized operation
+per distinct IP. All instances are headless.
+
+Differences from the Interpreter:
+* program memory is shared by all instances and must not be writable, i.e.
+  ram and stack must not be mapped onto it,
+* registers are stored as DTYPE (int64 by default), so results that do not
+  fit wrap around, and rand fails if it draws a value that does not fit.
+  dtype=object gives exact Python integer semantics at a lower speed,
+* out-of-bounds memory accesses are reported as MemoryAccessFault.
+
+For every instance, a JSON object is written as a single line:
+
+    {"instance": 0, "seed": 42, "exit_reason": "halted",
+     "instructions_executed": 160913, "registers": {"IP": 542, ...},
+     "screen_sha256": "..."}
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from evil.cpu import (CPU, Register, RegisterSet, ExitReason, ExecutionStats,
+                      make_register_file, REG_IP, REG_SP, REG_RP, REG_A, REG_C, REG_F,
+                      FLAG_ZERO, FLAG_GREATER)
+from evil.endianness import Endianness, bytes_from_value, values_from_bytes
+from evil.fault import Fault
+from evil.gpu import GPU, NullGPU
+from evil.input import Input, ScriptedInput
+from evil.machine import MachineConfig
+from evil.memory import Memory, StrictlyAlignedMemory, DataType, MemoryAccessFault, UnalignedMemoryAccessFault
+from evil.utils import make_bytes_dump
+
+
+class _Block:
+    """ Contents of a single address space, for every instance """
+    def __init__(self, memory: Memory, instances: int, shared: bool):
+        self.char_bit = memory.char_bit
+        self.aligned = isinstance(memory, StrictlyAlignedMemory)
+        # shared blocks have a single row, used by all instances
+        self.shared = shared
+        data = np.array(list(memory), dtype=np.min_scalar_type(2**memory.char_bit - 1))
+        self.data = data[np.newaxis, :] if shared else np.tile(data, (instances, 1))
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def rows(self, instances: np.ndarray) -> np.ndarray:
+        return np.zeros_like(instances) if self.shared else instances
+
+
+class LockstepMachine:
+    """
+    INSTANCES copies of a VM, each with its own registers, RAM, stack, GPU,
+    input device and random number generator, executing the program from
+    MEMORY_BLOCKS in lockstep.
+
+    INPUTS and SEEDS, if given, provide an input device and a seed for the
+    random number generator of every instance. GPU_FACTORY is called with
+    screen width and height to create the GPU of every instance.
+    """
+    def __init__(self,
+                 memory_blocks: Dict[str, Memory],
+                 instances: int,
+                 inputs: Sequence[Optional[Input]] = None,
+                 seeds: Sequence[Optional[int]] = None,
+                 gpu_factory: Callable[[int, int], GPU] = NullGPU,
+                 dtype=np.int64):
+        program = memory_blocks['program']
+        if memory_blocks['ram'] is program or memory_blocks['stack'] is program:
+            raise ValueError('program memory must not be writable in lockstep mode')
+        if inputs is not None and len(inputs) != instances:
+            raise ValueError('expected %d inputs, got %d' % (instances, len(inputs)))
+        if seeds is not None and len(seeds) != instances:
+            raise ValueError('expected %d seeds, got %d' % (instances, len(seeds)))
+
+        self.instances = instances
+        self.dtype = dtype
+
+        # register file index -> values for every instance
+        self.regs = np.zeros((len(make_register_file()), instances), dtype=dtype)
+        self.regs[REG_SP] = len(memory_blocks['ram'])
+        self.regs[REG_RP] = len(memory_blocks['stack'])
+
+        # aliased address spaces share a _Block
+        blocks = {}
+        self._blocks = {}
+        for name, mem in memory_blocks.items():
+            if id(mem) not in blocks:
+                blocks[id(mem)] = _Block(mem, instances, shared=(mem is program))
+            self._blocks[name] = blocks[id(mem)]
+
+        self.inputs = list(inputs) if inputs is not None else [None] * instances
+        self.rngs = [random.Random(seed) for seed in (seeds if seeds is not None else [None] * instances)]
+        self.gpus = [gpu_factory(80, 24) for _ in range(instances)]
+
+        self.halted = np.zeros(instances, dtype=bool)
+        # number of instructions executed by every instance
+        self.instructions_executed = np.zeros(instances, dtype=np.int64)
+
+        # decodes instructions and caches them, using the shared program
+        self._decoder = CPU()
+        self._decoder.program = program
+        self._decoder._max_instruction_size = max(op.size_bytes for op in CPU.OPERATIONS_BY_OPCODE.values())
+
+    def registers(self, instance: int) -> RegisterSet:
+        """ Returns a copy of INSTANCE registers """
+        return RegisterSet([int(v) for v in self.regs[:, instance]])
+
+    def memory(self, instance: int, name: str) -> List[int]:
+        """ Returns a copy of INSTANCE address space called NAME """
+        block = self._blocks[name]
+        return block.data[0 if block.shared else instance].tolist()
+
+    def _log_fault(self, instance: int, fault: Fault):
+        logging.error('instance %d: %s', instance, fault)
+
+    def _set_flags(self, instances: np.ndarray, values: np.ndarray):
+        self.regs[REG_F, instances] = np.where(values == 0, FLAG_ZERO,
+                                               np.where(values > 0, FLAG_GREATER, 0))
+
+    def _check_access(self,
+                      block: _Block,
+                      instances: np.ndarray,
+                      addrs: np.ndarray,
+                      datatype: DataType) -> np.ndarray:
+        """
+        Returns a mask of INSTANCES that may access DATATYPE at their ADDRS.
+        Logs a Fault for every other one.
+        """
+        valid = (addrs >= 0) & (addrs + datatype.size_bytes <= len(block))
+        if block.aligned:
+            valid &= (addrs % datatype.alignment == 0)
+        if valid.all():
+            return valid
+
+        for instance, addr in zip(instances[~valid], addrs[~valid]):
+            addr = int(addr)
+            if 0 <= addr and addr + datatype.size_bytes <= len(block):
+                self._log_fault(instance, UnalignedMemoryAccessFault(address=addr, alignment=datatype.alignment))
+            else:
+                self._log_fault(instance, MemoryAccessFault(addr, 0, len(block)))
+        return valid
+
+    def _load(self,
+              name: str,
+              fmt: str,
+              instances: np.ndarray,
+              addrs) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads a big-endian, sign-magnitude value of type FMT from address
+        space NAME at ADDRS. Returns instances that did not fault along with
+        values they read.
+        """
+        block = self._blocks[name]
+        datatype = DataType.from_fmt(fmt)
+        addrs = np.broadcast_to(np.asarray(addrs, dtype=np.int64), instances.shape)
+        valid = self._check_access(block, instances, addrs, datatype)
+        instances, addrs = instances[valid], addrs[valid]
+
+        columns = addrs[:, np.newaxis] + np.arange(datatype.size_bytes)
+        data = block.data[block.rows(instances)[:, np.newaxis], columns].astype(self.dtype)
+
+        msb = 1 << (block.char_bit - 1)
+        negative = (data[:, 0] & msb) != 0
+        data[:, 0] &= ~msb
+
+        values = np.zeros(len(instances), dtype=self.dtype)
+        for column in range(datatype.size_bytes):
+            values = (values << block.char_bit) | data[:, column]
+        return instances, np.where(negative, -values, values)
+
+    def _store(self,
+               name: str,
+               fmt: str,
+               instances: np.ndarray,
+               addrs,
+               values) -> np.ndarray:
+        """
+        Writes VALUES as big-endian, sign-magnitude values of type FMT to
+        address space NAME at ADDRS. Returns instances that did not fault.
+        """
+        block = self._blocks[name]
+        datatype = DataType.from_fmt(fmt)
+        addrs = np.broadcast_to(np.asarray(addrs, dtype=np.int64), instances.shape)
+        values = np.broadcast_to(np.asarray(values, dtype=self.dtype), instances.shape)
+
+        valid = self._check_access(block, instances, addrs, datatype)
+        instances, addrs, values = instances[valid], addrs[valid], values[valid]
+
+        magnitudes = abs(values)
+        max_value = 2**(block.char_bit * datatype.size_bytes) - 1
+        if (magnitudes > max_value).any():
+            raise ValueError('%d is too big to fit on %d %d-bit bytes (max: %d)'
+                             % (values[magnitudes > max_value][0], datatype.size_bytes,
+                                block.char_bit, max_value))
+
+        mask = 2**block.char_bit - 1
+        data = np.empty((len(instances), datatype.size_bytes), dtype=self.dtype)
+        for column in range(datatype.size_bytes):
+            shift = block.char_bit * (datatype.size_bytes - 1 - column)
+            data[:, column] = (magnitudes >> shift) & mask
+        data[:, 0] |= np.where(values < 0, 1 << (block.char_bit - 1), 0)
+
+        columns = addrs[:, np.newaxis] + np.arange(datatype.size_bytes)
+        block.data[block.rows(instances)[:, np.newaxis], columns] = data
+        return instances
+
+    def _load_chars(self, name: str, instance: int, addr: int, count: int) -> List[int]:
+        """
+        Reads COUNT bytes from INSTANCE address space NAME at ADDR, decoded
+        as by ldb.r
+        """
+        block = self._blocks[name]
+        count = max(count, 0)
+        self._check_range(block, addr, count)
+        row = 0 if block.shared else instance
+        return values_from_bytes(block.data[row, addr:addr + count].tolist(), block.char_bit)
+
+    def _check_range(self, block: _Block, addr: int, count: int):
+        """ Raises MemoryAccessFault unless COUNT bytes at ADDR are in BLOCK """
+        if addr < 0 or addr + count > len(block):
+            raise MemoryAccessFault(addr if addr < 0 or addr >= len(block) else addr + count,
+                                    0, len(block))
+
+    def _groups(self, instances: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        """ Splits INSTANCES into (IP, instances) groups """
+        ips = self.regs[REG_IP, instances]
+        if (ips == ips[0]).all():
+            return [(int(ips[0]), instances)]
+
+        order = np.argsort(ips, kind='stable')
+        ips = ips[order]
+        starts = np.concatenate(([0], np.flatnonzero(ips[1:] != ips[:-1]) + 1))
+        return [(int(ips[start]), group)
+                for start, group in zip(starts, np.split(instances[order], starts[1:]))]
+
+    def run(self, halt_after_instructions: Optional[int]) -> List[ExecutionStats]:
+        """
+        Executes instructions on all instances until every instance halts or
+        HALT_AFTER_INSTRUCTIONS instructions are executed. Returns
+        ExecutionStats of every instance.
+        """
+        decoded = self._decoder._decoded
+        decode = self._decoder._decode
+        regs = self.regs
+        executed = int(self.instructions_executed.max(initial=0))
+        active = np.flatnonzero(~self.halted)
+        start_time = time.time()
+
+        try:
+            while (len(active)
+                   and (halt_after_instructions is None or executed < halt_after_instructions)):
+                executed += 1
+                for ip, group in self._groups(active):
+                    try:
+                        op, args, next_ip = decoded.get(ip) or decode(ip)
+                    except Fault as err:
+                        for instance in group:
+                            self._log_fault(instance, err)
+                        continue
+
+                    regs[REG_IP, group] = next_ip
+                    try:
+                        implementation = VECTOR_OPERATIONS[op.mnemonic]
+                    except KeyError as err:
+                        raise NotImplementedError('%s is not supported in lockstep mode' % op.mnemonic) from err
+                    implementation(self, group, next_ip, *args)
+
+                self.instructions_executed[active] = executed
+                if self.halted[active].any():
+                    active = active[~self.halted[active]]
+        except KeyboardInterrupt:
+            self.instructions_executed[active] = executed
+            exit_reason = ExitReason.INTERRUPTED
+        else:
+            exit_reason = ExitReason.INSTRUCTION_LIMIT
+
+        elapsed_s = time.time() - start_time
+        for gpu in self.gpus:
+            gpu.refresh(force=True)
+
+        return [ExecutionStats(instructions_executed=int(self.instructions_executed[instance]),
+                               elapsed_s=elapsed_s,
+                               exit_reason=(ExitReason.HALTED if self.halted[instance] else exit_reason))
+                for instance in range(self.instances)]
+
+
+def _arith(operation: Callable, src_is_reg: bool):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, dst: int, src: int):
+        values = operation(m.regs[dst, instances], m.regs[src, instances] if src_is_reg else src)
+        m.regs[dst, instances] = values
+        m._set_flags(instances, values)
+    return run
+
+
+def _mod(values, divisors):
+    if np.any(np.asarray(divisors) == 0):
+        raise ZeroDivisionError('integer modulo by zero')
+    return values % divisors
+
+
+def _cmp(src_is_reg: bool):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, reg: int, src: int):
+        m._set_flags(instances, m.regs[reg, instances] - (m.regs[src, instances] if src_is_reg else src))
+    return run
+
+
+def _mov_i2r(m: LockstepMachine, instances: np.ndarray, _next_ip: int, reg: int, imm: int):
+    m.regs[reg, instances] = imm
+    m._set_flags(instances, m.regs[reg, instances])
+
+
+def _mov_r2r(m: LockstepMachine, instances: np.ndarray, _next_ip: int, dst: int, src: int):
+    m.regs[dst, instances] = m.regs[src, instances]
+    m._set_flags(instances, m.regs[dst, instances])
+
+
+def _load_imm(name: str, fmt: str):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, reg: int, addr: int):
+        instances, values = m._load(name, fmt, instances, addr)
+        m.regs[reg, instances] = values
+        m._set_flags(instances, values)
+    return run
+
+
+def _load_reg(name: str, fmt: str):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, dst: int, addr_reg: int):
+        instances, values = m._load(name, fmt, instances, m.regs[addr_reg, instances])
+        m.regs[dst, instances] = values
+        m._set_flags(instances, values)
+    return run
+
+
+def _store_imm(fmt: str):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr: int, reg: int):
+        m._store('ram', fmt, instances, addr, m.regs[reg, instances])
+    return run
+
+
+def _store_reg(fmt: str):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr_reg: int, val_reg: int):
+        m._store('ram', fmt, instances, m.regs[addr_reg, instances], m.regs[val_reg, instances])
+    return run
+
+
+def _jump_if(condition: Callable[[np.ndarray], np.ndarray]):
+    def run(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr: int):
+        m.regs[REG_IP, instances[condition(m.regs[REG_F, instances])]] = addr
+    return run
+
+
+def _jmp(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr: int):
+    m.regs[REG_IP, instances] = addr
+
+
+def _loop(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr: int):
+    counters = m.regs[REG_C, instances] - 1
+    m.regs[REG_C, instances] = counters
+    m.regs[REG_IP, instances[counters > 0]] = addr
+
+
+def _call(m: LockstepMachine, instances: np.ndarray, next_ip: int, addr: int):
+    m.regs[REG_RP, instances] -= DataType.calcsize('a')
+    instances = m._store('stack', 'a', instances, m.regs[REG_RP, instances], next_ip)
+    m.regs[REG_IP, instances] = addr
+
+
+def _call_r(m: LockstepMachine, instances: np.ndarray, next_ip: int, reg: int):
+    m.regs[REG_RP, instances] -= DataType.calcsize('a')
+    instances = m._store('stack', 'a', instances, m.regs[REG_RP, instances], next_ip)
+    m.regs[REG_IP, instances] = m.regs[reg, instances]
+
+
+def _ret(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    instances, addrs = m._load('stack', 'a', instances, m.regs[REG_RP, instances])
+    m.regs[REG_IP, instances] = addrs
+    m.regs[REG_RP, instances] += DataType.calcsize('a')
+
+
+def _push(m: LockstepMachine, instances: np.ndarray, _next_ip: int, reg: int):
+    m.regs[REG_SP, instances] -= DataType.calcsize('w')
+    m._store('ram', 'w', instances, m.regs[REG_SP, instances], m.regs[reg, instances])
+
+
+def _pop(m: LockstepMachine, instances: np.ndarray, _next_ip: int, reg: int):
+    instances, values = m._load('ram', 'w', instances, m.regs[REG_SP, instances])
+    m.regs[reg, instances] = values
+    m.regs[REG_SP, instances] += DataType.calcsize('w')
+
+
+def _in(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    for instance in instances:
+        input = m.inputs[instance]
+        char = input.get_char() if input is not None else None
+        if char is None:
+            char = -1
+        else:
+            logging.info('instance %d: in: %d', instance, char)
+        m.regs[REG_A, instance] = char
+    m._set_flags(instances, m.regs[REG_A, instances])
+
+
+def _rand(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    char_bit = m._blocks['ram'].char_bit
+    for instance in instances:
+        value = 0
+        for _ in range(DataType.calcsize('w')):
+            value *= 2**char_bit
+            value += m.rngs[instance].randint(0, 2**char_bit)
+        try:
+            m.regs[REG_A, instance] = value
+        except OverflowError as err:
+            raise OverflowError('instance %d: random value %d does not fit in %s; use dtype=object'
+                                % (instance, value, m.dtype)) from err
+    m._set_flags(instances, m.regs[REG_A, instances])
+
+
+def _out(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    for instance in instances:
+        try:
+            m.gpus[instance].put(int(m.regs[REG_A, instance]))
+        except Fault as err:
+            m._log_fault(instance, err)
+
+
+def _seek(m: LockstepMachine, instances: np.ndarray, _next_ip: int, x_reg: int, y_reg: int):
+    for instance in instances:
+        try:
+            m.gpus[instance].seek(x=int(m.regs[x_reg, instance]),
+                                  y=int(m.regs[y_reg, instance]))
+        except Fault as err:
+            m._log_fault(instance, err)
+
+
+def _flip(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    for instance in instances:
+        m.gpus[instance].flip()
+
+
+def _blit(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr_reg: int, count_reg: int):
+    for instance in instances:
+        try:
+            m.gpus[instance].write(m._load_chars('ram', instance,
+                                                 int(m.regs[addr_reg, instance]),
+                                                 int(m.regs[count_reg, instance])))
+        except Fault as err:
+            m._log_fault(instance, err)
+
+
+def _blit_x(m: LockstepMachine, instances: np.ndarray, _next_ip: int,
+            addr_reg: int, table_reg: int, count_reg: int):
+    for instance in instances:
+        try:
+            values = m._load_chars('ram', instance,
+                                   int(m.regs[addr_reg, instance]),
+                                   int(m.regs[count_reg, instance]))
+            table = int(m.regs[table_reg, instance])
+            glyphs = {value: m._load_chars('program', instance, table + value, 1)[0]
+                      for value in set(values)}
+            m.gpus[instance].write([glyphs[value] for value in values])
+        except Fault as err:
+            m._log_fault(instance, err)
+
+
+def _fill(m: LockstepMachine, instances: np.ndarray, _next_ip: int, char_reg: int, count_reg: int):
+    for instance in instances:
+        try:
+            m.gpus[instance].fill(int(m.regs[char_reg, instance]),
+                                  int(m.regs[count_reg, instance]))
+        except Fault as err:
+            m._log_fault(instance, err)
+
+
+def _memcpy(m: LockstepMachine, instances: np.ndarray, _next_ip: int,
+            dst_reg: int, src_reg: int, count_reg: int):
+    block = m._blocks['ram']
+    for instance in instances:
+        dst, src, count = (int(m.regs[reg, instance]) for reg in (dst_reg, src_reg, count_reg))
+        if count <= 0:
+            continue
+        try:
+            m._check_range(block, dst, count)
+            m._check_range(block, src, count)
+        except Fault as err:
+            m._log_fault(instance, err)
+            continue
+        row = block.data[0 if block.shared else instance]
+        row[dst:dst + count] = row[src:src + count].copy()
+
+
+def _memset(m: LockstepMachine, instances: np.ndarray, _next_ip: int,
+            dst_reg: int, val_reg: int, count_reg: int):
+    block = m._blocks['ram']
+    for instance in instances:
+        dst, value, count = (int(m.regs[reg, instance]) for reg in (dst_reg, val_reg, count_reg))
+        if count <= 0:
+            continue
+        try:
+            m._check_range(block, dst, count)
+        except Fault as err:
+            m._log_fault(instance, err)
+            continue
+        byte, = bytes_from_value(Endianness.Big, value, block.char_bit, 1)
+        block.data[0 if block.shared else instance, dst:dst + count] = byte
+
+
+def _memcmp(m: LockstepMachine, instances: np.ndarray, _next_ip: int,
+            lhs_reg: int, rhs_reg: int, count_reg: int):
+    compared = []
+    differences = []
+    for instance in instances:
+        lhs, rhs, count = (int(m.regs[reg, instance]) for reg in (lhs_reg, rhs_reg, count_reg))
+        try:
+            lhs_values = m._load_chars('ram', instance, lhs, count)
+            rhs_values = m._load_chars('ram', instance, rhs, count)
+        except Fault as err:
+            m._log_fault(instance, err)
+            continue
+        compared.append(instance)
+        differences.append(next((a - b for a, b in zip(lhs_values, rhs_values) if a != b), 0))
+    m._set_flags(np.array(compared, dtype=instances.dtype), np.array(differences, dtype=m.dtype))
+
+
+def _halt(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    m.halted[instances] = True
+
+
+def _dbg_reg(m: LockstepMachine, instances: np.ndarray, _next_ip: int, reg: int):
+    for instance in instances:
+        value = int(m.regs[reg, instance])
+        print('instance %d: %08x: %s = %d (%x)' % (instance, int(m.regs[REG_IP, instance]),
+                                                   Register(reg).name, value, value),
+              file=sys.stderr)
+
+
+def _dbg_regs(m: LockstepMachine, instances: np.ndarray, _next_ip: int):
+    for instance in instances:
+        print('--- INSTANCE %d ---\n%s' % (instance, m.registers(instance)), file=sys.stderr)
+
+
+def _dbg_ram(m: LockstepMachine, instances: np.ndarray, _next_ip: int, addr: int, size: int):
+    for instance in instances:
+        print('--- INSTANCE %d ---\n%s' % (instance, make_bytes_dump(m.memory(instance, 'ram')[addr:addr+size],
+                                                                   m._blocks['ram'].char_bit,
+                                                                   alignment=4, address_base=addr)),
+              file=sys.stderr)
+
+
+# mnemonic -> implementation called as implementation(machine, instances, next_ip, *args),
+# after IP of INSTANCES is set to next_ip. Operations not listed here are not
+# supported in lockstep mode.
+VECTOR_OPERATIONS = {
+    'movw.r2r': _mov_r2r,
+    'movb.i2r': _mov_i2r,
+    'movw.i2r': _mov_i2r,
+    'movb.m2r': _load_imm('ram', 'b'),
+    'movw.m2r': _load_imm('ram', 'w'),
+    'movb.r2m': _store_imm('b'),
+    'movw.r2m': _store_imm('w'),
+    'lpb.r': _load_reg('program', 'b'),
+    'lpa.r': _load_reg('program', 'a'),
+    'lpw.r': _load_reg('program', 'w'),
+    'ldb.r': _load_reg('ram', 'b'),
+    'lda.r': _load_reg('ram', 'a'),
+    'ldw.r': _load_reg('ram', 'w'),
+    'stb.r': _store_reg('b'),
+    'sta.r': _store_reg('a'),
+    'stw.r': _store_reg('w'),
+    'jmp': _jmp,
+    'out': _out,
+    'in': _in,
+    'seek': _seek,
+    'call': _call,
+    'call.r': _call_r,
+    'ret': _ret,
+    'push': _push,
+    'pop': _pop,
+    'add.b': _arith(np.add, False),
+    'add.w': _arith(np.add, False),
+    'add.r': _arith(np.add, True),
+    'sub.b': _arith(np.subtract, False),
+    'sub.w': _arith(np.subtract, False),
+    'sub.r': _arith(np.subtract, True),
+    'mul.b': _arith(np.multiply, False),
+    'mul.w': _arith(np.multiply, False),
+    'mul.r': _arith(np.multiply, True),
+    'mod.b': _arith(_mod, False),
+    'mod.w': _arith(_mod, False),
+    'mod.r': _arith(_mod, True),
+    'and.b': _arith(np.bitwise_and, False),
+    'and.w': _arith(np.bitwise_and, False),
+    'and.r': _arith(np.bitwise_and, True),
+    'or.b': _arith(np.bitwise_or, False),
+    'or.w': _arith(np.bitwise_or, False),
+    'or.r': _arith(np.bitwise_or, True),
+    'shr.b': _arith(np.right_shift, False),
+    'shl.b': _arith(np.left_shift, False),
+    'cmp.b': _cmp(False),
+    'cmp.w': _cmp(False),
+    'cmp.r': _cmp(True),
+    'je': _jump_if(lambda flags: (flags & FLAG_ZERO) != 0),
+    'jne': _jump_if(lambda flags: (flags & FLAG_ZERO) == 0),
+    'ja': _jump_if(lambda flags: (flags & FLAG_GREATER) != 0),
+    'jae': _jump_if(lambda flags: (flags & (FLAG_ZERO | FLAG_GREATER)) != 0),
+    'jb': _jump_if(lambda flags: (flags & (FLAG_ZERO | FLAG_GREATER)) == 0),
+    'jbe': _jump_if(lambda flags: (flags & FLAG_GREATER) == 0),
+    'loop': _loop,
+    'rand': _rand,
+    'halt': _halt,
+    'dbg': _dbg_regs,
+    'dbg.reg': _dbg_reg,
+    'dbg.regs': _dbg_regs,
+    'dbg.ram': _dbg_ram,
+    'flip': _flip,
+    'blit': _blit,
+    'blit.x': _blit_x,
+    'fill': _fill,
+    'memcpy': _memcpy,
+    'memset': _memset,
+    'memcmp': _memcmp,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser('evil lockstep',
+                                     description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(dest='source',
+                        help='Assembly source file')
+    parser.add_argument('-n', '--instances',
+                        type=int,
+                        required=True,
+                        help='Number of instances to run')
+    parser.add_argument('-c', '--config',
+                        type=json.loads,
+                        default={},
+                        help='Machine configuration, as a JSON object with MachineConfig fields, '
+                             'e.g. \'{"ram_size": 1024}\'')
+    parser.add_argument('-s', '--seed',
+                        type=int,
+                        default=None,
+                        help='Random number generator seed of the first instance; '
+                             'following instances use consecutive seeds')
+    parser.add_argument('-i', '--input-file',
+                        action='append',
+                        default=[],
+                        help='File to feed to an instance as keyboard input. May be given once per instance, '
+                             'or once for all instances')
+    parser.add_argument('-H', '--halt-after-instructions',
+                        type=int,
+                        default=None,
+                        help='Stop every instance after executing that many instructions')
+    parser.add_argument('--object-registers',
+                        action='store_true',
+                        help='Store registers as Python integers instead of int64. Slower, but values never overflow')
+    parser.add_argument('-o', '--output',
+                        default=None,
+                        help='File to write results to. Default: stdout')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(os.environ.get('LOGLEVEL', 'WARNING'))
+
+    unknown = set(args.config) - set(MachineConfig._fields)
+    if unknown:
+        parser.error('unknown config keys: %s' % ', '.join(sorted(unknown)))
+    if args.config.get('framebuffer_addr') is not None:
+        parser.error('framebuffer_addr is not supported in lockstep mode')
+    if args.config.get('paged_ram'):
+        parser.error('paged_ram is not supported in lockstep mode')
+    if len(args.input_file) not in (0, 1, args.instances):
+        parser.error('--input-file must be given once, or once per instance')
+
+    config = MachineConfig(**args.config)
+    with open(args.source) as infile:
+        memory_blocks = config.create_memory_blocks(infile.read())
+
+    inputs = None
+    if args.input_file:
+        paths = args.input_file * (args.instances // len(args.input_file))
+        inputs = [ScriptedInput.from_file(path) for path in paths]
+
+    seeds = [None] * args.instances
+    if args.seed is not None:
+        seeds = [args.seed + instance for instance in range(args.instances)]
+
+    machine = LockstepMachine(memory_blocks, args.instances,
+                              inputs=inputs,
+                              seeds=seeds,
+                              dtype=(object if args.object_registers else np.int64))
+    all_stats = machine.run(args.halt_after_instructions)
+
+    outfile = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for instance, stats in enumerate(all_stats):
+            result = {'instance': instance,
+                      'seed': seeds[instance],
+                      'exit_reason': stats.exit_reason.value,
+                      'instructions_executed': stats.instructions_executed,
+                      'registers': {reg.name: machine.registers(instance)[reg] for reg in Register.all()},
+                      'screen_sha256': hashlib.sha256(machine.gpus[instance].dump().encode('utf-8')).hexdigest()}
+            outfile.write(json.dumps(result) + '\n')
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    total = sum(stats.instructions_executed for stats in all_stats)
+    elapsed_s = all_stats[0].elapsed_s if all_stats else 0.0
+    logging.info('%f instructions/s across all instances', total / elapsed_s if elapsed_s > 0 else 0.0)
+
+
+if __name__ == '__main__':
+    main()
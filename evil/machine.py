@@ -0,0 +1,100 @@
+"""
+Machine configuration: data type sizes, address spaces and execution engines
+of a VM instance.
+"""
+
+from typing import Dict, NamedTuple, Optional, Sequence
+
+from evil.assembler import Assembler
+from evil.cpu import Interpreter
+from evil.jit import BlockEngine
+from evil.fusion import FusingInterpreter
+from evil.gpu import GPU
+from evil.memory import Memory, MemoryRegion, StrictlyAlignedMemory, DataType, PagedStorage, map_file
+
+ENGINES = {
+    'interpreter': Interpreter,
+    'blocks': BlockEngine,
+    'fused': FusingInterpreter,
+}
+
+
+class MachineConfig(NamedTuple):
+    char_bit: int = 9
+    word_size: int = 7
+    # None = equal to word_size
+    word_alignment: Optional[int] = None
+    addr_size: int = 5
+    # None = equal to addr_size
+    addr_alignment: Optional[int] = None
+    # in bytes; None = just large enough to accomodate program bytecode
+    program_size: Optional[int] = None
+    # in machine words
+    ram_size: int = 8
+    # in addresses
+    stack_size: int = 8
+    # address space remappings, e.g. 'ram=program'
+    map_memory: Sequence[str] = ()
+    # RAM address the GPU framebuffer is mapped at; None = not mapped
+    framebuffer_addr: Optional[int] = None
+    # file RAM contents are mapped onto; None = RAM is kept in process memory
+    ram_file: Optional[str] = None
+    # allocate RAM in pages on first write, so that a large, sparsely used
+    # RAM only costs the pages in use
+    paged_ram: bool = False
+
+    def configure_datatypes(self):
+        """
+        Sets machine word and address sizes. Note: these are global, so
+        only one configuration may be used by a process at a time.
+        """
+        DataType._TYPES['w'] = DataType(name='w',
+                                        size_bytes=self.word_size,
+                                        alignment=(self.word_alignment or self.word_size))
+        DataType._TYPES['a'] = DataType(name='a',
+                                        size_bytes=self.addr_size,
+                                        alignment=(self.addr_alignment or self.addr_size))
+
+    def create_memory_blocks(self, source: str) -> Dict[str, Memory]:
+        """
+        Configures data types, assembles SOURCE and creates program, ram and
+        stack address spaces, mapped according to map_memory.
+        """
+        self.configure_datatypes()
+
+        blocks = {}
+        asm = Assembler(char_bit=self.char_bit)
+        if self.program_size is None:
+            blocks['program'] = asm.assemble_to_memory(source)
+        else:
+            blocks['program'] = Memory(char_bit=self.char_bit,
+                                       value=asm.assemble(source),
+                                       size=self.program_size)
+
+        ram_bytes = DataType.calcsize('w') * self.ram_size
+        if self.ram_file is not None and self.paged_ram:
+            raise ValueError('paged RAM cannot be mapped onto a file')
+        if self.ram_file is not None:
+            blocks['ram'] = StrictlyAlignedMemory(char_bit=self.char_bit,
+                                                  storage=map_file(self.ram_file, self.char_bit, ram_bytes))
+        elif self.paged_ram:
+            blocks['ram'] = StrictlyAlignedMemory(char_bit=self.char_bit,
+                                                  storage=PagedStorage(self.char_bit, ram_bytes))
+        else:
+            blocks['ram'] = StrictlyAlignedMemory(char_bit=self.char_bit, size=ram_bytes)
+        blocks['stack'] = StrictlyAlignedMemory(char_bit=self.char_bit, size=DataType.calcsize('a') * self.stack_size)
+
+        for mapping in self.map_memory:
+            dst, src = mapping.split('=', maxsplit=1)
+            if src not in blocks or dst not in blocks:
+                raise ValueError('invalid memory mapping: %s' % mapping)
+
+            blocks[dst] = blocks[src]
+
+        return blocks
+
+    def map_framebuffer(self, memory_blocks: Dict[str, Memory], gpu: GPU):
+        """ Maps the framebuffer of GPU into RAM, if framebuffer_addr is set """
+        if self.framebuffer_addr is not None:
+            gpu.map_memory(MemoryRegion(memory_blocks['ram'], self.framebuffer_addr,
+                                        gpu.width * gpu.height))
@@ -1,7 +1,12 @@
-from typing import List, NamedTuple, Any, Tuple
+import copy
+import functools
+import mmap
+import os
+from array import array
+from typing import List, NamedTuple, Any, Tuple, Callable, Optional, MutableSequence, Sequence, Union
 
 from evil.utils import make_bytes_dump
-from evil.endianness import Endianness, bytes_from_value, value_from_bytes
+from evil.endianness import Endianness, Codec, get_codec, values_from_bytes
 from evil.fault import Fault
 
 
@@ -41,70 +46,381 @@ class MemoryAccessFault(Fault):
         super().__init__('Invalid memory access - address %d is not in range [%d, %d)'
                          % (addr, valid_begin, valid_end))
 
+def make_storage(char_bit: int, value: Sequence[int] = ()) -> MutableSequence[int]:
+    """
+    Returns a copy of VALUE in the most compact container that holds
+    CHAR_BIT-bit bytes: a bytearray, an array('H') or array('I'), or a list
+    for bytes wider than 32 bits.
+    """
+    if char_bit <= 8:
+        return bytearray(value)
+    if char_bit <= 16:
+        return array('H', value)
+    if char_bit <= 32 and array('I').itemsize >= 4:
+        return array('I', value)
+    return list(value)
+
+
+# (maximum char_bit, typecode) of fixed-width cells of mapped files
+_FILE_CELLS = [(8, 'B'), (16, 'H'), (32, 'I'), (64, 'Q')]
+
+
+def map_file(path: str, char_bit: int, size: int) -> memoryview:
+    """
+    Maps SIZE CHAR_BIT-bit bytes onto the file at PATH, to be used as
+    storage of a Memory block. The file is created or extended with zero
+    bytes if needed; existing contents are kept and not validated.
+
+    Every byte occupies a fixed-width cell of 1, 2, 4 or 8 octets, in native
+    byte order, so other processes may map the same file to inspect memory
+    as it changes.
+    """
+    try:
+        typecode = next(typecode for max_char_bit, typecode in _FILE_CELLS if char_bit <= max_char_bit)
+    except StopIteration:
+        raise ValueError('cannot map %d-bit bytes to a file' % char_bit) from None
+    if size <= 0:
+        raise ValueError('cannot map %d bytes to a file' % size)
+
+    length = size * array(typecode).itemsize
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < length:
+            os.ftruncate(fd, length)
+        mapping = mmap.mmap(fd, length)
+    finally:
+        os.close(fd)
+    return memoryview(mapping).cast(typecode)
+
+
+# log2 of the number of bytes in a page of PagedStorage
+PAGE_BITS = 12
+
+
+class PagedStorage:
+    """
+    Storage of SIZE CHAR_BIT-bit bytes split into pages of 2**PAGE_BITS
+    bytes, allocated on first write. Untouched pages read as zero bytes, so
+    a large, sparsely used address space costs only the pages in use.
+
+    Supports the part of the sequence protocol Memory relies on: len(),
+    iteration, and indexing and slicing with a step of 1.
+    """
+    def __init__(self, char_bit: int, size: int, page_bits: int = PAGE_BITS):
+        if size < 0:
+            raise ValueError('invalid storage size: %d' % size)
+
+        self._size = size
+        self._page_bits = page_bits
+        self._page_size = 1 << page_bits
+        self._offset_mask = self._page_size - 1
+        self._blank_page = make_storage(char_bit, [0]) * self._page_size
+        # page index -> view of page contents
+        self._pages = {}
+        # pages not shared with forks, which may be written in place
+        self._writable = {}
+        # read-only page returned for pages that were never written
+        self._zero_page = self._make_view(self._blank_page)
+        self._pack = (functools.partial(array, self._zero_page.format)
+                      if isinstance(self._zero_page, memoryview) else None)
+
+    @staticmethod
+    def _make_view(page: MutableSequence[int]) -> MutableSequence[int]:
+        return page if isinstance(page, list) else memoryview(page)
+
+    @property
+    def num_pages(self) -> int:
+        """ Number of pages allocated so far """
+        return len(self._pages)
+
+    def _writable_page(self, index: int) -> MutableSequence[int]:
+        try:
+            return self._writable[index]
+        except KeyError:
+            shared = self._pages.get(index)
+            if shared is None:
+                contents = self._blank_page
+            else:
+                contents = shared if isinstance(shared, list) else shared.obj
+            page = self._pages[index] = self._writable[index] = self._make_view(contents[:])
+            return page
+
+    def fork(self) -> 'PagedStorage':
+        """
+        Returns a copy of this storage that shares all pages with it. Both
+        copies make a private copy of a shared page before writing to it,
+        so forking costs time proportional to the number of pages in use.
+        """
+        clone = copy.copy(self)
+        clone._pages = dict(self._pages)
+        clone._writable = {}
+        self._writable = {}
+        return clone
+
+    def _slice_range(self, key: slice) -> Tuple[int, int]:
+        start, stop, step = key.indices(self._size)
+        if step != 1:
+            raise ValueError('paged storage does not support extended slices')
+        return start, max(start, stop)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for base in range(0, self._size, self._page_size):
+            page = self._pages.get(base >> self._page_bits, self._zero_page)
+            yield from page[:self._size - base]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self._slice_range(key)
+            index = start >> self._page_bits
+            offset = start & self._offset_mask
+            if offset + stop - start <= self._page_size:
+                # fast path: slice within a single page
+                return self._pages.get(index, self._zero_page)[offset:offset + stop - start]
+
+            result = []
+            while start < stop:
+                index = start >> self._page_bits
+                offset = start & self._offset_mask
+                count = min(stop - start, self._page_size - offset)
+                result.extend(self._pages.get(index, self._zero_page)[offset:offset + count])
+                start += count
+            return result
+
+        if not 0 <= key < self._size:
+            raise IndexError('address %d out of range' % key)
+        page = self._pages.get(key >> self._page_bits)
+        return 0 if page is None else page[key & self._offset_mask]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self._slice_range(key)
+            if len(value) != stop - start:
+                raise ValueError('paged storage cannot be resized')
+
+            offset = start & self._offset_mask
+            if offset + stop - start <= self._page_size:
+                # fast path: slice within a single page
+                self._writable_page(start >> self._page_bits)[offset:offset + stop - start] = (
+                    self._pack(value) if self._pack else value)
+                return
+
+            done = 0
+            while start < stop:
+                offset = start & self._offset_mask
+                count = min(stop - start, self._page_size - offset)
+                chunk = value[done:done + count]
+                self._writable_page(start >> self._page_bits)[offset:offset + count] = (
+                    self._pack(chunk) if self._pack else chunk)
+                start += count
+                done += count
+            return
+
+        if not 0 <= key < self._size:
+            raise IndexError('address %d out of range' % key)
+        self._writable_page(key >> self._page_bits)[key & self._offset_mask] = value
+
+
 class Memory:
     def __init__(self,
                  char_bit: int,
                  size: int = None,
-                 value: List[int] = None):
+                 value: List[int] = None,
+                 storage: Union[memoryview, PagedStorage] = None):
+        """
+        STORAGE, if given, holds the bytes instead of a container allocated
+        for VALUE and SIZE, e.g. a file mapped with map_file() or
+        a PagedStorage.
+        """
         self._char_bit = char_bit
-
-        if value:
-            for idx, byte in enumerate(value):
-                if byte >= 2**char_bit:
-                    raise ValueError('byte %d at offset %d is larger than the limit imposed '
-                                     'by given char_bit = %d' % (byte, idx, char_bit))
-
-        if not size:
-            self._memory = list(value)
+        self._write_listeners = []
+
+        if storage is not None:
+            self._memory = storage
+            self._view = storage
+            self._codecs = {}
+            self._pack = self._make_pack(storage)
+            return
+
+        value = value if value is not None else []
+        if len(value) and (min(value) < 0 or max(value) >= 2**char_bit):
+            idx, byte = next((idx, byte) for idx, byte in enumerate(value)
+                             if not 0 <= byte < 2**char_bit)
+            raise ValueError('byte %d at offset %d is outside the limit imposed '
+                             'by given char_bit = %d' % (byte, idx, char_bit))
+
+        self._memory = make_storage(char_bit, value)
+        if size and size > len(self._memory):
+            self._memory.extend(make_storage(char_bit, [0]) * (size - len(self._memory)))
+        self._make_view()
+
+        # (endianness, num_bytes) -> Codec
+        self._codecs = {}
+        # converts encoded bytes to something that can be assigned to a
+        # slice of storage
+        self._pack = self._make_pack(self._memory)
+
+    @staticmethod
+    def _make_pack(storage) -> Optional[Callable[[List[int]], Sequence[int]]]:
+        if isinstance(storage, array):
+            return functools.partial(array, storage.typecode)
+        if isinstance(storage, memoryview):
+            return functools.partial(array, storage.format)
+        # bytearrays, lists and PagedStorage accept lists of ints
+        return None
+
+    def _make_view(self):
+        # zero-copy slices of typed storage; lists are sliced directly
+        self._view = self._memory if isinstance(self._memory, list) else memoryview(self._memory)
+
+    def _codec(self, endianness: Endianness, num_bytes: int) -> Codec:
+        try:
+            return self._codecs[endianness, num_bytes]
+        except KeyError:
+            codec = self._codecs[endianness, num_bytes] = get_codec(endianness, self.char_bit, num_bytes)
+            return codec
+
+    def _resize(self, size: int):
+        """ Appends zero bytes to make the memory SIZE bytes long """
+        if isinstance(self._memory, (memoryview, PagedStorage)):
+            raise ValueError('external memory storage cannot be resized')
+        if isinstance(self._view, memoryview):
+            # typed storage cannot be resized while a view exists
+            self._view.release()
+        self._memory.extend(make_storage(self.char_bit, [0]) * (size - len(self._memory)))
+        self._make_view()
+
+    def fork(self) -> 'Memory':
+        """
+        Returns an independent copy of this memory block, without write
+        listeners. PagedStorage is shared copy-on-write, page by page; other
+        storage, including files mapped with map_file(), is copied into
+        process memory.
+        """
+        clone = copy.copy(self)
+        clone._write_listeners = []
+        if isinstance(self._memory, PagedStorage):
+            clone._memory = clone._view = self._memory.fork()
         else:
-            self._memory = ([0] * size)
-            if value:
-                self._memory[:len(value)] = value
+            clone._memory = make_storage(self.char_bit, self._memory)
+            clone._make_view()
+            clone._pack = self._make_pack(clone._memory)
+        return clone
+
+    def _check_range(self, addr: int, size: int):
+        if addr < 0 or addr + size > len(self._memory):
+            raise MemoryAccessFault(addr if addr < 0 or addr >= len(self._memory) else addr + size,
+                                    0, len(self._memory))
 
     @property
     def char_bit(self) -> int:
         return self._char_bit
 
+    @property
+    def paged(self) -> bool:
+        """ True if bytes are kept in a PagedStorage """
+        return isinstance(self._memory, PagedStorage)
+
+    def add_write_listener(self, listener: Callable[[int, int], None]):
+        """
+        Registers LISTENER to be called as listener(addr, size) after every
+        write to this memory block.
+        """
+        self._write_listeners.append(listener)
+
+    def remove_write_listener(self, listener: Callable[[int, int], None]):
+        self._write_listeners.remove(listener)
+
+    def _notify_write(self, addr: int, size: int):
+        for listener in self._write_listeners:
+            listener(addr, size)
+
     def __len__(self):
         return len(self._memory)
 
+    def __iter__(self):
+        return iter(self._memory)
+
     def __getitem__(self,
                     addr: int) -> int:
+        """ Returns a byte, or a zero-copy view of a slice of bytes """
         try:
-            return self._memory[addr]
+            return self._view[addr]
         except IndexError as err:
             raise MemoryAccessFault(addr, 0, len(self)) from err
 
     def __setitem__(self,
                     addr: int,
                     val: int):
-        if val >= 2**self.char_bit:
-            raise ValueError('%d is too big to fit in a single %d-bit byte (max: %d)'
-                             % (val, self.char_bit, 2**self.char_bit - 2))
+        if not 0 <= val < 2**self.char_bit:
+            raise ValueError('%d does not fit in a single %d-bit byte (max: %d)'
+                             % (val, self.char_bit, 2**self.char_bit - 1))
 
         try:
             self._memory[addr] = val
         except IndexError as err:
             raise MemoryAccessFault(addr, 0, len(self)) from err
 
+        if self._write_listeners:
+            self._notify_write(addr, 1)
+
+    def get_bytes(self, addr: int, size: int) -> List[int]:
+        """ Returns a copy of SIZE raw bytes starting at ADDR """
+        self._check_range(addr, max(size, 0))
+        data = self._view[addr:addr+size]
+        return data if isinstance(data, list) else data.tolist()
+
+    def copy_bytes(self, dst: int, src: int, size: int):
+        """
+        Copies SIZE raw bytes from SRC to DST. Overlapping ranges are
+        handled as if the bytes were copied through a temporary buffer.
+        """
+        if size <= 0:
+            return
+        self._check_range(dst, size)
+        data = self.get_bytes(src, size)
+        self._memory[dst:dst+size] = self._pack(data) if self._pack else data
+
+        if self._write_listeners:
+            self._notify_write(dst, size)
+
+    def fill_bytes(self,
+                   addr: int,
+                   value: int,
+                   size: int,
+                   endianness: Endianness = Endianness.Big):
+        """ Stores VALUE as a single byte at SIZE consecutive addresses from ADDR """
+        if size <= 0:
+            return
+        self._check_range(addr, size)
+        data = self._codec(endianness, 1).encode(value) * size
+        self._memory[addr:addr+size] = self._pack(data) if self._pack else data
+
+        if self._write_listeners:
+            self._notify_write(addr, size)
+
     def _get_datatype(self,
                       addr: int,
                       datatype: DataType,
                       endianness: Endianness) -> int:
-        return value_from_bytes(endianness=endianness,
-                                val_bytes=self._memory[addr:addr+datatype.size_bytes],
-                                char_bit=self.char_bit)
+        size = datatype.size_bytes
+        self._check_range(addr, size)
+        return self._codec(endianness, size).decode(self._view[addr:addr+size])
 
     def _set_datatype(self,
                       addr: int,
                       value: int,
                       datatype: DataType,
                       endianness: Endianness):
-        self._memory[addr:addr+datatype.size_bytes] = \
-                bytes_from_value(endianness=endianness,
-                                 value=value,
-                                 char_bit=self.char_bit,
-                                 num_bytes=datatype.size_bytes)
+        size = datatype.size_bytes
+        self._check_range(addr, size)
+        encoded = self._codec(endianness, size).encode(value)
+        self._memory[addr:addr+size] = self._pack(encoded) if self._pack else encoded
+
+        if self._write_listeners:
+            self._notify_write(addr, size)
 
     def _get_fmt_impl(self,
                       fmt_c: str,
@@ -147,6 +463,64 @@ class Memory:
         return self.make_dump(DataType.from_fmt('w').alignment)
 
 
+class MemoryRegion:
+    """
+    Range of SIZE bytes of MEMORY starting at START, mapped to a device.
+
+    Writes that hit the region are recorded as a single dirty span, which
+    the device consumes with take_dirty(). The whole region is dirty when
+    mapped, so the device picks up its initial contents.
+    """
+    def __init__(self, memory: Memory, start: int, size: int):
+        if start < 0 or size < 0 or start + size > len(memory):
+            raise ValueError('region [%d, %d) does not fit in memory of size %d'
+                             % (start, start + size, len(memory)))
+
+        self.memory = memory
+        self.start = start
+        self.size = size
+        # dirty span, relative to START; nothing is dirty if begin >= end
+        self._dirty_begin = 0
+        self._dirty_end = size
+
+        memory.add_write_listener(self._on_write)
+
+    def _on_write(self, addr: int, size: int):
+        begin = addr - self.start
+        end = begin + size
+        if end <= 0 or begin >= self.size:
+            return
+        if begin < self._dirty_begin:
+            self._dirty_begin = max(begin, 0)
+        if end > self._dirty_end:
+            self._dirty_end = min(end, self.size)
+
+    def take_dirty(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns the [begin, end) span, relative to the start of the region,
+        written since the last call, or None if nothing was written
+        """
+        if self._dirty_begin >= self._dirty_end:
+            return None
+
+        span = (self._dirty_begin, self._dirty_end)
+        self._dirty_begin = self.size
+        self._dirty_end = 0
+        return span
+
+    def get_values(self, begin: int, end: int) -> List[int]:
+        """
+        Returns bytes [begin, end) of the region, each decoded as a
+        single-byte value
+        """
+        return values_from_bytes(self.memory.get_bytes(self.start + begin, end - begin),
+                                 self.memory.char_bit)
+
+    def close(self):
+        """ Stops tracking writes """
+        self.memory.remove_write_listener(self._on_write)
+
+
 class UnalignedMemoryAccessFault(Fault):
     def __init__(self, address: int, alignment: int):
         super().__init__('Address %#x is not %d-byte aligned' % (address, alignment))
@@ -174,13 +548,13 @@ class StrictlyAlignedMemory(Memory):
 
 
 class ExtendableMemory(Memory):
-    def __init__(self, char_bit: int):
+    def __init__(self, char_bit: int, value: List[int] = None):
         super().__init__(char_bit=char_bit,
-                         value=[])
+                         value=(value or []))
 
     def _resize_if_required(self, desired_size: int):
         if len(self) < desired_size:
-            self._memory += [0] * (desired_size - len(self))
+            self._resize(desired_size)
 
     def __setitem__(self, addr: int, val: int):
         self._resize_if_required(addr + 1)
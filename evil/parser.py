@@ -155,8 +155,9 @@ class Match:
 class Statement:
     @staticmethod
     def parse(text: str) -> Optional['Statement']:
+        # keep leading whitespace, so that token columns match source lines
+        tokens = tokenize(text.rstrip())
         text = text.strip()
-        tokens = tokenize(text)
 
         if not tokens:
             return None
@@ -172,7 +173,7 @@ class Statement:
                 return Instruction.build(tokens)
         if matches(tokens[:1], [';']):
             return None
-        raise ValueError('unable to parse statement: %s', text)
+        raise ValueError('unable to parse statement at column %d: %s' % (tokens[0].column, text))
 
 
 class ConstantDefinition(NamedTuple, Statement):
@@ -0,0 +1,170 @@
+"""
+Execution profiling: counts executions and accumulated wall time of every
+instruction, and reports them per operation mnemonic and per IP.
+"""
+
+import collections
+import json
+import logging
+import marshal
+import time
+from typing import Iterator, List, NamedTuple, Optional, TextIO
+
+from evil.cpu import CPU, Interpreter, Operation, REG_IP
+from evil.fault import Fault
+
+
+class ProfileEntry(NamedTuple):
+    # mnemonic or IP, depending on how the entries were grouped
+    key: object
+    mnemonic: str
+    count: int
+    time_s: float
+
+
+class Profile:
+    """ Execution counts and times, collected by ProfilingInterpreter """
+    def __init__(self):
+        # IP -> [operation, count, time_s]
+        self._by_ip = {}
+        # (IP, [operation, count, time_s]) of entries replaced in _by_ip
+        # because the program modified itself
+        self._replaced = []
+
+    def _replace(self, ip: int, op: Operation) -> list:
+        if ip in self._by_ip:
+            self._replaced.append((ip, self._by_ip[ip]))
+        entry = self._by_ip[ip] = [op, 0, 0.0]
+        return entry
+
+    def _entries(self) -> Iterator[ProfileEntry]:
+        for ip, (op, count, time_s) in list(self._by_ip.items()) + self._replaced:
+            yield ProfileEntry(key=ip, mnemonic=op.mnemonic, count=count, time_s=time_s)
+
+    @property
+    def instructions_executed(self) -> int:
+        return sum(e.count for e in self._entries())
+
+    @property
+    def time_s(self) -> float:
+        return sum(e.time_s for e in self._entries())
+
+    def by_ip(self) -> List[ProfileEntry]:
+        """ Returns per-IP entries, most time-consuming first """
+        return sorted(self._entries(), key=lambda e: (-e.time_s, e.key))
+
+    def by_mnemonic(self) -> List[ProfileEntry]:
+        """ Returns per-operation entries, most time-consuming first """
+        counts = collections.Counter()
+        times = collections.Counter()
+        for entry in self._entries():
+            counts[entry.mnemonic] += entry.count
+            times[entry.mnemonic] += entry.time_s
+
+        entries = [ProfileEntry(key=mnemonic, mnemonic=mnemonic, count=counts[mnemonic], time_s=times[mnemonic])
+                   for mnemonic in counts]
+        return sorted(entries, key=lambda e: (-e.time_s, e.key))
+
+    def format_table(self, limit: Optional[int] = 20) -> str:
+        """
+        Returns a text report: all operations, followed by LIMIT (or all)
+        most time-consuming IPs.
+        """
+        total_count = self.instructions_executed or 1
+        total_time_s = self.time_s or 1.0
+
+        def format_entries(title: str, entries: List[ProfileEntry]) -> List[str]:
+            lines = ['%12s %7s %10s %7s %9s  %s' % ('count', '%count', 'time_s', '%time', 'ns/insn', title)]
+            for entry in entries:
+                lines.append('%12d %6.2f%% %10.4f %6.2f%% %9.0f  %s'
+                             % (entry.count, 100.0 * entry.count / total_count,
+                                entry.time_s, 100.0 * entry.time_s / total_time_s,
+                                1e9 * entry.time_s / entry.count,
+                                entry.key if isinstance(entry.key, str)
+                                else '%08x %s' % (entry.key, entry.mnemonic)))
+            return lines
+
+        ip_entries = self.by_ip()
+        if limit is not None:
+            ip_entries = ip_entries[:limit]
+
+        lines = (['%d instructions executed in %f s' % (self.instructions_executed, self.time_s), '']
+                 + format_entries('mnemonic', self.by_mnemonic())
+                 + ['']
+                 + format_entries('ip', ip_entries))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, outfile: TextIO):
+        json.dump({
+            'instructions_executed': self.instructions_executed,
+            'time_s': self.time_s,
+            'by_mnemonic': [{'mnemonic': e.mnemonic, 'count': e.count, 'time_s': e.time_s}
+                            for e in self.by_mnemonic()],
+            'by_ip': [{'ip': e.key, 'mnemonic': e.mnemonic, 'count': e.count, 'time_s': e.time_s}
+                      for e in self.by_ip()],
+        }, outfile, indent=2)
+
+    def dump_stats(self, path: str, program_name: str = 'program'):
+        """
+        Writes per-IP entries to PATH in the format used by the pstats
+        module, with PROGRAM_NAME as file name, IP as line number and
+        mnemonic as function name. The result can be inspected with e.g.
+        `python3 -m pstats PATH`.
+        """
+        stats = {}
+        for entry in self.by_ip():
+            key = (program_name, entry.key, entry.mnemonic)
+            count, _, time_s, _, _ = stats.get(key, (0, 0, 0.0, 0.0, {}))
+            count += entry.count
+            time_s += entry.time_s
+            stats[key] = (count, count, time_s, time_s, {})
+
+        with open(path, 'wb') as outfile:
+            marshal.dump(stats, outfile)
+
+
+class ProfilingInterpreter(Interpreter):
+    """ Interpreter that records execution count and time of every instruction """
+    def __init__(self, cpu: CPU, profile: Profile):
+        super().__init__(cpu)
+        self.profile = profile
+
+    def run(self, halt_after_instructions: Optional[int]):
+        cpu = self.cpu
+        regs = cpu.regs
+        decoded = cpu._decoded
+        frame_scheduler = cpu.frame_scheduler
+        profile = self.profile
+        by_ip = profile._by_ip
+        clock = time.perf_counter
+        instructions_executed = self.instructions_executed
+        next_frame_check = instructions_executed
+
+        try:
+            while (halt_after_instructions is None
+                   or instructions_executed < halt_after_instructions):
+                instructions_executed += 1
+                cpu.instructions_executed = instructions_executed
+                start = clock()
+                try:
+                    idx = regs[REG_IP]
+                    op, args, next_ip = decoded.get(idx) or cpu._decode(idx)
+                except Fault as err:
+                    logging.error(err)
+                else:
+                    try:
+                        regs[REG_IP] = next_ip
+                        op.run(cpu, *args)
+                    except Fault as err:
+                        logging.error(err)
+                    finally:
+                        entry = by_ip.get(idx)
+                        if entry is None or entry[0] is not op:
+                            entry = profile._replace(idx, op)
+                        entry[1] += 1
+                        entry[2] += clock() - start
+
+                if instructions_executed >= next_frame_check:
+                    next_frame_check = frame_scheduler.check(instructions_executed)
+        finally:
+            self.instructions_executed = instructions_executed
@@ -0,0 +1,220 @@
+"""
+Deterministic record/replay of nondeterministic machine inputs: key presses
+read with the in instruction and random numbers drawn by rand.
+
+Every event is tagged with the number of instructions executed when it
+happened, including the instruction that consumed it. Replaying a recording
+feeds each event back at exactly the same instruction, so the run can be
+reproduced without a terminal.
+
+File layout: MAGIC, followed by a zlib-compressed stream of unsigned
+LEB128 varints: total number of executed instructions, then for every event
+the instruction count delta since previous event, event kind and zigzag-
+encoded value.
+"""
+
+import enum
+import zlib
+from typing import Iterator, List, NamedTuple, Optional
+
+from evil.cpu import CPU
+from evil.input import Input
+
+MAGIC = b'EVRR\x01'
+
+
+class EventKind(enum.IntEnum):
+    INPUT = 0
+    RANDOM = 1
+
+
+class Event(NamedTuple):
+    instruction: int
+    kind: EventKind
+    value: int
+
+
+class ReplayError(Exception):
+    """ Raised when the replayed program diverges from the recording """
+    pass
+
+
+def _write_varint(out: bytearray, value: int):
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varints(data: bytes) -> Iterator[int]:
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            yield value
+            value = 0
+            shift = 0
+    if shift:
+        raise ValueError('truncated varint')
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+class Recording:
+    """ Sequence of input and RNG events, in execution order """
+    def __init__(self,
+                 events: List[Event] = None,
+                 instructions_executed: Optional[int] = None):
+        self.events = events or []
+        # total number of instructions executed by the recorded run
+        self.instructions_executed = instructions_executed
+
+    def add(self, instruction: int, kind: EventKind, value: int):
+        self.events.append(Event(instruction, kind, value))
+
+    def save(self, path: str):
+        out = bytearray()
+        _write_varint(out, self.instructions_executed or 0)
+
+        prev_instruction = 0
+        for event in self.events:
+            _write_varint(out, event.instruction - prev_instruction)
+            _write_varint(out, event.kind)
+            _write_varint(out, _zigzag(event.value))
+            prev_instruction = event.instruction
+
+        with open(path, 'wb') as outfile:
+            outfile.write(MAGIC)
+            outfile.write(zlib.compress(bytes(out)))
+
+    @classmethod
+    def load(cls, path: str) -> 'Recording':
+        with open(path, 'rb') as infile:
+            if infile.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a recording file' % path)
+            values = _read_varints(zlib.decompress(infile.read()))
+
+        recording = cls(instructions_executed=next(values))
+        instruction = 0
+        for delta in values:
+            instruction += delta
+            recording.add(instruction, EventKind(next(values)), _unzigzag(next(values)))
+        return recording
+
+
+class RecordingInput(Input):
+    """ Passes key presses from another Input device, recording each of them """
+    def __init__(self, input: Input, cpu: CPU, recording: Recording):
+        super().__init__()
+        self._input = input
+        self._cpu = cpu
+        self._recording = recording
+
+    def __enter__(self):
+        self._input.__enter__()
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        return self._input.__exit__(_type, _value, _traceback)
+
+    def wait(self, timeout_s: float) -> bool:
+        return self._input.wait(timeout_s)
+
+    def get_char(self) -> Optional[int]:
+        char = self._input.get_char()
+        if char is not None:
+            self._recording.add(self._cpu.instructions_executed, EventKind.INPUT, char)
+        return char
+
+
+class RecordingRandom:
+    """ Wraps the CPU random number generator, recording every draw """
+    def __init__(self, rng, cpu: CPU, recording: Recording):
+        self._rng = rng
+        self._cpu = cpu
+        self._recording = recording
+
+    def getstate(self):
+        return self._rng.getstate()
+
+    def setstate(self, state):
+        self._rng.setstate(state)
+
+    def randint(self, a: int, b: int) -> int:
+        value = self._rng.randint(a, b)
+        self._recording.add(self._cpu.instructions_executed, EventKind.RANDOM, value)
+        return value
+
+
+class _EventQueue:
+    """ Hands out recorded events of a single kind, checking their timing """
+    def __init__(self, cpu: CPU, recording: Recording, kind: EventKind):
+        self._cpu = cpu
+        self._kind = kind
+        self._events = [e for e in recording.events if e.kind == kind]
+        self._next = 0
+
+    def pop(self) -> Optional[int]:
+        """
+        Returns value of the next event if it was recorded at current
+        instruction, None otherwise.
+        """
+        if self._next >= len(self._events):
+            return None
+
+        event = self._events[self._next]
+        now = self._cpu.instructions_executed
+        if event.instruction < now:
+            raise ReplayError('%s event recorded at instruction %d was not consumed; now at instruction %d'
+                              % (self._kind.name, event.instruction, now))
+        if event.instruction > now:
+            return None
+
+        self._next += 1
+        return event.value
+
+
+class ReplayInput(Input):
+    """ Input device that returns recorded key presses at recorded instructions """
+    def __init__(self, cpu: CPU, recording: Recording):
+        super().__init__()
+        self._events = _EventQueue(cpu, recording, EventKind.INPUT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        pass
+
+    def wait(self, timeout_s: float) -> bool:
+        # recorded key presses arrive at recorded instructions, not in real time
+        return False
+
+    def get_char(self) -> Optional[int]:
+        return self._events.pop()
+
+
+class ReplayRandom:
+    """ Random number generator that returns recorded values """
+    def __init__(self, cpu: CPU, recording: Recording):
+        self._cpu = cpu
+        self._events = _EventQueue(cpu, recording, EventKind.RANDOM)
+
+    def randint(self, a: int, b: int) -> int:
+        value = self._events.pop()
+        if value is None:
+            raise ReplayError('no random number recorded for instruction %d'
+                              % self._cpu.instructions_executed)
+        return value
@@ -0,0 +1,199 @@
+"""
+Machine state snapshots: registers, memory contents, GPU and RNG state and machine
+configuration, saved to a compressed binary file.
+
+File layout: MAGIC, followed by a zlib-compressed payload. The payload
+starts with a 32-bit little-endian length of JSON-encoded metadata, followed
+by the metadata itself and binary blobs it refers to.
+"""
+
+import array
+import json
+import struct
+import sys
+import zlib
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from evil.cpu import CPU
+from evil.gpu import GPU, GPUState
+from evil.machine import MachineConfig
+from evil.memory import Memory, StrictlyAlignedMemory, ExtendableMemory
+
+MAGIC = b'EVSN\x01'
+
+MEMORY_TYPES = {cls.__name__: cls for cls in [Memory, StrictlyAlignedMemory, ExtendableMemory]}
+
+
+class Snapshot(NamedTuple):
+    config: MachineConfig
+    registers: List[int]
+    # address space name -> Memory; aliased address spaces share a Memory
+    memory_blocks: Dict[str, Memory]
+    gpu: GPU
+    # state of the random number generator, if it could be saved
+    rng_state: Optional[tuple]
+
+
+def _typecode_for(bits: int) -> str:
+    """
+    Returns array typecode able to store BITS-bit unsigned integers, or an
+    empty string if there is none.
+    """
+    for typecode in 'BHILQ':
+        if array.array(typecode).itemsize * 8 >= bits:
+            return typecode
+    return ''
+
+
+def _encode_values(values: List[int], bits: int) -> Tuple[str, bytes]:
+    """
+    Encodes VALUES as little-endian unsigned integers. Returns typecode used
+    for encoding and encoded data. Empty typecode means each value is
+    encoded on the smallest number of bytes that fits BITS bits.
+    """
+    typecode = _typecode_for(bits)
+    if not typecode:
+        num_bytes = (bits + 7) // 8
+        return typecode, b''.join(v.to_bytes(num_bytes, 'little') for v in values)
+
+    data = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return typecode, data.tobytes()
+
+
+def _decode_values(typecode: str, data: bytes, bits: int) -> List[int]:
+    if not typecode:
+        num_bytes = (bits + 7) // 8
+        return [int.from_bytes(data[idx:idx + num_bytes], 'little')
+                for idx in range(0, len(data), num_bytes)]
+
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tolist()
+
+
+def save(path: str,
+         cpu: CPU,
+         config: MachineConfig,
+         memory_blocks: Dict[str, Memory]):
+    """
+    Saves CPU registers, contents of MEMORY_BLOCKS, state of the CPU's GPU
+    and random number generator, and machine CONFIG to PATH.
+    """
+    blobs = []
+
+    def add_blob(data: bytes) -> int:
+        blobs.append(data)
+        return len(blobs) - 1
+
+    # identity of Memory objects -> index in blocks, to preserve aliasing
+    block_indices = {}
+    blocks = []
+    for mem in memory_blocks.values():
+        if id(mem) in block_indices:
+            continue
+        if type(mem).__name__ not in MEMORY_TYPES:
+            raise ValueError('unsupported memory type: %s' % type(mem).__name__)
+        if mem.paged:
+            raise ValueError('snapshots of paged memory are not supported')
+
+        typecode, data = _encode_values(list(mem), mem.char_bit)
+        block_indices[id(mem)] = len(blocks)
+        blocks.append({'type': type(mem).__name__,
+                       'char_bit': mem.char_bit,
+                       'typecode': typecode,
+                       'blob': add_blob(data)})
+
+    gpu_state = cpu.gpu.save_state()
+    pixels_typecode, pixels = _encode_values(gpu_state.pixels, 32)
+    front_blob = None
+    if gpu_state.front is not None:
+        _, front = _encode_values(gpu_state.front, 32)
+        front_blob = add_blob(front)
+
+    rng_state = None
+    if hasattr(cpu.rng, 'getstate'):
+        rng_state = cpu.rng.getstate()
+
+    metadata = {
+        'config': config._asdict(),
+        'registers': list(cpu.regs),
+        'rng_state': rng_state,
+        'blocks': blocks,
+        'mappings': {name: block_indices[id(mem)] for name, mem in memory_blocks.items()},
+        'gpu': {'width': gpu_state.width,
+                'height': gpu_state.height,
+                'cursor_x': gpu_state.cursor_x,
+                'cursor_y': gpu_state.cursor_y,
+                'typecode': pixels_typecode,
+                'pixels_blob': add_blob(pixels),
+                'front_blob': front_blob},
+        'blob_sizes': [len(blob) for blob in blobs],
+    }
+
+    metadata_bytes = json.dumps(metadata).encode('utf-8')
+    payload = b''.join([struct.pack('<I', len(metadata_bytes)), metadata_bytes] + blobs)
+
+    with open(path, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(zlib.compress(payload))
+
+
+def load(path: str,
+         gpu_factory: Callable[[int, int], GPU] = GPU) -> Snapshot:
+    """
+    Reads a snapshot saved with save(). Configures DataType sizes according
+    to the saved machine configuration. GPU_FACTORY is called with screen
+    width and height to create the GPU the state is restored into.
+
+    RAM contents are restored in process, so the returned configuration has
+    no ram_file even if the saved machine had one; the file is left as-is.
+    """
+    with open(path, 'rb') as infile:
+        if infile.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a snapshot file' % path)
+        payload = zlib.decompress(infile.read())
+
+    metadata_size, = struct.unpack_from('<I', payload)
+    offset = struct.calcsize('<I') + metadata_size
+    metadata = json.loads(payload[struct.calcsize('<I'):offset].decode('utf-8'))
+
+    blobs = []
+    for size in metadata['blob_sizes']:
+        blobs.append(payload[offset:offset + size])
+        offset += size
+
+    config = MachineConfig(**metadata['config'])._replace(ram_file=None)
+    config.configure_datatypes()
+
+    blocks = []
+    for block in metadata['blocks']:
+        values = _decode_values(block['typecode'], blobs[block['blob']], block['char_bit'])
+        blocks.append(MEMORY_TYPES[block['type']](char_bit=block['char_bit'], value=values))
+
+    gpu_meta = metadata['gpu']
+    front = None
+    if gpu_meta['front_blob'] is not None:
+        front = _decode_values(gpu_meta['typecode'], blobs[gpu_meta['front_blob']], 32)
+
+    gpu = gpu_factory(gpu_meta['width'], gpu_meta['height'])
+    gpu.load_state(GPUState(width=gpu_meta['width'],
+                            height=gpu_meta['height'],
+                            pixels=_decode_values(gpu_meta['typecode'], blobs[gpu_meta['pixels_blob']], 32),
+                            front=front,
+                            cursor_x=gpu_meta['cursor_x'],
+                            cursor_y=gpu_meta['cursor_y']))
+
+    rng_state = metadata.get('rng_state')
+    if rng_state is not None:
+        # JSON turns tuples into lists
+        rng_state = tuple(tuple(x) if isinstance(x, list) else x for x in rng_state)
+
+    return Snapshot(config=config,
+                    registers=metadata['registers'],
+                    memory_blocks={name: blocks[idx] for name, idx in metadata['mappings'].items()},
+                    gpu=gpu,
+                    rng_state=rng_state)
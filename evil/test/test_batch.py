@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from evil.batch import Job, run_job
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+
+    def write_source(self, source: str) -> str:
+        path = os.path.join(self.tmpdir, 'program.asm')
+        with open(path, 'w') as outfile:
+            outfile.write(source)
+        return path
+
+    def test_job_from_json(self):
+        job = Job.from_json({'source': 'program.asm',
+                             'config': {'char_bit': 8, 'map_memory': ['ram=program']},
+                             'input': '\x1b[A',
+                             'halt_after_instructions': 10},
+                            base_dir=self.tmpdir,
+                            default_id='manifest:1')
+
+        self.assertEqual('manifest:1', job.id)
+        self.assertEqual(os.path.join(self.tmpdir, 'program.asm'), job.source)
+        self.assertEqual(8, job.config.char_bit)
+        self.assertEqual(b'\x1b[A', job.input)
+
+    def test_job_from_json_rejects_unknown_keys(self):
+        with self.assertRaises(ValueError):
+            Job.from_json({'source': 'program.asm', 'config': {'ram': 1}},
+                          base_dir=self.tmpdir, default_id='manifest:1')
+        with self.assertRaises(ValueError):
+            Job.from_json({'source': 'program.asm', 'halt_after': 1},
+                          base_dir=self.tmpdir, default_id='manifest:1')
+
+    def test_job_from_json_rejects_multibyte_input(self):
+        with self.assertRaisesRegex(ValueError, 'job manifest:1: "input"'):
+            Job.from_json({'source': 'program.asm', 'input': 'snek \u2192'},
+                          base_dir=self.tmpdir, default_id='manifest:1')
+
+    def test_halted(self):
+        source = self.write_source('in\n'
+                                   'out\n'
+                                   'halt\n')
+        result = run_job(Job(id='echo', source=source, input=b'x'))
+
+        self.assertEqual('halted', result['exit_reason'])
+        self.assertEqual(3, result['instructions_executed'])
+        self.assertEqual(ord('x'), result['registers']['A'])
+
+    def test_timeout(self):
+        source = self.write_source('start:\n'
+                                   '    jmp start\n')
+        result = run_job(Job(id='loop', source=source, timeout_s=0.1))
+
+        self.assertEqual('timeout', result['exit_reason'])
+        self.assertGreater(result['instructions_executed'], 0)
+
+    def test_error(self):
+        result = run_job(Job(id='missing', source=os.path.join(self.tmpdir, 'missing.asm')))
+
+        self.assertEqual('error', result['exit_reason'])
+        self.assertIn('error', result)
@@ -0,0 +1,367 @@
+import unittest
+
+from evil.cpu import (CPU, IdleDetector, Operations, Register, RegisterSet, make_register_file,
+                      REG_F, FLAG_ZERO)
+from evil.endianness import Endianness
+from evil.memory import Memory, MemoryRegion, ExtendableMemory, StrictlyAlignedMemory, DataType
+from evil.jit import BlockEngine
+from evil.gpu import NullGPU
+from evil.input import ScriptedInput
+
+
+CHAR_BIT = 9
+
+
+def assemble(*instructions) -> Memory:
+    """
+    Encodes INSTRUCTIONS - (Operation, arg, ...) tuples - into a memory block,
+    the same way Assembler does.
+    """
+    mem = ExtendableMemory(CHAR_BIT)
+    for op, *args in instructions:
+        mem.append(op.opcode, DataType.from_fmt('b'), Endianness.Little)
+        for fmt_c, arg in zip(op.arg_def, args):
+            if isinstance(arg, Register):
+                arg = arg.value
+            mem.append(arg, DataType.from_fmt(fmt_c), op.args_endianness)
+    return mem.freeze()
+
+
+def offset_of(*instructions) -> int:
+    """ Returns the size of INSTRUCTIONS bytecode """
+    return sum(op.size_bytes for op, *_ in instructions)
+
+
+class RegisterSetTest(unittest.TestCase):
+    def test_is_a_view_of_register_file(self):
+        regs = make_register_file()
+        registers = RegisterSet(regs)
+
+        registers.A = 42
+        self.assertEqual(42, regs[Register.A.value])
+
+        regs[Register.IP.value] = 7
+        self.assertEqual(7, registers.IP)
+        self.assertEqual(7, registers[Register.IP])
+
+    def test_unknown_register(self):
+        registers = RegisterSet()
+        with self.assertRaises(KeyError):
+            registers.X = 1
+        with self.assertRaises(AttributeError):
+            registers.X
+
+
+class CPUTest(unittest.TestCase):
+    ENGINE = None
+
+    def run_program(self,
+                    program: Memory,
+                    ram: Memory = None,
+                    halt_after_instructions: int = 1000,
+                    gpu: NullGPU = None) -> CPU:
+        if ram is None:
+            ram = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8)
+        stack = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('a') * 8)
+
+        cpu = CPU()
+        self.stats = cpu.execute(program=program, ram=ram, stack=stack, input=None,
+                                 halt_after_instructions=halt_after_instructions,
+                                 engine=self.ENGINE,
+                                 gpu=gpu or NullGPU(width=80, height=24))
+        return cpu
+
+    def test_loop(self):
+        loop_start = offset_of((Operations.movb_i2r,))
+        program = assemble((Operations.movb_i2r, Register.C, 5),
+                           (Operations.add_b, Register.A, 3),
+                           (Operations.loop, loop_start),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(15, cpu.registers.A)
+        self.assertEqual(0, cpu.registers.C)
+        self.assertEqual(12, self.stats.instructions_executed)
+
+    def test_halt_after_instructions(self):
+        program = assemble((Operations.add_b, Register.A, 1),
+                           (Operations.jmp, 0))
+
+        cpu = self.run_program(program, halt_after_instructions=9)
+        self.assertEqual(5, cpu.registers.A)
+
+    def test_self_modifying_code_invalidates_decoded_instructions(self):
+        prologue = [(Operations.movb_i2r, Register.C, 2)]
+        body = [(Operations.movb_i2r, Register.B, 1),
+                (Operations.movb_i2r, Register.A, 7)]
+        loop_start = offset_of(*prologue)
+        # address of IMM_BYTE argument of the first body instruction
+        patched_addr = (loop_start
+                        + Operations.movb_i2r.opcode_size_bytes
+                        + DataType.calcsize('r'))
+
+        program = assemble(*prologue,
+                           *body,
+                           (Operations.movb_r2m, patched_addr, Register.A),
+                           (Operations.loop, loop_start),
+                           (Operations.halt,))
+
+        # same as --map-memory ram=program
+        cpu = self.run_program(program, ram=program)
+        self.assertEqual(7, cpu.registers.B)
+
+    def test_load_words_from_register_address(self):
+        program = assemble((Operations.movw_i2r, Register.A, -1000),
+                           (Operations.movw_r2m, 0, Register.A),
+                           (Operations.movb_i2r, Register.B, 0),
+                           (Operations.ldw_r, Register.C, Register.B),
+                           (Operations.lpw_r, Register.A, Register.B),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(-1000, cpu.registers.C)
+        self.assertEqual(program.get_fmt('w', 0), cpu.registers.A)
+        self.assertEqual(6, self.stats.instructions_executed)
+
+    def test_fault_skips_instruction(self):
+        program = assemble((Operations.movb_i2r, Register.A, 1),
+                           # unaligned access
+                           (Operations.movw_m2r, Register.A, 1),
+                           (Operations.add_b, Register.A, 2),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(3, cpu.registers.A)
+
+    def test_invalid_register_faults(self):
+        program = assemble((Operations.movb_i2r, len(Register) + 1, 1),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program, halt_after_instructions=3)
+        self.assertEqual(0, cpu.registers.IP)
+
+    def test_call_ret(self):
+        subroutine = offset_of((Operations.call, 0),
+                               (Operations.halt,))
+        program = assemble((Operations.call, subroutine),
+                           (Operations.halt,),
+                           (Operations.movb_i2r, Register.B, 4),
+                           (Operations.ret,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(4, cpu.registers.B)
+        self.assertEqual(subroutine, cpu.registers.IP)
+        self.assertEqual(DataType.calcsize('a') * 8, cpu.registers.RP)
+
+    def test_blit_and_fill(self):
+        table = assemble((Operations.movb_i2r, Register.A, ord('x')))
+        # IMM_BYTE argument of the instruction above
+        table_addr = Operations.movb_i2r.opcode_size_bytes + DataType.calcsize('r')
+
+        program = assemble((Operations.movb_i2r, Register.A, ord('x')),
+                           (Operations.movb_i2r, Register.A, ord('a')),
+                           (Operations.movb_r2m, 0, Register.A),
+                           (Operations.movb_i2r, Register.B, 0),
+                           (Operations.movb_i2r, Register.C, 1),
+                           (Operations.blit, Register.B, Register.C),
+                           # $RAM[1] == 0, translated to $PROGRAM[table_addr]
+                           (Operations.movb_i2r, Register.A, table_addr),
+                           (Operations.movb_i2r, Register.B, 1),
+                           (Operations.blit_x, Register.B, Register.A, Register.C),
+                           (Operations.movb_i2r, Register.A, ord('-')),
+                           (Operations.movb_i2r, Register.C, 3),
+                           (Operations.fill, Register.A, Register.C),
+                           (Operations.halt,))
+        self.assertEqual(list(table), list(program)[:len(table)])
+
+        cpu = self.run_program(program)
+        self.assertEqual('ax---', cpu.gpu.dump()[:5])
+        self.assertEqual(13, self.stats.instructions_executed)
+
+    def test_blit_out_of_bounds_faults(self):
+        program = assemble((Operations.movb_i2r, Register.B, 1),
+                           (Operations.movw_i2r, Register.C, DataType.calcsize('w') * 8),
+                           (Operations.blit, Register.B, Register.C),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(' ' * 80 + '\n', cpu.gpu.dump()[:81])
+        self.assertEqual(4, self.stats.instructions_executed)
+
+    def test_memset_memcpy_memcmp(self):
+        program = assemble((Operations.movb_i2r, Register.A, 0),
+                           (Operations.movb_i2r, Register.B, -3),
+                           (Operations.movb_i2r, Register.C, 5),
+                           (Operations.memset, Register.A, Register.B, Register.C),
+                           (Operations.movb_i2r, Register.B, 10),
+                           (Operations.memcpy, Register.B, Register.A, Register.C),
+                           (Operations.memcmp, Register.A, Register.B, Register.C),
+                           (Operations.movb_r2m, 12, Register.C),
+                           (Operations.memcmp, Register.A, Register.B, Register.C),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program, halt_after_instructions=7)
+        negative_3 = 2**(CHAR_BIT - 1) + 3
+        self.assertEqual([negative_3] * 5 + [0] * 5 + [negative_3] * 5 + [0],
+                         list(cpu.ram)[:16])
+        self.assertEqual(FLAG_ZERO, cpu.regs[REG_F])
+
+        cpu = self.run_program(program)
+        self.assertEqual([negative_3] * 2 + [5] + [negative_3] * 2, list(cpu.ram)[10:15])
+        # -3 < 5
+        self.assertEqual(0, cpu.regs[REG_F])
+
+    def test_memcpy_out_of_bounds_faults(self):
+        program = assemble((Operations.movb_i2r, Register.A, 1),
+                           (Operations.movw_i2r, Register.C, DataType.calcsize('w') * 8),
+                           (Operations.memcpy, Register.A, Register.B, Register.C),
+                           (Operations.memset, Register.A, Register.A, Register.C),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual([0] * DataType.calcsize('w') * 8, list(cpu.ram))
+        self.assertEqual(5, self.stats.instructions_executed)
+
+    def test_memset_invalidates_decoded_instructions(self):
+        setup = [(Operations.movb_i2r, Register.A, 0),
+                 (Operations.movb_i2r, Register.B, 7),
+                 (Operations.movb_i2r, Register.C, 1),
+                 (Operations.memset, Register.A, Register.B, Register.C)]
+        # address of IMM_BYTE argument of the instruction following memset
+        patched_addr = (offset_of(*setup)
+                        + Operations.movb_i2r.opcode_size_bytes
+                        + DataType.calcsize('r'))
+        setup[0] = (Operations.movb_i2r, Register.A, patched_addr)
+
+        program = assemble(*setup,
+                           (Operations.movb_i2r, Register.A, 1),
+                           (Operations.halt,))
+
+        # same as --map-memory ram=program
+        cpu = self.run_program(program, ram=program)
+        self.assertEqual(7, cpu.registers.A)
+
+    def test_mapped_framebuffer(self):
+        ram = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8)
+        gpu = NullGPU(width=80, height=24)
+        gpu.map_memory(MemoryRegion(ram, 1, 2))
+
+        program = assemble((Operations.movb_i2r, Register.A, ord('h')),
+                           (Operations.movb_r2m, 1, Register.A),
+                           (Operations.movb_i2r, Register.B, 2),
+                           (Operations.add_b, Register.A, 1),
+                           (Operations.stb_r, Register.B, Register.A),
+                           (Operations.flip,),
+                           (Operations.halt,))
+
+        self.run_program(program, ram=ram, gpu=gpu)
+        self.assertEqual('hi  ', gpu.dump()[:4])
+
+
+class BlockEngineTest(CPUTest):
+    ENGINE = BlockEngine
+
+    def test_halt_after_instructions_inside_block(self):
+        program = assemble(*[(Operations.add_b, Register.A, 1)] * 10,
+                           (Operations.halt,))
+
+        cpu = self.run_program(program, halt_after_instructions=4)
+        self.assertEqual(4, cpu.registers.A)
+        self.assertEqual(offset_of((Operations.add_b,)) * 4, cpu.registers.IP)
+
+
+class PollingInput(ScriptedInput):
+    """ Finds no key press for the first MISSES polls, then returns DATA """
+    def __init__(self, data: bytes, misses: int):
+        super().__init__(data)
+        self.misses = misses
+        self.waits = 0
+
+    def get_char(self):
+        if self.misses > 0:
+            self.misses -= 1
+            return None
+        return super().get_char()
+
+    def wait(self, timeout_s: float) -> bool:
+        self.waits += 1
+        return False
+
+
+class IdleDetectorTest(unittest.TestCase):
+    def run_program(self, program: Memory, input: PollingInput, idle_wait: bool = True):
+        ram = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8)
+        stack = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('a') * 8)
+
+        cpu = CPU()
+        self.stats = cpu.execute(program=program, ram=ram, stack=stack, input=input,
+                                 halt_after_instructions=1000,
+                                 gpu=NullGPU(width=80, height=24),
+                                 idle_wait=idle_wait)
+        return cpu
+
+    def test_waits_in_busy_wait_loop(self):
+        program = assemble((Operations._in,),
+                           (Operations.jb, 0),
+                           (Operations.halt,))
+
+        input = PollingInput(b'x', misses=10)
+        cpu = self.run_program(program, input)
+        self.assertEqual(ord('x'), cpu.registers.A)
+        self.assertEqual(23, self.stats.instructions_executed)
+        self.assertEqual(10 - IdleDetector.IDLE_POLLS, input.waits)
+
+        input = PollingInput(b'x', misses=10)
+        self.run_program(program, input, idle_wait=False)
+        self.assertEqual(23, self.stats.instructions_executed)
+        self.assertEqual(0, input.waits)
+
+    def test_does_not_wait_if_registers_change(self):
+        program = assemble((Operations.add_b, Register.B, 1),
+                           (Operations._in,),
+                           (Operations.jb, 0),
+                           (Operations.halt,))
+
+        input = PollingInput(b'x', misses=10)
+        cpu = self.run_program(program, input)
+        self.assertEqual(11, cpu.registers.B)
+        self.assertEqual(0, input.waits)
+
+
+class ForkTest(unittest.TestCase):
+    PROGRAM = assemble((Operations.rand,),
+                       (Operations.movw_r2m, 0, Register.A),
+                       (Operations.add_b, Register.B, 1),
+                       (Operations.jmp, 0))
+
+    def execute(self, cpu, halt_after_instructions, gpu=None, resume=False):
+        cpu.execute(program=cpu.program, ram=cpu.ram, stack=cpu.call_stack, input=None,
+                    halt_after_instructions=halt_after_instructions,
+                    gpu=gpu or NullGPU(width=4, height=2),
+                    resume=resume)
+
+    def make_cpu(self) -> CPU:
+        cpu = CPU()
+        cpu.program = self.PROGRAM
+        cpu.ram = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8)
+        cpu.call_stack = cpu.ram
+        cpu.rng.seed(1)
+        return cpu
+
+    def test_fork_continues_independently(self):
+        reference = self.make_cpu()
+        self.execute(reference, 10)
+
+        parent = self.make_cpu()
+        self.execute(parent, 6)
+        parent.gpu.fill(ord('x'), 3)
+
+        child = parent.fork(gpu=NullGPU(width=4, height=2))
+        self.assertIs(child.ram, child.call_stack)
+        self.assertEqual(parent.gpu.dump(), child.gpu.dump())
+
+        parent.ram.set_fmt('w', 0, 0)
+        self.execute(child, 4, gpu=child.gpu, resume=True)
+        self.assertEqual(list(reference.regs), list(child.regs))
+        self.assertEqual(list(reference.ram), list(child.ram))
+        self.assertEqual(0, parent.ram.get_fmt('w', 0))
@@ -0,0 +1,30 @@
+import unittest
+
+from evil.endianness import Endianness, bytes_from_value, value_from_bytes, get_codec
+
+
+class CodecTest(unittest.TestCase):
+    def test_encoding(self):
+        self.assertEqual([0, 1, 0, 2], bytes_from_value(Endianness.Big, 2**18 + 2, 9, 4))
+        self.assertEqual([2, 0, 1, 0], bytes_from_value(Endianness.Little, 2**18 + 2, 9, 4))
+        self.assertEqual([0, 2, 0, 1], bytes_from_value(Endianness.PDP, 2**18 + 2, 9, 4))
+        self.assertEqual([0x80, 5], bytes_from_value(Endianness.Big, -5, 8, 2))
+
+    def test_round_trip(self):
+        for endianness in Endianness:
+            for char_bit in (7, 8, 9):
+                for value in (0, 1, -1, 300, -300, 2**(4 * char_bit - 1) - 1):
+                    encoded = bytes_from_value(endianness, value, char_bit, 4)
+                    self.assertEqual(value, value_from_bytes(endianness, encoded, char_bit))
+
+    def test_value_too_big(self):
+        with self.assertRaises(ValueError):
+            bytes_from_value(Endianness.Big, 2**18, 9, 2)
+        with self.assertRaises(ValueError):
+            bytes_from_value(Endianness.Little, -2**16, 8, 2)
+        with self.assertRaises(ValueError):
+            value_from_bytes(Endianness.Big, [512, 0], 9)
+
+    def test_codecs_are_cached(self):
+        self.assertIs(get_codec(Endianness.Big, 9, 7), get_codec(Endianness.Big, 9, 7))
+        self.assertIsNot(get_codec(Endianness.Big, 9, 7), get_codec(Endianness.Little, 9, 7))
@@ -0,0 +1,84 @@
+from evil.cpu import CPU, Operations, Register
+from evil.fusion import FusingInterpreter, FusionStats
+from evil.gpu import NullGPU
+from evil.memory import DataType
+from evil.test import test_cpu
+from evil.test.test_cpu import assemble, offset_of
+
+
+class FusingInterpreterTest(test_cpu.CPUTest):
+    ENGINE = FusingInterpreter
+
+    def test_fused_compare_and_jump(self):
+        stats = FusionStats()
+        self.ENGINE = lambda cpu: FusingInterpreter(cpu, stats=stats)
+
+        loop_start = offset_of((Operations.movb_i2r,))
+        program = assemble((Operations.movb_i2r, Register.A, 0),
+                           (Operations.add_b, Register.A, 1),
+                           (Operations.cmp_b, Register.A, 3),
+                           (Operations.jb, loop_start),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(3, cpu.registers.A)
+        self.assertEqual(11, self.stats.instructions_executed)
+        self.assertEqual({'cmp.b+jb': 3}, dict(stats.fired))
+
+    def test_halt_after_instructions_inside_superinstruction(self):
+        program = assemble((Operations.add_b, Register.A, 1),
+                           (Operations.add_b, Register.A, 1),
+                           (Operations.add_b, Register.B, 1),
+                           (Operations.add_b, Register.B, 1),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program, halt_after_instructions=3)
+        self.assertEqual(2, cpu.registers.A)
+        self.assertEqual(1, cpu.registers.B)
+        self.assertEqual(offset_of((Operations.add_b,)) * 3, cpu.registers.IP)
+
+    def test_fault_inside_superinstruction(self):
+        program = assemble((Operations.push, Register.A),
+                           # unaligned access
+                           (Operations.movw_m2r, Register.A, 1),
+                           (Operations.add_b, Register.A, 2),
+                           (Operations.movw_r2m, 0, Register.A),
+                           (Operations.halt,))
+
+        cpu = self.run_program(program)
+        self.assertEqual(2, cpu.registers.A)
+        self.assertEqual(5, self.stats.instructions_executed)
+
+    def test_self_modifying_code_with_memory_mapped_onto_program(self):
+        copy_code = [(Operations.movw_m2r, Register.A, 0),
+                     (Operations.movw_r2m, 0, Register.A)]
+        patched = [(Operations.movb_i2r, Register.B, 1),
+                   (Operations.movb_i2r, Register.C, 1),
+                   (Operations.halt,)]
+        replacement = [(Operations.movb_i2r, Register.B, 7),
+                       (Operations.movb_i2r, Register.C, 7),
+                       (Operations.halt,)]
+        self.assertEqual(DataType.calcsize('w'), offset_of(*patched))
+
+        patched_addr = offset_of((Operations.call, 0), *copy_code)
+        replacement_addr = patched_addr + offset_of(*patched)
+        subroutine = replacement_addr + offset_of(*replacement)
+        copy_code = [(Operations.movw_m2r, Register.A, replacement_addr),
+                     (Operations.movw_r2m, patched_addr, Register.A)]
+
+        program = assemble((Operations.call, subroutine),
+                           *copy_code,
+                           *patched,
+                           *replacement,
+                           (Operations.add_b, Register.A, 1),
+                           (Operations.ret,),
+                           # overwritten by the return address pushed by call
+                           *[(Operations.halt,)] * DataType.calcsize('a'))
+
+        cpu = CPU()
+        # same as --map-memory ram=program stack=program
+        cpu.execute(program=program, ram=program, stack=program, input=None,
+                    halt_after_instructions=100, engine=self.ENGINE,
+                    gpu=NullGPU(width=80, height=24))
+        self.assertEqual([7, 7], [cpu.registers.B, cpu.registers.C])
+        self.assertEqual(program.get_fmt('w', replacement_addr), cpu.registers.A)
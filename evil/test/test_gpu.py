@@ -0,0 +1,212 @@
+import io
+import sys
+import threading
+import unittest
+import unittest.mock
+
+from evil.memory import Memory, MemoryRegion
+from evil.test.test_cpu import CHAR_BIT
+from evil.gpu import GPU, GPUFault, NullGPU, ThreadedGPU, FrameScheduler, AnsiRenderer
+
+
+class GPUTest(unittest.TestCase):
+    def setUp(self):
+        self.stdout = io.StringIO()
+        patcher = unittest.mock.patch('sys.stdout', self.stdout)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refresh_displays_framebuffer(self):
+        gpu = GPU(width=3, height=2)
+        for c in 'abcd':
+            gpu.put(ord(c))
+        gpu.refresh(force=True)
+
+        self.assertEqual('abc\nd  \n\n', self.stdout.getvalue())
+
+    def test_flip_displays_only_complete_frames(self):
+        gpu = GPU(width=2, height=1)
+        gpu.put(ord('a'))
+        gpu.flip()
+        gpu.put(ord('b'))
+
+        gpu.present()
+        self.assertEqual('a \n\n', self.stdout.getvalue())
+
+        # no new frame flipped since last refresh
+        gpu.present()
+        self.assertEqual('a \n\n', self.stdout.getvalue())
+
+    def test_frame_scheduler_checks_clock_every_interval(self):
+        gpu = unittest.mock.Mock(spec=GPU)
+        scheduler = FrameScheduler(gpu, check_interval=100)
+
+        self.assertEqual(105, scheduler.check(5))
+        gpu.refresh.assert_called_once_with()
+
+    def test_frame_scheduler_with_emulated_clock(self):
+        gpu = unittest.mock.Mock(spec=GPU, refresh_rate_hz=60)
+        scheduler = FrameScheduler(gpu, clock_hz=6000)
+
+        with unittest.mock.patch('time.sleep'):
+            self.assertEqual(100, scheduler.check(0))
+            self.assertEqual(200, scheduler.check(100))
+            self.assertEqual(300, scheduler.check(250))
+        self.assertEqual(3, gpu.present.call_count)
+
+    def test_frame_scheduler_vsync_waits_for_next_frame(self):
+        gpu = unittest.mock.Mock(spec=GPU)
+        gpu.refresh_due_in.return_value = 0.01
+
+        with unittest.mock.patch('time.sleep') as sleep:
+            FrameScheduler(gpu).vsync()
+            gpu.refresh.assert_not_called()
+
+            FrameScheduler(gpu, vsync=True).vsync()
+            sleep.assert_called_once_with(0.01)
+            gpu.refresh.assert_called_once_with(force=True)
+
+    def test_write_wraps_around(self):
+        gpu = NullGPU(width=2, height=2)
+        gpu.seek(1, 1)
+        gpu.write([ord(c) for c in 'abcdef'])
+        gpu.put(ord('g'))
+
+        self.assertEqual('fg\nde\n', gpu.dump())
+        self.assertEqual((0, 1), (gpu.save_state().cursor_x, gpu.save_state().cursor_y))
+
+    def test_fill(self):
+        gpu = NullGPU(width=2, height=2)
+        gpu.put(ord('a'))
+        gpu.fill(ord('b'), 10)
+
+        self.assertEqual('bb\nbb\n', gpu.dump())
+        self.assertEqual(3, gpu.save_state().cursor_x + 2 * gpu.save_state().cursor_y)
+
+    def test_invalid_characters_are_not_written(self):
+        gpu = NullGPU(width=2, height=1)
+        with self.assertRaises(GPUFault):
+            gpu.write([ord('a'), -1])
+        with self.assertRaises(GPUFault):
+            gpu.fill(sys.maxunicode, 1)
+
+        self.assertEqual('  \n', gpu.dump())
+
+    def test_mapped_memory(self):
+        memory = Memory(CHAR_BIT, size=8)
+        memory.set_fmt('b', 2, ord('x'))
+        gpu = NullGPU(width=2, height=2)
+        gpu.map_memory(MemoryRegion(memory, 2, 4))
+        self.assertEqual('x \n  \n', gpu.dump())
+
+        gpu.seek(0, 1)
+        gpu.put(ord('p'))
+        memory.set_fmt('b', 3, ord('a'))
+        # outside of the region
+        memory.set_fmt('b', 6, ord('z'))
+        self.assertEqual('xa\np \n', gpu.dump())
+
+        memory.set_fmt('b', 5, -1)
+        gpu.flip()
+        memory.set_fmt('b', 2, ord('y'))
+        self.assertEqual('xa\np \n', gpu.dump())
+
+        # picks up pending writes, ignores further ones
+        gpu.close()
+        memory.set_fmt('b', 3, ord('b'))
+        gpu.flip()
+        self.assertEqual('ya\np \n', gpu.dump())
+
+    def test_mapped_region_must_fit_screen(self):
+        gpu = NullGPU(width=2, height=2)
+        with self.assertRaises(ValueError):
+            gpu.map_memory(MemoryRegion(Memory(CHAR_BIT, size=8), 0, 5))
+
+    def test_null_gpu_keeps_framebuffer(self):
+        gpu = NullGPU(width=2, height=2)
+        gpu.put(ord('a'))
+        gpu.flip()
+        gpu.put(ord('b'))
+        gpu.refresh(force=True)
+
+        self.assertEqual('', self.stdout.getvalue())
+        self.assertEqual('a \n  \n', gpu.dump())
+
+
+class BlockingOutput(io.StringIO):
+    """ Output that blocks every write until it is allowed to continue """
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.unblocked = threading.Event()
+
+    def write(self, s):
+        self.writing.set()
+        self.unblocked.wait()
+        return super().write(s)
+
+
+class ThreadedGPUTest(unittest.TestCase):
+    def test_close_waits_for_frames(self):
+        output = io.StringIO()
+        gpu = ThreadedGPU(width=3, height=2, output=output)
+        for c in 'abcd':
+            gpu.put(ord(c))
+        gpu.refresh(force=True)
+        gpu.close()
+
+        self.assertEqual('abc\nd  \n\n', output.getvalue())
+        self.assertEqual(1, gpu.frames_rendered)
+
+    def test_drops_frames_when_output_is_slow(self):
+        output = BlockingOutput()
+        gpu = ThreadedGPU(width=1, height=1, output=output)
+        gpu.put(ord('a'))
+        gpu.refresh(force=True)
+        # the renderer is stuck writing the first frame
+        self.assertTrue(output.writing.wait(timeout=5))
+
+        for c in 'bcd':
+            gpu.seek(0, 0)
+            gpu.put(ord(c))
+            gpu.refresh(force=True)
+
+        output.unblocked.set()
+        gpu.close()
+
+        self.assertEqual('a\n\nd\n\n', output.getvalue())
+        self.assertEqual(2, gpu.frames_rendered)
+        self.assertEqual(2, gpu.frames_dropped)
+
+
+class AnsiRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.size = (80, 24)
+        self.renderer = AnsiRenderer(width=4, height=2, terminal_size=lambda: self.size)
+
+    def test_first_frame_redraws_screen(self):
+        text = self.renderer.render([ord(c) for c in 'ab\ncdef'])
+        self.assertEqual('\x1b[H\x1b[2J\x1b[1;1Hab c\x1b[2;1Hdef\x1b[3;1H', text)
+
+    def test_writes_only_changed_cells(self):
+        pixels = [ord(' ')] * 8
+        self.renderer.render(pixels)
+
+        pixels[5] = ord('x')
+        self.assertEqual('\x1b[2;2Hx\x1b[3;1H', self.renderer.render(pixels))
+        self.assertEqual('', self.renderer.render(pixels))
+
+    def test_merges_close_runs(self):
+        pixels = [ord(' ')] * 8
+        self.renderer.render(pixels)
+
+        pixels[0] = ord('a')
+        pixels[3] = ord('b')
+        self.assertEqual('\x1b[1;1Ha  b\x1b[3;1H', self.renderer.render(pixels))
+
+    def test_resize_redraws_screen(self):
+        pixels = [ord(' ')] * 8
+        self.renderer.render(pixels)
+
+        self.size = (100, 30)
+        self.assertTrue(self.renderer.render(pixels).startswith('\x1b[H\x1b[2J'))
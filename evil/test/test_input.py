@@ -0,0 +1,23 @@
+import os
+import tempfile
+import unittest
+
+from evil.input import ScriptedInput
+
+
+class ScriptedInputTest(unittest.TestCase):
+    def test_returns_data_then_nothing(self):
+        with ScriptedInput(b'\x1b[A') as input:
+            self.assertEqual([27, ord('['), ord('A'), None, None],
+                             [input.get_char() for _ in range(5)])
+
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'input')
+            with open(path, 'wb') as outfile:
+                outfile.write(b'q')
+
+            input = ScriptedInput.from_file(path)
+
+        self.assertEqual(ord('q'), input.get_char())
+        self.assertIsNone(input.get_char())
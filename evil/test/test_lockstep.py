@@ -0,0 +1,146 @@
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from evil.cpu import CPU, Operations, Register
+from evil.gpu import NullGPU
+from evil.input import ScriptedInput
+from evil.memory import StrictlyAlignedMemory, DataType
+from evil.test.test_cpu import CHAR_BIT, assemble, offset_of
+
+if np is not None:
+    from evil.lockstep import LockstepMachine
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class LockstepMachineTest(unittest.TestCase):
+    DTYPE = np.int64 if np is not None else None
+
+    def memory_blocks(self, program):
+        return {'program': program,
+                'ram': StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8),
+                'stack': StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('a') * 8)}
+
+    def run_reference(self, program, input: bytes, seed: int, halt_after_instructions: int) -> CPU:
+        blocks = self.memory_blocks(program)
+        cpu = CPU()
+        cpu.rng.seed(seed)
+        cpu.execute(program=blocks['program'], ram=blocks['ram'], stack=blocks['stack'],
+                    input=ScriptedInput(input),
+                    halt_after_instructions=halt_after_instructions,
+                    gpu=NullGPU(width=80, height=24))
+        return cpu
+
+    def assert_matches_interpreter(self, program, inputs, halt_after_instructions=100):
+        seeds = list(range(len(inputs)))
+        machine = LockstepMachine(self.memory_blocks(program), len(inputs),
+                                  inputs=[ScriptedInput(data) for data in inputs],
+                                  seeds=seeds,
+                                  dtype=self.DTYPE)
+        stats = machine.run(halt_after_instructions)
+
+        for instance, (data, seed) in enumerate(zip(inputs, seeds)):
+            cpu = self.run_reference(program, data, seed, halt_after_instructions)
+            self.assertEqual(list(cpu.regs), list(machine.registers(instance)._values))
+            self.assertEqual(list(cpu.ram), machine.memory(instance, 'ram'))
+            self.assertEqual(cpu.gpu.dump(), machine.gpus[instance].dump())
+            self.assertEqual(cpu.instructions_executed, stats[instance].instructions_executed)
+        return machine, stats
+
+    def test_divergent_control_flow(self):
+        subroutine = offset_of((Operations._in,),
+                               (Operations.cmp_b, Register.A, 0),
+                               (Operations.jb, 0),
+                               (Operations.movb_i2r, Register.C, 0),
+                               (Operations.call, 0),
+                               (Operations.out,),
+                               (Operations.halt,))
+        program = assemble((Operations._in,),
+                           (Operations.cmp_b, Register.A, 0),
+                           # no input: halt immediately
+                           (Operations.jb, subroutine - offset_of((Operations.halt,))),
+                           (Operations.movb_i2r, Register.C, 3),
+                           (Operations.call, subroutine),
+                           (Operations.out,),
+                           (Operations.halt,),
+                           # subroutine: B = (A * C) % 7, pushed and popped back, stored to RAM
+                           (Operations.movw_r2r, Register.B, Register.A),
+                           (Operations.mul_r, Register.B, Register.C),
+                           (Operations.mod_b, Register.B, 7),
+                           (Operations.push, Register.B),
+                           (Operations.pop, Register.A),
+                           (Operations.stw_r, Register.C, Register.A),
+                           (Operations.rand,),
+                           (Operations.loop, subroutine),
+                           (Operations.ret,))
+
+        _, stats = self.assert_matches_interpreter(program, [b'a', b'', b'b', b'a'])
+        self.assertEqual('halted', stats[1].exit_reason.value)
+
+    def test_fault_skips_instruction_of_faulting_instance(self):
+        program = assemble((Operations._in,),
+                           # unaligned access for A = 1
+                           (Operations.lda_r, Register.B, Register.A),
+                           (Operations.add_b, Register.B, 2),
+                           (Operations.halt,))
+
+        self.assert_matches_interpreter(program, [b'\x00', b'\x01'])
+
+    def test_instruction_limit(self):
+        program = assemble((Operations.add_b, Register.A, 1),
+                           (Operations.jmp, 0))
+
+        machine, stats = self.assert_matches_interpreter(program, [b'', b''], halt_after_instructions=9)
+        self.assertEqual([9, 9], [s.instructions_executed for s in stats])
+        self.assertEqual(5, machine.registers(1).A)
+
+    def test_blit_and_fill(self):
+        program = assemble((Operations._in,),
+                           (Operations.movb_r2m, 0, Register.A),
+                           (Operations.movb_i2r, Register.B, 0),
+                           (Operations.movb_i2r, Register.C, 2),
+                           (Operations.blit, Register.B, Register.C),
+                           (Operations.fill, Register.A, Register.C),
+                           (Operations.halt,))
+
+        self.assert_matches_interpreter(program, [b'a', b'b'])
+
+    def test_bulk_memory_operations(self):
+        program = assemble((Operations._in,),
+                           (Operations.movb_i2r, Register.B, 3),
+                           (Operations.movb_i2r, Register.C, 4),
+                           (Operations.memset, Register.B, Register.A, Register.C),
+                           # out of range for A = 'b'
+                           (Operations.memcpy, Register.A, Register.B, Register.C),
+                           (Operations.memcmp, Register.A, Register.C, Register.C),
+                           (Operations.halt,))
+
+        machine, _ = self.assert_matches_interpreter(program, [b'\x00', b'\x01', b'b'])
+        # equal, greater, and flags left by in for the instance that faulted
+        self.assertEqual([1, 2, 2], [machine.registers(i).F for i in range(3)])
+
+    def test_word_loads_from_register_address(self):
+        program = assemble((Operations._in,),
+                           (Operations.movb_i2r, Register.C, 0),
+                           (Operations.stw_r, Register.C, Register.A),
+                           (Operations.ldw_r, Register.B, Register.C),
+                           (Operations.lpw_r, Register.C, Register.C),
+                           (Operations.halt,))
+
+        machine, _ = self.assert_matches_interpreter(program, [b'a', b'b'])
+        self.assertEqual([ord('a'), ord('b')], [machine.registers(i).B for i in range(2)])
+        self.assertEqual(program.get_fmt('w', 0), machine.registers(0).C)
+
+    def test_rejects_writable_program(self):
+        program = assemble((Operations.halt,))
+        blocks = self.memory_blocks(program)
+        blocks['ram'] = program
+        with self.assertRaises(ValueError):
+            LockstepMachine(blocks, 2)
+
+
+class ObjectLockstepMachineTest(LockstepMachineTest):
+    DTYPE = object
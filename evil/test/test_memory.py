@@ -0,0 +1,149 @@
+import os
+import tempfile
+import unittest
+from array import array
+
+from evil.endianness import Endianness
+from evil.memory import (Memory, ExtendableMemory, StrictlyAlignedMemory, DataType,
+                         MemoryAccessFault, PagedStorage, make_storage, map_file)
+
+
+class MemoryTest(unittest.TestCase):
+    def test_storage_fits_char_bit(self):
+        self.assertIsInstance(make_storage(8), bytearray)
+        self.assertEqual('H', make_storage(9).typecode)
+        self.assertEqual('I', make_storage(32).typecode)
+        self.assertIsInstance(make_storage(33), list)
+
+    def test_rejects_values_out_of_range(self):
+        with self.assertRaises(ValueError):
+            Memory(9, value=[1, 512])
+        with self.assertRaises(ValueError):
+            Memory(9, value=[-1])
+
+        mem = Memory(9, size=2)
+        with self.assertRaises(ValueError):
+            mem[0] = 512
+
+    def test_access_out_of_range_faults(self):
+        mem = Memory(9, size=8)
+        with self.assertRaises(MemoryAccessFault):
+            mem.set_fmt('w', 4, 1)
+        with self.assertRaises(MemoryAccessFault):
+            mem.get_fmt('w', -1)
+        self.assertEqual(8, len(mem))
+
+    def test_decoding_does_not_modify_memory(self):
+        for char_bit in (8, 9, 40):
+            mem = StrictlyAlignedMemory(char_bit, size=DataType.calcsize('w'))
+            mem.set_fmt('w', 0, -5, Endianness.Little)
+            data = list(mem)
+
+            self.assertEqual(-5, mem.get_fmt('w', 0, Endianness.Little))
+            self.assertEqual(data, list(mem))
+
+    def test_extendable_memory_grows(self):
+        mem = ExtendableMemory(9)
+        mem.append(600, DataType.from_fmt('w'), Endianness.Big)
+
+        frozen = mem.freeze()
+        self.assertEqual(DataType.calcsize('w'), len(frozen))
+        self.assertEqual(600, frozen.get_fmt('w', 0))
+        self.assertEqual(array('H', [0] * (DataType.calcsize('w') - 2) + [1, 600 - 512]),
+                         frozen._memory)
+
+
+class MappedFileTest(unittest.TestCase):
+    def test_contents_persist(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'ram')
+            mem = StrictlyAlignedMemory(9, storage=map_file(path, 9, 14))
+            mem.set_fmt('w', 7, -300)
+            self.assertEqual(14 * 2, os.path.getsize(path))
+            del mem
+
+            mem = StrictlyAlignedMemory(9, storage=map_file(path, 9, 14))
+            self.assertEqual(-300, mem.get_fmt('w', 7))
+            self.assertEqual(0, mem.get_fmt('w', 0))
+            with self.assertRaises(MemoryAccessFault):
+                mem.get_fmt('w', 14)
+
+
+class PagedStorageTest(unittest.TestCase):
+    def test_pages_are_allocated_on_write(self):
+        size = DataType.calcsize('w') * 2**40
+        storage = PagedStorage(9, size, page_bits=4)
+        mem = StrictlyAlignedMemory(9, storage=storage)
+        self.assertEqual(size, len(mem))
+        self.assertEqual(0, mem.get_fmt('w', size - 7))
+        self.assertEqual(0, storage.num_pages)
+
+        mem.set_fmt('w', size - 7, -300)
+        mem[3] = 511
+        self.assertEqual(-300, mem.get_fmt('w', size - 7))
+        self.assertEqual(511, mem[3])
+        self.assertEqual(2, storage.num_pages)
+
+    def test_access_across_pages(self):
+        for char_bit in (8, 9, 40):
+            storage = PagedStorage(char_bit, 40, page_bits=3)
+            mem = Memory(char_bit, storage=storage)
+            mem.set_fmt('w', 5, 2**(char_bit * 4) + 3)
+            self.assertEqual(2**(char_bit * 4) + 3, mem.get_fmt('w', 5))
+            self.assertEqual(2, storage.num_pages)
+
+            expected = [0] * 40
+            expected[5:12] = mem.get_bytes(5, 7)
+            self.assertEqual(expected, list(mem))
+            self.assertEqual(expected[6:30], list(mem[6:30]))
+
+    def test_access_out_of_range_faults(self):
+        mem = StrictlyAlignedMemory(9, storage=PagedStorage(9, 21, page_bits=4))
+        with self.assertRaises(MemoryAccessFault):
+            mem.get_fmt('w', 21)
+        with self.assertRaises(MemoryAccessFault):
+            mem.set_fmt('w', 21, 1)
+        with self.assertRaises(MemoryAccessFault):
+            mem[-1]
+        with self.assertRaises(MemoryAccessFault):
+            mem[21] = 1
+
+    def test_fork_copies_pages_on_write(self):
+        storage = PagedStorage(9, 64, page_bits=4)
+        parent = StrictlyAlignedMemory(9, storage=storage)
+        parent[0] = 1
+        parent[16] = 2
+
+        child = parent.fork()
+        child[0] = 3
+        parent[40] = 4
+        self.assertEqual([1, 2, 4], [parent[0], parent[16], parent[40]])
+        self.assertEqual([3, 2, 0], [child[0], child[16], child[40]])
+
+        parent[16] = 5
+        self.assertEqual(2, child[16])
+        self.assertEqual(5, parent[16])
+
+
+class ForkTest(unittest.TestCase):
+    def test_fork_is_independent(self):
+        for char_bit in (8, 9, 40):
+            parent = StrictlyAlignedMemory(char_bit, size=DataType.calcsize('w') * 2)
+            parent.set_fmt('w', 0, 300)
+            listener_calls = []
+            parent.add_write_listener(lambda addr, size: listener_calls.append(addr))
+
+            child = parent.fork()
+            self.assertIsInstance(child, StrictlyAlignedMemory)
+            child.set_fmt('w', 0, -300)
+            self.assertEqual(300, parent.get_fmt('w', 0))
+            self.assertEqual(-300, child.get_fmt('w', 0))
+            self.assertEqual([], listener_calls)
+
+    def test_fork_of_mapped_file_stays_in_process(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'ram')
+            parent = StrictlyAlignedMemory(9, storage=map_file(path, 9, 14))
+            child = parent.fork()
+            child.set_fmt('w', 7, 5)
+            self.assertEqual(0, parent.get_fmt('w', 7))
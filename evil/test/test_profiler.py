@@ -0,0 +1,51 @@
+import io
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+from evil.cpu import CPU, Operations, Register
+from evil.memory import Memory, DataType
+from evil.profiler import Profile, ProfilingInterpreter
+from evil.test.test_cpu import CHAR_BIT, assemble, offset_of
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        loop_start = offset_of((Operations.movb_i2r,))
+        program = assemble((Operations.movb_i2r, Register.C, 5),
+                           (Operations.add_b, Register.A, 3),
+                           (Operations.loop, loop_start),
+                           (Operations.halt,))
+
+        self.profile = Profile()
+        CPU().execute(program=program,
+                      ram=Memory(CHAR_BIT, size=DataType.calcsize('w')),
+                      stack=Memory(CHAR_BIT, size=DataType.calcsize('a')),
+                      input=None,
+                      halt_after_instructions=100,
+                      engine=lambda cpu: ProfilingInterpreter(cpu, self.profile))
+
+    def test_counts(self):
+        self.assertEqual(12, self.profile.instructions_executed)
+        self.assertEqual({'movb.i2r': 1, 'add.b': 5, 'loop': 5, 'halt': 1},
+                         {e.mnemonic: e.count for e in self.profile.by_mnemonic()})
+        self.assertEqual([1, 5, 5, 1],
+                         [e.count for e in sorted(self.profile.by_ip(), key=lambda e: e.key)])
+
+    def test_json(self):
+        outfile = io.StringIO()
+        self.profile.write_json(outfile)
+
+        result = json.loads(outfile.getvalue())
+        self.assertEqual(12, result['instructions_executed'])
+        self.assertEqual(4, len(result['by_ip']))
+
+    def test_pstats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'profile')
+            self.profile.dump_stats(path, program_name='test.asm')
+            stats = pstats.Stats(path, stream=io.StringIO())
+
+        self.assertEqual(12, stats.total_calls)
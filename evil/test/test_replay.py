@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from evil.cpu import CPU, Operations, Register
+from evil.input import ScriptedInput
+from evil.jit import BlockEngine
+from evil.memory import StrictlyAlignedMemory, DataType
+from evil.replay import (EventKind, Recording, RecordingInput, RecordingRandom,
+                         ReplayError, ReplayInput, ReplayRandom)
+from evil.test.test_cpu import CHAR_BIT, assemble
+
+
+class RecordingTest(unittest.TestCase):
+    def test_save_load(self):
+        recording = Recording(instructions_executed=1000)
+        recording.add(3, EventKind.INPUT, 27)
+        recording.add(3, EventKind.RANDOM, 2**40)
+        recording.add(900, EventKind.INPUT, -1)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'recording')
+            recording.save(path)
+            loaded = Recording.load(path)
+
+        self.assertEqual(1000, loaded.instructions_executed)
+        self.assertEqual(recording.events, loaded.events)
+
+
+class ReplayTest(unittest.TestCase):
+    ENGINE = None
+
+    PROGRAM = [(Operations._in,),
+               (Operations.add_r, Register.B, Register.A),
+               (Operations.rand,),
+               (Operations.add_r, Register.C, Register.A),
+               (Operations.jmp, 0)]
+
+    def execute(self, cpu, program, input, halt_after_instructions=100):
+        ram = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8)
+        stack = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('a') * 8)
+        with input:
+            cpu.execute(program=program, ram=ram, stack=stack, input=input,
+                        halt_after_instructions=halt_after_instructions,
+                        engine=self.ENGINE)
+
+    def record(self) -> (CPU, Recording):
+        cpu = CPU()
+        cpu.rng.seed(1)
+        recording = Recording()
+        cpu.rng = RecordingRandom(cpu.rng, cpu, recording)
+        self.execute(cpu, assemble(*self.PROGRAM), RecordingInput(ScriptedInput(b'abc'), cpu, recording))
+        recording.instructions_executed = cpu.instructions_executed
+        return cpu, recording
+
+    def test_replay(self):
+        recorded, recording = self.record()
+
+        cpu = CPU()
+        cpu.rng = ReplayRandom(cpu, recording)
+        self.execute(cpu, assemble(*self.PROGRAM), ReplayInput(cpu, recording),
+                     halt_after_instructions=recording.instructions_executed)
+
+        self.assertEqual(list(recorded.regs), list(cpu.regs))
+
+    def test_divergence(self):
+        _, recording = self.record()
+
+        cpu = CPU()
+        cpu.rng = ReplayRandom(cpu, recording)
+        program = assemble((Operations.add_b, Register.A, 1), *self.PROGRAM)
+        with self.assertRaises(ReplayError):
+            self.execute(cpu, program, ReplayInput(cpu, recording))
+
+
+class BlockEngineReplayTest(ReplayTest):
+    ENGINE = BlockEngine
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from evil import snapshot
+from evil.cpu import CPU, Operations, Register
+from evil.gpu import NullGPU
+from evil.machine import MachineConfig
+from evil.memory import StrictlyAlignedMemory, DataType
+from evil.test.test_cpu import CHAR_BIT, assemble
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'snapshot')
+
+        self.config = MachineConfig(char_bit=CHAR_BIT, map_memory=['stack=ram'])
+        self.program = assemble((Operations.add_b, Register.A, 1),
+                                (Operations.out,),
+                                (Operations.flip,),
+                                (Operations.jmp, 0))
+        self.ram = StrictlyAlignedMemory(CHAR_BIT, size=DataType.calcsize('w') * 8)
+        self.ram[3] = 2**CHAR_BIT - 1
+        self.memory_blocks = {'program': self.program, 'ram': self.ram, 'stack': self.ram}
+
+    def execute(self, cpu, memory_blocks, gpu, halt_after_instructions, resume=False):
+        cpu.execute(program=memory_blocks['program'],
+                    ram=memory_blocks['ram'],
+                    stack=memory_blocks['stack'],
+                    input=None,
+                    halt_after_instructions=halt_after_instructions,
+                    gpu=gpu,
+                    resume=resume)
+
+    def test_save_load(self):
+        cpu = CPU()
+        self.execute(cpu, self.memory_blocks, NullGPU(width=4, height=2), halt_after_instructions=10)
+        snapshot.save(self.path, cpu, self.config, self.memory_blocks)
+
+        saved = snapshot.load(self.path, gpu_factory=NullGPU)
+
+        self.assertEqual(self.config.char_bit, saved.config.char_bit)
+        self.assertEqual(list(cpu.regs), saved.registers)
+        self.assertEqual(list(self.program), list(saved.memory_blocks['program']))
+        self.assertEqual(list(self.ram), list(saved.memory_blocks['ram']))
+        self.assertIsInstance(saved.memory_blocks['ram'], StrictlyAlignedMemory)
+        self.assertIs(saved.memory_blocks['ram'], saved.memory_blocks['stack'])
+        self.assertEqual(cpu.gpu.dump(), saved.gpu.dump())
+
+    def test_load_clears_ram_file(self):
+        cpu = CPU()
+        self.execute(cpu, self.memory_blocks, NullGPU(width=4, height=2), halt_after_instructions=10)
+        snapshot.save(self.path, cpu, self.config._replace(ram_file=self.path + '.ram'), self.memory_blocks)
+
+        saved = snapshot.load(self.path, gpu_factory=NullGPU)
+
+        self.assertIsNone(saved.config.ram_file)
+        self.assertEqual(list(self.ram), list(saved.memory_blocks['ram']))
+
+    def test_resume(self):
+        cpu = CPU()
+        self.execute(cpu, self.memory_blocks, NullGPU(width=4, height=2), halt_after_instructions=10)
+        snapshot.save(self.path, cpu, self.config, self.memory_blocks)
+
+        saved = snapshot.load(self.path, gpu_factory=NullGPU)
+        resumed = CPU()
+        resumed.regs[:] = saved.registers
+        self.execute(resumed, saved.memory_blocks, saved.gpu, halt_after_instructions=10, resume=True)
+
+        self.assertEqual(5, resumed.registers.A)
+        self.assertEqual([1, 2, 3, 4, 5, 0], resumed.gpu.save_state().front[:6])
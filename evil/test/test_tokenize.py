@@ -45,3 +45,20 @@ class TokenizeTest(unittest.TestCase):
         self.assertEqual(['>>'], tokenize('>>'))
         self.assertEqual(['<<', '<'], tokenize('<<<'))
         self.assertEqual(['>>', '>>', '>'], tokenize('>>>>>'))
+
+    def test_identifiers_do_not_start_with_underscore_or_dot(self):
+        self.assertEqual(['.', 'foo_bar.baz', '_', 'qux'], tokenize('.foo_bar.baz _qux'))
+
+    def test_backslash_at_end_of_unclosed_quote(self):
+        self.assertEqual(['"foo\\'], tokenize('"foo\\'))
+        self.assertEqual(['"0xff\\n"', ',', '1'], tokenize('"0xff\\n", 1'))
+
+    def test_positions(self):
+        tokens = tokenize('foo "bar\nbaz" qux\n  <<')
+        self.assertEqual(['foo', '"bar\nbaz"', 'qux', '<<'], tokens)
+        self.assertEqual([(1, 1), (1, 5), (2, 6), (3, 3)],
+                         [(tok.line, tok.column) for tok in tokens])
+
+    def test_invalid_character(self):
+        with self.assertRaisesRegex(ValueError, 'line 2, column 3'):
+            tokenize('foo\nb \x00')
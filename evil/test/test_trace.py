@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from evil.cpu import CPU, Operations, Register, make_register_file
+from evil.trace import Tracer, TracingInterpreter, format_record, render
+from evil.memory import Memory, DataType
+from evil.test.test_cpu import CHAR_BIT, assemble, offset_of
+
+
+class TracerTest(unittest.TestCase):
+    def run_traced(self, program: Memory, capacity: int, halt_after_instructions: int) -> Tracer:
+        tracer = Tracer(capacity)
+        cpu = CPU()
+        cpu.execute(program=program,
+                    ram=Memory(CHAR_BIT, size=DataType.calcsize('w')),
+                    stack=Memory(CHAR_BIT, size=DataType.calcsize('a')),
+                    input=None,
+                    halt_after_instructions=halt_after_instructions,
+                    engine=lambda cpu: TracingInterpreter(cpu, tracer))
+        return tracer
+
+    def test_keeps_last_instructions(self):
+        program = assemble((Operations.add_b, Register.A, 1),
+                           (Operations.jmp, 0))
+
+        records = list(self.run_traced(program, capacity=3, halt_after_instructions=10))
+
+        self.assertEqual([Operations.jmp.opcode, Operations.add_b.opcode, Operations.jmp.opcode],
+                         [r.opcode for r in records])
+        self.assertEqual([Register.A.value, 1], records[1].args)
+        self.assertIn((Register.A, 5), records[1].register_deltas)
+
+    def test_format_matches_bytecode(self):
+        program = assemble((Operations.movw_i2r, Register.B, 300),
+                           (Operations.halt,))
+
+        record = list(self.run_traced(program, capacity=4, halt_after_instructions=10))[0]
+
+        size = offset_of((Operations.movw_i2r,))
+        byte_fmt = '%03x'
+        self.assertEqual('00000000  movw.i2r 5, 300               %s'
+                         % ' '.join(byte_fmt % b for b in program[0:size]),
+                         format_record(record, CHAR_BIT))
+
+    def test_save_load(self):
+        tracer = Tracer(2)
+        regs_before = make_register_file()
+        regs_after = make_register_file()
+        regs_after[Register.C.value] = 2**70
+
+        tracer.record(4, Operations.loop, [8], regs_before, regs_after, faulted=True)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'trace')
+            tracer.save(path, char_bit=CHAR_BIT)
+            loaded, char_bit = Tracer.load(path)
+
+        self.assertEqual(CHAR_BIT, char_bit)
+        self.assertEqual(list(tracer), list(loaded))
+        self.assertEqual(1, len(list(render(loaded, char_bit, last=1))))
+        self.assertTrue(list(loaded)[0].faulted)
@@ -0,0 +1,261 @@
+"""
+Execution tracing: a binary ring buffer of recently executed instructions
+and a tool that renders it as text.
+
+    python3 -m evil.trace TRACE_FILE [--last N] [--registers]
+"""
+
+import argparse
+import array
+import struct
+import sys
+import logging
+from typing import List, Iterator, NamedTuple, Optional, Tuple
+
+from evil.cpu import CPU, Interpreter, Operation, Register, REG_IP
+from evil.endianness import bytes_from_value
+from evil.memory import DataType
+from evil.fault import Fault
+
+
+def _to_int64(value: int) -> int:
+    """ Truncates VALUE to a signed 64-bit integer """
+    return ((value + 2**63) % 2**64) - 2**63
+
+
+class TraceRecord(NamedTuple):
+    ip: int
+    opcode: int
+    args: List[int]
+    faulted: bool
+    # (Register, new value) for every register changed by the instruction
+    register_deltas: List[tuple]
+
+
+class Tracer:
+    """
+    Fixed-size ring buffer of binary instruction records.
+
+    Each record is a fixed number of signed 64-bit integers: IP, opcode,
+    max_args arguments, flags, bitmask of modified registers and values of
+    all registers after the instruction was executed. Values that do not fit
+    in 64 bits are truncated.
+    """
+    FLAG_FAULTED = 1
+
+    MAGIC = b'EVTR'
+    HEADER = struct.Struct('<4sHHHHHQQ')
+    VERSION = 1
+
+    def __init__(self,
+                 capacity: int,
+                 max_args: int = None):
+        if capacity < 1:
+            raise ValueError('invalid trace capacity: %d' % capacity)
+        if max_args is None:
+            max_args = max(len(op.arg_def) for op in CPU.OPERATIONS_BY_OPCODE.values())
+
+        self.capacity = capacity
+        self.max_args = max_args
+        self.record_size = 2 + max_args + 2 + len(Register)
+        # total number of recorded instructions, including overwritten ones
+        self.count = 0
+        self._records = array.array('q', bytes(8 * self.record_size * capacity))
+
+    def record(self,
+               ip: int,
+               op: Operation,
+               args: List[int],
+               regs_before: List[int],
+               regs_after: List[int],
+               faulted: bool):
+        offset = (self.count % self.capacity) * self.record_size
+        records = self._records
+
+        changed = 0
+        for idx in range(1, len(regs_after)):
+            if regs_before[idx] != regs_after[idx]:
+                changed |= 1 << idx
+
+        record = ([ip, op.opcode]
+                  + list(args) + [0] * (self.max_args - len(args))
+                  + [self.FLAG_FAULTED if faulted else 0, changed]
+                  + regs_after[1:])
+        try:
+            records[offset:offset + self.record_size] = array.array('q', record)
+        except OverflowError:
+            records[offset:offset + self.record_size] = \
+                    array.array('q', (_to_int64(v) for v in record))
+        self.count += 1
+
+    def __iter__(self) -> Iterator[TraceRecord]:
+        """ Yields recorded instructions, oldest first """
+        first = max(0, self.count - self.capacity)
+        for idx in range(first, self.count):
+            offset = (idx % self.capacity) * self.record_size
+            record = self._records[offset:offset + self.record_size]
+
+            op = CPU.OPERATIONS_BY_OPCODE.get(record[1])
+            num_args = len(op.arg_def) if op else 0
+            flags, changed = record[2 + self.max_args:4 + self.max_args]
+            regs = record[4 + self.max_args:]
+
+            yield TraceRecord(ip=record[0],
+                              opcode=record[1],
+                              args=list(record[2:2 + num_args]),
+                              faulted=bool(flags & self.FLAG_FAULTED),
+                              register_deltas=[(reg, regs[reg.value - 1])
+                                               for reg in Register.all()
+                                               if changed & (1 << reg.value)])
+
+    def save(self, path: str, char_bit: int):
+        """
+        Writes the buffer to PATH, along with machine configuration required
+        to render it.
+        """
+        records = array.array('q', self._records)
+        if sys.byteorder != 'little':
+            records.byteswap()
+
+        with open(path, 'wb') as outfile:
+            outfile.write(self.HEADER.pack(self.MAGIC, self.VERSION, char_bit,
+                                           DataType.calcsize('w'), DataType.calcsize('a'),
+                                           self.max_args, self.capacity, self.count))
+            outfile.write(records.tobytes())
+
+    @classmethod
+    def load(cls, path: str) -> Tuple['Tracer', int]:
+        """
+        Reads a buffer written by save(). Configures DataType sizes and
+        returns a (tracer, char_bit) tuple.
+        """
+        with open(path, 'rb') as infile:
+            header = infile.read(cls.HEADER.size)
+            (magic, version, char_bit, word_size, addr_size,
+             max_args, capacity, count) = cls.HEADER.unpack(header)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError('%s is not a trace file' % path)
+
+            tracer = cls(capacity, max_args)
+            tracer.count = count
+            tracer._records = array.array('q')
+            tracer._records.frombytes(infile.read())
+            if sys.byteorder != 'little':
+                tracer._records.byteswap()
+
+        DataType._TYPES['w'] = DataType(name='w', size_bytes=word_size, alignment=word_size)
+        DataType._TYPES['a'] = DataType(name='a', size_bytes=addr_size, alignment=addr_size)
+        return tracer, char_bit
+
+
+def format_record(record: TraceRecord, char_bit: int) -> str:
+    """
+    Formats a single TraceRecord as a line of text: address, mnemonic,
+    arguments and instruction bytecode.
+    """
+    op = CPU.OPERATIONS_BY_OPCODE.get(record.opcode)
+    if op is None:
+        return '%08x  ??? (opcode %d)' % (record.ip, record.opcode)
+
+    args_str = ', '.join(str(x) for x in record.args)
+
+    byte_fmt_len = len('%x' % 2**(char_bit - 1))
+    byte_fmt = '%0{0}x'.format(byte_fmt_len)
+    try:
+        bytecode = [op.opcode]
+        for fmt_c, arg in zip(op.arg_def, record.args):
+            bytecode += bytes_from_value(endianness=op.args_endianness,
+                                         value=arg,
+                                         char_bit=char_bit,
+                                         num_bytes=DataType.from_fmt(fmt_c).size_bytes)
+        bytecode_str = ' '.join(byte_fmt % b for b in bytecode)
+    except ValueError:
+        bytecode_str = '?'
+
+    return '%08x  %-8s %-20s %s' % (record.ip, op.mnemonic, args_str, bytecode_str)
+
+
+def render(tracer: Tracer,
+           char_bit: int,
+           last: Optional[int] = None,
+           registers: bool = False) -> Iterator[str]:
+    """ Yields text lines describing LAST (or all) records from TRACER """
+    records = list(tracer)
+    if last is not None:
+        records = records[-last:] if last > 0 else []
+
+    for record in records:
+        line = format_record(record, char_bit)
+        if record.faulted:
+            line += '  FAULT'
+        yield line
+
+        if registers:
+            for reg, value in record.register_deltas:
+                yield '%10s%s = %d (%x)' % ('', reg.name, value, value)
+
+
+class TracingInterpreter(Interpreter):
+    """ Interpreter that records every executed instruction into a Tracer """
+    def __init__(self, cpu: CPU, tracer: Tracer):
+        super().__init__(cpu)
+        self.tracer = tracer
+
+    def run(self, halt_after_instructions: Optional[int]):
+        cpu = self.cpu
+        regs = cpu.regs
+        decoded = cpu._decoded
+        frame_scheduler = cpu.frame_scheduler
+        record = self.tracer.record
+        instructions_executed = self.instructions_executed
+        next_frame_check = instructions_executed
+
+        try:
+            while (halt_after_instructions is None
+                   or instructions_executed < halt_after_instructions):
+                instructions_executed += 1
+                cpu.instructions_executed = instructions_executed
+                try:
+                    idx = regs[REG_IP]
+                    op, args, next_ip = decoded.get(idx) or cpu._decode(idx)
+                except Fault as err:
+                    logging.error(err)
+                else:
+                    regs_before = list(regs)
+                    faulted = False
+                    try:
+                        regs[REG_IP] = next_ip
+                        op.run(cpu, *args)
+                    except Fault as err:
+                        faulted = True
+                        logging.error(err)
+                    finally:
+                        record(idx, op, args, regs_before, regs, faulted)
+
+                if instructions_executed >= next_frame_check:
+                    next_frame_check = frame_scheduler.check(instructions_executed)
+        finally:
+            self.instructions_executed = instructions_executed
+
+
+def main():
+    parser = argparse.ArgumentParser('evil.trace',
+                                     description='Render an execution trace recorded with --trace.')
+    parser.add_argument(dest='trace_file',
+                        help='Trace file to render')
+    parser.add_argument('-n', '--last',
+                        type=int,
+                        default=None,
+                        help='Only show last LAST instructions')
+    parser.add_argument('-r', '--registers',
+                        action='store_true',
+                        help='Show register values modified by each instruction')
+    args = parser.parse_args()
+
+    tracer, char_bit = Tracer.load(args.trace_file)
+    for line in render(tracer, char_bit, last=args.last, registers=args.registers):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,9 @@
 Utility functions that do not fit elsewhere.
 """
 
-import itertools
+import re
 import string
-from typing import Sequence, Optional, List, T
+from typing import Iterator, Sequence, Optional, List, T
 
 def group(seq: Sequence[T],
           size: int,
@@ -62,63 +62,56 @@ def make_bytes_dump(data: List[int],
     return '\n'.join(lines_with_offsets)
 
 
-def tokenize(text: str) -> List[str]:
-    IDENTIFIER_CHARS = string.ascii_lowercase + string.ascii_uppercase + string.digits + '_.'
-
-    def parse_escape(text: str):
-        if not text:
-            return 0
-        if text[0] == 'x':
-            return 1 + parse_while_matches(text[1:], string.hexdigits)
-        return 1
-
-    def parse_quote(text: str, quote_char: str):
-        idx = 0
-        quote = ''
-        while idx < len(text):
-            size = 1
-            if text[idx] == '\\':
-                size += parse_escape(text[1:])
-                quote += text[idx:idx+size]
-            elif text[idx] == quote_char:
-                return quote + text[idx:idx+size], idx + size
-            else:
-                quote += text[idx]
-            idx += size
-
-        return quote, len(text)
-
-    def parse_while_matches(text: str, valid: str):
-        return len(list((itertools.takewhile(lambda c: c in valid, text))))
-
-    def parse_punctuation(text: str):
-        multichar_operators  = { '>>', '<<' }
-
-        for op in multichar_operators:
-            if text.startswith(op):
-                return op, len(op)
-
-        return text[0], 1
-
-    result = []
-    idx = 0
-    while idx < len(text):
-        size = 1
-        if text[idx] in ('"', "'"):
-            tok, tok_size = parse_quote(text[idx+1:], text[idx])
-            size += tok_size
-            result.append(text[idx] + tok)
-        elif text[idx] in string.punctuation:
-            tok, tok_size = parse_punctuation(text[idx:])
-            size = tok_size
-            result.append(tok)
-        elif text[idx] in IDENTIFIER_CHARS:
-            size += parse_while_matches(text[idx+1:], IDENTIFIER_CHARS)
-            result.append(text[idx:idx+size])
-        elif text[idx].isspace():
-            size += parse_while_matches(text[idx+1:], string.whitespace)
-        else:
-            raise ValueError('ಠ_ಠ: %s', text[idx])
-        idx += size
-
-    return result
+class Token(str):
+    """ A token of assembly source, along with its 1-based line and column """
+    __slots__ = ('line', 'column')
+
+    def __new__(cls, value: str, line: int = 1, column: int = 1):
+        token = super().__new__(cls, value)
+        token.line = line
+        token.column = column
+        return token
+
+
+_PUNCTUATION = string.punctuation.replace('"', '').replace("'", '')
+
+# Alternatives are tried in order: quotes, whitespace, operators,
+# punctuation (which includes '_' and '.', so identifiers never start with
+# them), identifiers and anything else, which is invalid. Quoted strings
+# may span lines, escape the next character with a backslash and be left
+# unclosed at the end of text.
+_TOKEN_RE = re.compile(r"""
+    (?P<quote>   "[^"\\]*(?:\\.?[^"\\]*)*"?
+               | '[^'\\]*(?:\\.?[^'\\]*)*'? )
+  | (?P<space> \s+ )
+  | (?P<operator> << | >> | [%s] )
+  | (?P<identifier> [A-Za-z0-9][A-Za-z0-9_.]* )
+  | (?P<invalid> . )
+""" % re.escape(_PUNCTUATION), re.VERBOSE | re.DOTALL)
+
+
+def iter_tokens(text: str) -> Iterator[Token]:
+    """
+    Splits TEXT into quoted strings, operators, punctuation and
+    identifiers, skipping whitespace, in a single pass.
+    """
+    line = 1
+    line_start = 0
+    for match in _TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        start = match.start()
+        if kind == 'invalid':
+            raise ValueError('unexpected character %r at line %d, column %d'
+                             % (match.group(), line, start - line_start + 1))
+        if kind != 'space':
+            yield Token(match.group(), line, start - line_start + 1)
+
+        if kind == 'space' or kind == 'quote':
+            newlines = text.count('\n', start, match.end())
+            if newlines:
+                line += newlines
+                line_start = text.rindex('\n', start, match.end()) + 1
+
+
+def tokenize(text: str) -> List[Token]:
+    return list(iter_tokens(text))